@@ -0,0 +1,205 @@
+"""
+Memoization of losses: scoring the same prediction on the same event again,
+eg. for constant predictors or when rerunning experiments, is looked up
+instead of solving another earth mover's distance problem.
+"""
+
+import hashlib
+import shelve
+import threading
+from collections import OrderedDict
+from typing import Any, Generic, List, Optional, Sequence
+
+import numpy as np
+from numpy import ndarray
+
+from petutils.experiment import Loss, X_contra, XT_contra, loss_batch
+
+
+def digest(obj: Any) -> str:
+    """
+    Stable hash of an object's contents: arrays by dtype, shape and bytes,
+    objects by their attributes, anything else by repr.
+    """
+
+    h = hashlib.blake2b(digest_size=16)
+
+    def update(value: Any):
+        if isinstance(value, ndarray):
+            h.update(value.dtype.str.encode())
+            h.update(repr(value.shape).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple)):
+            h.update(b"(")
+            for item in value:
+                update(item)
+            h.update(b")")
+        elif hasattr(value, "__slots__") or hasattr(value, "__dict__"):
+            h.update(value.__class__.__name__.encode())
+            for name in sorted(attributes(value)):
+                h.update(name.encode())
+                update(getattr(value, name))
+        else:
+            h.update(repr(value).encode())
+
+    update(obj)
+    return h.hexdigest()
+
+
+def attributes(obj: Any) -> List[str]:
+    names = list(getattr(obj, "__dict__", {}))
+    for cls in type(obj).__mro__:
+        names.extend(getattr(cls, "__slots__", ()))
+    return [name for name in names if hasattr(obj, name)]
+
+
+class CachedLoss(Generic[XT_contra, X_contra]):
+    """
+    Loss wrapper remembering the losses of the most recent size
+    (event, prediction) pairs in memory, and of all of them in a shelve
+    store if given.
+
+    Events are identified by their event_id attribute, eg. simplified.XT's,
+    or by the hash of their contents when they have none (event_id -1);
+    predictions by the hash of their contents.
+
+    Parameters
+    ----------
+
+    loss : Loss
+        loss to cache
+    size : int
+        number of losses kept in memory
+    store : str
+        filename of a shelve store keeping the losses between runs
+    namespace : str
+        prefix of the keys, by default the loss's class and settings; event ids
+        are only unique within a dataset, so stores shared by several datasets
+        need a namespace per dataset
+
+    The cache can be shared by threads, but the store can't be shared by
+    concurrent processes: copies of the cache sent to worker processes only
+    cache in memory.
+    """
+
+    def __init__(
+        self,
+        loss: Loss[XT_contra, X_contra],
+        size: int = 100000,
+        store: Optional[str] = None,
+        namespace: Optional[str] = None,
+    ):
+        self.wrapped = loss
+        self.size = size
+        self.memory: "OrderedDict[str, float]" = OrderedDict()
+        self.store = None if store is None else shelve.open(store)
+
+        if namespace is None:
+            namespace = "{0}{1}".format(
+                loss.__class__.__name__, sorted(getattr(loss, "__dict__", {}).items())
+            )
+        self.namespace = namespace
+
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+        # losses may be scored from threads, eg. by Runner.run_pipelined
+        self.lock = threading.Lock()
+
+    def key(self, xt: XT_contra, x: X_contra) -> str:
+        event_id = getattr(xt, "event_id", -1)
+        event = digest(xt) if event_id == -1 else str(event_id)
+        return "{0}/{1}/{2}".format(self.namespace, event, digest(x))
+
+    def lookup(self, key: str) -> Optional[float]:
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+
+            if self.store is not None and key in self.store:
+                loss = self.store[key]
+                self.remember(key, loss)
+                self.store_hits += 1
+                return loss
+
+            self.misses += 1
+            return None
+
+    def remember(self, key: str, loss: float):
+        """
+        Keep the loss in memory, evicting the least recently used one if
+        full; the caller holds the lock.
+        """
+
+        self.memory[key] = loss
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def add(self, key: str, loss: float):
+        with self.lock:
+            self.remember(key, loss)
+            if self.store is not None:
+                self.store[key] = loss
+
+    def loss(self, xt: XT_contra, x: X_contra) -> float:
+        key = self.key(xt, x)
+        loss = self.lookup(key)
+        if loss is None:
+            loss = float(self.wrapped.loss(xt, x))
+            self.add(key, loss)
+        return loss
+
+    def loss_batch(self, xts: Sequence[XT_contra], xs: Sequence[X_contra]) -> ndarray:
+        """
+        Losses of the pairs, computing the missing ones in one batch.
+        """
+
+        keys = [self.key(xt, x) for xt, x in zip(xts, xs)]
+        losses = np.zeros(len(keys))
+        missing = []
+        for i, key in enumerate(keys):
+            loss = self.lookup(key)
+            if loss is None:
+                missing.append(i)
+            else:
+                losses[i] = loss
+
+        if missing:
+            computed = loss_batch(
+                self.wrapped, [xts[i] for i in missing], [xs[i] for i in missing]
+            )
+            for i, loss in zip(missing, computed.tolist()):
+                losses[i] = loss
+                self.add(keys[i], loss)
+
+        return losses
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.store_hits + self.misses
+        return (self.hits + self.store_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        return "{0} hits, {1} store hits, {2} misses, {3:.1%} hit rate".format(
+            self.hits, self.store_hits, self.misses, self.hit_rate
+        )
+
+    def close(self):
+        with self.lock:
+            if self.store is not None:
+                self.store.close()
+                self.store = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["store"] = None
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
@@ -1,21 +1,27 @@
-from typing import NamedTuple
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import numpy as np
 import scipy.optimize
+import scipy.sparse
 import scipy.spatial
 from numpy import ndarray
+from scipy.sparse import spmatrix
 
 
 class LinProg(NamedTuple):
     """
-    Follows convention in https://docs.scipy.org/doc/scipy-1.1.0/reference/generated/scipy.optimize.linprog.html#scipy.optimize.linprog
+    Follows convention in https://docs.scipy.org/doc/scipy/reference/generated/scipy.optimize.linprog.html
+
+    The constraint matrices are scipy.sparse matrices; A_ub and b_ub are None
+    when there are no inequality constraints.
     """
 
     c: ndarray
-    A_ub: ndarray
-    b_ub: ndarray
-    A_eq: ndarray
+    A_ub: Optional[spmatrix]
+    b_ub: Optional[ndarray]
+    A_eq: spmatrix
     b_eq: ndarray
+    bounds: Tuple[float, Optional[float]] = (0, None)
 
     def solve_scipy(self):
         return scipy.optimize.linprog(
@@ -24,11 +30,12 @@ class LinProg(NamedTuple):
             b_eq=self.b_eq,
             A_ub=self.A_ub,
             b_ub=self.b_ub,
-            bounds=None,
+            bounds=self.bounds,
+            method="highs",
         )
 
 
-def emd(x, y, xy_dist):
+def emd(x, y, xy_dist, solver="transport"):
     """
     Calculates earth movers' distance between two densities x and y
 
@@ -41,6 +48,8 @@ def emd(x, y, xy_dist):
         1 - dimensional array of weights
     xy_dist : ndarray
         2 - dimensional array containing distances between x and y density coordinates
+    solver : str
+        name of the backend in SOLVERS used to solve the transportation problem
 
     Returns
     -------
@@ -50,8 +59,15 @@ def emd(x, y, xy_dist):
     ndarray
         moves required to move x onto y
 
-    This implementation doesn't exploit the sparsity in the A_eq matrix.
+    """
+
+    return SOLVERS[solver](x, y, xy_dist)
+
 
+def solve_linprog(x, y, xy_dist) -> Tuple[float, ndarray]:
+    """
+    Reference backend: solves the transportation problem as a general
+    linear program with scipy.optimize.linprog.
     """
 
     linprog = to_linprog(x, y, xy_dist)
@@ -60,6 +76,275 @@ def emd(x, y, xy_dist):
     return res["fun"], res["x"].reshape(xy_dist.shape)
 
 
+# number of cells priced at a time by solve_transport
+BLOCK_CELLS = 4096
+
+
+def solve_transport(x, y, xy_dist, max_iter=None) -> Tuple[float, ndarray]:
+    """
+    Exact backend: solves the transportation problem with the transportation
+    simplex method, which is the network simplex specialized to the complete
+    bipartite x / y graph.
+
+    The basis is a spanning tree of n + m - 1 cells of the flow matrix,
+    initialized with the matrix minimum rule. Each pivot picks a cell with
+    negative reduced cost, pushes flow around the cycle it closes in the tree
+    and updates the dual potentials of the subtree that gets reattached.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        1 - dimensional array of weights
+    y : ndarray
+        1 - dimensional array of weights
+    xy_dist : ndarray
+        2 - dimensional array containing distances between x and y density coordinates
+    max_iter : int
+        maximum number of pricing steps, defaults to a generous multiple of the problem size
+
+    Returns
+    -------
+
+    float
+        earth movers' distance
+    ndarray
+        moves required to move x onto y
+
+    """
+
+    tol = 1e-8
+
+    x = np.asarray(x, dtype="double")
+    y = np.asarray(y, dtype="double")
+    cost = np.asarray(xy_dist, dtype="double")
+
+    assert np.abs(x.sum() - y.sum()) < tol, "x and y must be close to avoid instability"
+    assert cost.shape == (x.shape[0], y.shape[0])
+
+    x_dim, y_dim = cost.shape
+
+    if max_iter is None:
+        max_iter = max(1000, 10 * x_dim * y_dim)
+
+    # reduced costs are only trusted to be negative beyond roundoff
+    cost_tol = 1e-12 * max(1.0, np.abs(cost).max())
+
+    # tree nodes are numbered with rows first: row i is node i and
+    # column j is node x_dim + j
+    flow, adj = _initial_basis(x, y, cost)
+    u, v, parent, depth = _potentials(cost, adj)
+
+    # partial pricing: scan the rows in blocks, entering the most negative
+    # cell of the first block that has one
+    block = max(1, min(x_dim, BLOCK_CELLS // y_dim))
+    start = 0
+    scanned = 0
+
+    for _ in range(max_iter):
+        rows = slice(start, start + block)
+        reduced = cost[rows] - u[rows, None] - v[None, :]
+        k = np.argmin(reduced)
+        r = reduced.flat[k]
+
+        if r >= -cost_tol:
+            scanned += reduced.shape[0]
+            if scanned >= x_dim:
+                return float(np.sum(flow * cost)), flow
+            start = start + block if start + block < x_dim else 0
+            continue
+
+        scanned = 0
+        i, j = divmod(int(k), y_dim)
+        i += start
+        col = x_dim + j
+
+        # cells along the tree path from column j to row i alternately lose
+        # and gain flow, starting with a loss at the cell adjacent to column j
+        nodes = _tree_path(col, i, parent, depth)
+        cells = [_cell(a, b, x_dim) for a, b in zip(nodes[:-1], nodes[1:])]
+        losing = cells[0::2]
+        gaining = cells[1::2]
+
+        losing_flows = [flow[cell] for cell in losing]
+        leave = int(np.argmin(losing_flows))
+        theta = losing_flows[leave]
+
+        for cell in losing:
+            flow[cell] -= theta
+        for cell in gaining:
+            flow[cell] += theta
+        flow[i, j] = theta
+        flow[losing[leave]] = 0.0
+
+        a, b = nodes[2 * leave], nodes[2 * leave + 1]
+        adj[a].remove(b)
+        adj[b].remove(a)
+        adj[i].add(col)
+        adj[col].add(i)
+
+        # removing the leaving edge detaches the subtree below it, which
+        # contains the column j end of the path when the leaving edge lies
+        # on the way up from column j
+        if parent[a] == b:
+            inner, outer = col, i
+        else:
+            inner, outer = i, col
+
+        subtree = _reattach(inner, outer, adj, parent, depth)
+        subtree_rows = [node for node in subtree if node < x_dim]
+        subtree_cols = [node - x_dim for node in subtree if node >= x_dim]
+
+        shift = r if inner == i else -r
+        u[subtree_rows] += shift
+        v[subtree_cols] -= shift
+
+    raise Exception("transportation simplex did not converge")
+
+
+def _cell(a: int, b: int, x_dim: int) -> Tuple[int, int]:
+    if a < x_dim:
+        return a, b - x_dim
+    else:
+        return b, a - x_dim
+
+
+def _initial_basis(x: ndarray, y: ndarray, cost: ndarray):
+    """
+    Initial basic feasible solution by the matrix minimum rule: visit cells by
+    increasing cost, shipping as much as possible through each. Every shipment
+    exhausts a row or a column, so the shipping cells form a forest; cheap
+    zero-flow cells then join it into a spanning tree of x_dim + y_dim - 1
+    cells, as degenerate problems (eg. zero weights) require.
+    """
+
+    x_dim, y_dim = cost.shape
+
+    supply = x.tolist()
+    demand = y.tolist()
+    rows_left = sum(1 for s in supply if s > 0)
+    cols_left = sum(1 for d in demand if d > 0)
+
+    flow = np.zeros((x_dim, y_dim))
+    adj: List[set] = [set() for _ in range(x_dim + y_dim)]
+
+    # union-find over the tree nodes to detect cycles when joining the forest
+    root = list(range(x_dim + y_dim))
+
+    def find(node):
+        while root[node] != node:
+            root[node] = root[root[node]]
+            node = root[node]
+        return node
+
+    def link(i, j):
+        adj[i].add(x_dim + j)
+        adj[x_dim + j].add(i)
+        root[find(i)] = find(x_dim + j)
+
+    order = np.argsort(cost, axis=None, kind="stable").tolist()
+    num_edges = 0
+
+    for k in order:
+        if rows_left == 0 or cols_left == 0:
+            break
+        i, j = divmod(k, y_dim)
+        if supply[i] > 0 and demand[j] > 0:
+            f = min(supply[i], demand[j])
+            flow[i, j] = f
+            supply[i] -= f
+            demand[j] -= f
+            rows_left -= supply[i] <= 0
+            cols_left -= demand[j] <= 0
+            link(i, j)
+            num_edges += 1
+
+    for k in order:
+        if num_edges == x_dim + y_dim - 1:
+            break
+        i, j = divmod(k, y_dim)
+        if find(i) != find(x_dim + j):
+            link(i, j)
+            num_edges += 1
+
+    return flow, adj
+
+
+def _potentials(cost: ndarray, adj: List[set]):
+    """
+    Dual potentials u, v with u[i] + v[j] == cost[i, j] on every basic cell,
+    plus parent and depth of every node, obtained by traversing the basis
+    tree from row 0.
+    """
+
+    x_dim, y_dim = cost.shape
+
+    parent = [-1] * (x_dim + y_dim)
+    depth = [0] * (x_dim + y_dim)
+    potential = [0.0] * (x_dim + y_dim)
+
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        for child in adj[node]:
+            if child != parent[node]:
+                i, j = _cell(node, child, x_dim)
+                potential[child] = cost[i, j] - potential[node]
+                parent[child] = node
+                depth[child] = depth[node] + 1
+                stack.append(child)
+
+    potentials = np.array(potential)
+    return potentials[:x_dim], potentials[x_dim:], parent, depth
+
+
+def _tree_path(a: int, b: int, parent: List[int], depth: List[int]) -> List[int]:
+    """
+    Nodes along the tree path from node a to node b, in order.
+    """
+
+    up_a = [a]
+    up_b = [b]
+    while depth[a] > depth[b]:
+        a = parent[a]
+        up_a.append(a)
+    while depth[b] > depth[a]:
+        b = parent[b]
+        up_b.append(b)
+    while a != b:
+        a = parent[a]
+        b = parent[b]
+        up_a.append(a)
+        up_b.append(b)
+
+    return up_a + up_b[-2::-1]
+
+
+def _reattach(
+    inner: int, outer: int, adj: List[set], parent: List[int], depth: List[int]
+) -> List[int]:
+    """
+    Hang the subtree containing inner from outer, updating parent and depth
+    of its nodes, and return them.
+    """
+
+    parent[inner] = outer
+    depth[inner] = depth[outer] + 1
+
+    subtree = [inner]
+    stack = [inner]
+    while stack:
+        node = stack.pop()
+        for child in adj[node]:
+            if child != parent[node]:
+                parent[child] = node
+                depth[child] = depth[node] + 1
+                subtree.append(child)
+                stack.append(child)
+
+    return subtree
+
+
 def to_linprog(x, y, xy_dist) -> LinProg:
     """
 
@@ -82,7 +367,9 @@ def to_linprog(x, y, xy_dist) -> LinProg:
     because of numerical instability in the scipy _presolve step when eliminating
     redundant constraints, so ensure sufficient precision
 
-    TODO: use sparse A_eq, A_ub matrices
+    The marginal constraints are built as a sparse matrix with two nonzeros
+    per variable and non-negativity is expressed through the bounds, so
+    memory grows with x_dim * y_dim instead of its square.
 
     """
 
@@ -96,30 +383,66 @@ def to_linprog(x, y, xy_dist) -> LinProg:
     x_dim = x.shape[0]
     y_dim = y.shape[0]
 
-    c = xy_dist.flatten()
+    # variable k = i * y_dim + j is the flow from x[i] to y[j]
+    rows = np.repeat(np.arange(x_dim), y_dim)
+    cols = np.tile(np.arange(y_dim), x_dim)
 
-    A_eq = []
-    b_eq = []
+    c = np.asarray(xy_dist, dtype="double").flatten()
+    A_eq = marginal_constraints(rows, cols, x_dim, y_dim)
+    b_eq = np.concatenate([x, y]).astype("double")
 
-    for i in range(x_dim):
-        constraint = np.zeros(xy_dist.shape)
-        constraint[i] = 1.0
-        A_eq.append(constraint.flatten())
-        b_eq.append(x[i])
+    return LinProg(c=c, A_ub=None, b_ub=None, A_eq=A_eq, b_eq=b_eq)
 
-    for i in range(y_dim):
-        constraint = np.zeros(xy_dist.shape)
-        constraint[:, i] = 1.0
-        A_eq.append(constraint.flatten())
-        b_eq.append(y[i])
 
-    A_ub = np.diag(-np.ones(x_dim * y_dim))
-    b_ub = np.zeros(x_dim * y_dim)
+def marginal_constraints(rows, cols, x_dim, y_dim) -> spmatrix:
+    """
+    Sparse equality constraints forcing the flows along the edges
+    (rows[k], cols[k]) to sum to the x weights (first x_dim constraints)
+    and to the y weights (last y_dim constraints).
 
-    return LinProg(c=c, A_ub=A_ub, b_ub=b_ub, A_eq=np.array(A_eq), b_eq=np.array(b_eq))
+    Parameters
+    ----------
+
+    rows : ndarray
+        1 - dimensional array with the x index of each edge
+    cols : ndarray
+        1 - dimensional array with the y index of each edge
+    x_dim : int
+        number of x weights
+    y_dim : int
+        number of y weights
+
+    Returns
+    -------
+
+    spmatrix
+        (x_dim + y_dim, rows.shape[0]) - shaped csr matrix with two nonzeros per column
 
+    """
+
+    num_edges = rows.shape[0]
+    edges = np.arange(num_edges)
+
+    return scipy.sparse.coo_matrix(
+        (
+            np.ones(2 * num_edges),
+            (np.concatenate([rows, x_dim + cols]), np.concatenate([edges, edges])),
+        ),
+        shape=(x_dim + y_dim, num_edges),
+    ).tocsr()
 
-def sparse_emd(x, x_points, y, y_points, p=2):
+
+def sparse_emd(
+    x,
+    x_points,
+    y,
+    y_points,
+    p=2,
+    solver=None,
+    fast_paths=True,
+    radius=None,
+    k=None,
+):
     """
     Calculates earth movers' distance between two densities x and y.
 
@@ -136,17 +459,783 @@ def sparse_emd(x, x_points, y, y_points, p=2):
         (y.shape[0], n) - shaped array of points
     p : int
         minkowski p-norm
+    solver : str
+        name of the backend in SOLVERS used to solve the transportation problem,
+        "transport" by default; pruned problems are linear programs over the
+        candidate edges, so with radius or k only "linprog" is allowed
+    fast_paths : bool
+        use closed_form_emd instead of the solver when it applies
+    radius : float
+        if given, only consider moves between points closer than radius, see pruned_emd
+    k : int
+        if given, only consider moves between k nearest neighbours, see pruned_emd
 
     Returns
     -------
 
     float
         earth movers' distance
-    ndarray
-        moves required to move x onto y
+    ndarray or spmatrix
+        moves required to move x onto y: a dense ndarray, or a scipy.sparse
+        coo_matrix if radius or k are given, whichever path computes it
 
     """
 
+    pruned = radius is not None or k is not None
+    if pruned and solver not in (None, "linprog"):
+        raise Exception("radius and k are only supported by the linprog solver")
+
+    if fast_paths:
+        res = closed_form_emd(x, x_points, y, y_points, p)
+        if res is not None:
+            if pruned:
+                return res[0], scipy.sparse.coo_matrix(res[1])
+            return res
+
+    if pruned:
+        return pruned_emd(x, x_points, y, y_points, p, radius, k)
+
     xy_dist = scipy.spatial.distance_matrix(x_points, y_points, p)
 
-    return emd(x, y, xy_dist)
+    return emd(x, y, xy_dist, solver or "transport")
+
+
+def closed_form_emd(x, x_points, y, y_points, p=2) -> Optional[Tuple[float, ndarray]]:
+    """
+    Calculates earth movers' distance without solving a transportation problem
+    in the special cases where it has a closed form:
+
+    * all of x or all of y is concentrated on a single point: every other
+      point moves straight there
+    * x and y are the same density: nothing moves
+    * points are 1 - dimensional: the monotone coupling matching the sorted
+      cumulative distributions is optimal
+
+    Parameters are the same as for sparse_emd.
+
+    Returns
+    -------
+
+    Optional[Tuple[float, ndarray]]
+        earth movers' distance and an optimal flow, or None if no special case applies
+
+    """
+
+    # constant used in scipy.optimize._remove_redundancy
+    tol = 1e-8
+
+    x = np.asarray(x, dtype="double")
+    y = np.asarray(y, dtype="double")
+
+    # same contract as the solvers, the closed forms assume balanced densities
+    assert np.abs(x.sum() - y.sum()) < tol, "x and y must be close to avoid instability"
+
+    if x.shape[0] == 1:
+        xy_dist = _minkowski(x_points, y_points, p)
+        return float(np.sum(y * xy_dist[0])), y[None, :].copy()
+
+    if y.shape[0] == 1:
+        xy_dist = _minkowski(x_points, y_points, p)
+        return float(np.sum(x * xy_dist[:, 0])), x[:, None].copy()
+
+    if (
+        x.shape == y.shape
+        and np.array_equal(x_points, y_points)
+        and np.array_equal(x, y)
+    ):
+        return 0.0, np.diag(x)
+
+    if x_points.shape[1] == 1:
+        return _monotone_emd(x, x_points[:, 0], y, y_points[:, 0])
+
+    return None
+
+
+def _minkowski(x_points, y_points, p) -> ndarray:
+    diff = x_points[:, None, :] - y_points[None, :, :]
+    return np.linalg.norm(diff, ord=p, axis=-1)
+
+
+def _monotone_emd(x, x_coords, y, y_coords) -> Tuple[float, ndarray]:
+    """
+    1 - dimensional earth movers' distance as the integral of the difference
+    between the quantile functions of x and y.
+    """
+
+    x_order = np.argsort(x_coords, kind="stable")
+    y_order = np.argsort(y_coords, kind="stable")
+
+    x_cdf = np.cumsum(x[x_order])
+    y_cdf = np.cumsum(y[y_order])
+
+    # between consecutive breakpoints both quantile functions are constant
+    breaks = np.union1d(x_cdf, y_cdf)
+    breaks = breaks[breaks <= min(x_cdf[-1], y_cdf[-1])]
+    mass = np.diff(breaks, prepend=0.0)
+    mid = breaks - mass / 2
+
+    x_idx = x_order[np.minimum(np.searchsorted(x_cdf, mid), x.shape[0] - 1)]
+    y_idx = y_order[np.minimum(np.searchsorted(y_cdf, mid), y.shape[0] - 1)]
+
+    flow = np.zeros((x.shape[0], y.shape[0]))
+    np.add.at(flow, (x_idx, y_idx), mass)
+
+    dist = np.sum(mass * np.abs(x_coords[x_idx] - y_coords[y_idx]))
+    return float(dist), flow
+
+
+def pruned_emd(
+    x, x_points, y, y_points, p=2, radius=None, k=None
+) -> Tuple[float, spmatrix]:
+    """
+    Calculates earth movers' distance between two densities x and y considering
+    only moves along candidate edges from candidate_edges, which keeps the
+    number of linear program variables proportional to the number of points
+    for spatially clustered densities.
+
+    If no flow along the candidate edges satisfies the marginals, radius and
+    k are doubled until one does, falling back to all edges.
+
+    The result is exact if the optimal flow only uses candidate edges and an
+    upper bound otherwise.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        1 - dimensional array of weights
+    x_points : ndarray
+        (x.shape[0], n) - shaped array of points
+    y : ndarray
+        1 - dimensional array of weights
+    y_points : ndarray
+        (y.shape[0], n) - shaped array of points
+    p : int
+        minkowski p-norm
+    radius : float
+        initial maximum length of a move, must be positive
+    k : int
+        initial number of nearest neighbours each point can move to or from,
+        at least 1
+
+    Returns
+    -------
+
+    float
+        earth movers' distance
+    spmatrix
+        moves required to move x onto y
+
+    """
+
+    # constant used in scipy.optimize._remove_redundancy
+    tol = 1e-8
+
+    x = np.asarray(x, dtype="double")
+    y = np.asarray(y, dtype="double")
+
+    assert np.abs(x.sum() - y.sum()) < tol, "x and y must be close to avoid instability"
+    assert radius is not None or k is not None
+    # the widening below only terminates from a positive radius or k
+    assert radius is None or radius > 0, "radius must be positive"
+    assert k is None or k >= 1, "k must be at least 1"
+
+    x_dim = x.shape[0]
+    y_dim = y.shape[0]
+
+    x_tree = scipy.spatial.cKDTree(x_points)
+    y_tree = scipy.spatial.cKDTree(y_points)
+
+    # any radius beyond this keeps every edge
+    points = np.concatenate([x_points, y_points])
+    diameter = np.linalg.norm(np.ptp(points, axis=0), ord=p)
+
+    while True:
+        exhaustive = (radius is not None and radius > diameter) or (
+            k is not None and k >= max(x_dim, y_dim)
+        )
+
+        if exhaustive:
+            rows = np.repeat(np.arange(x_dim), y_dim)
+            cols = np.tile(np.arange(y_dim), x_dim)
+            cost = _minkowski(x_points, y_points, p).flatten()
+        else:
+            rows, cols, cost = candidate_edges(x_tree, y_tree, p, radius, k)
+
+        res = edge_emd(x, y, rows, cols, cost)
+        if res is not None:
+            return res
+
+        assert not exhaustive, "no feasible flow along all edges"
+
+        radius = None if radius is None else 2 * radius
+        k = None if k is None else 2 * k
+
+
+def edge_emd(x, y, rows, cols, cost) -> Optional[Tuple[float, spmatrix]]:
+    """
+    Calculates earth movers' distance between two densities x and y allowing
+    moves only along the edges (rows[k], cols[k]).
+
+    Parameters
+    ----------
+
+    x : ndarray
+        1 - dimensional array of weights
+    y : ndarray
+        1 - dimensional array of weights
+    rows : ndarray
+        1 - dimensional array with the x index of each edge
+    cols : ndarray
+        1 - dimensional array with the y index of each edge
+    cost : ndarray
+        1 - dimensional array with the length of each edge
+
+    Returns
+    -------
+
+    Optional[Tuple[float, spmatrix]]
+        earth movers' distance and moves required to move x onto y,
+        or None if no flow along the edges moves x onto y
+
+    """
+
+    x_dim = x.shape[0]
+    y_dim = y.shape[0]
+
+    if rows.shape[0] == 0:
+        return None
+
+    linprog = LinProg(
+        c=cost,
+        A_ub=None,
+        b_ub=None,
+        A_eq=marginal_constraints(rows, cols, x_dim, y_dim),
+        b_eq=np.concatenate([x, y]).astype("double"),
+    )
+    res = linprog.solve_scipy()
+
+    if not res["success"]:
+        return None
+
+    flow = scipy.sparse.coo_matrix((res["x"], (rows, cols)), shape=(x_dim, y_dim))
+    return res["fun"], flow
+
+
+def candidate_edges(x_tree, y_tree, p=2, radius=None, k=None):
+    """
+    Sparse candidate moves between the points in two KD-trees: every pair
+    closer than radius, plus every pair where one point is among the k nearest
+    neighbours of the other.
+
+    Parameters
+    ----------
+
+    x_tree : scipy.spatial.cKDTree
+        x points
+    y_tree : scipy.spatial.cKDTree
+        y points
+    p : int
+        minkowski p-norm
+    radius : float
+        maximum distance between points, or None
+    k : int
+        number of nearest neighbours, or None
+
+    Returns
+    -------
+
+    ndarray
+        x index of each edge
+    ndarray
+        y index of each edge
+    ndarray
+        distance along each edge
+
+    """
+
+    x_dim = x_tree.n
+    y_dim = y_tree.n
+
+    rows = [np.zeros(0, dtype=int)]
+    cols = [np.zeros(0, dtype=int)]
+
+    if radius is not None:
+        pairs = x_tree.sparse_distance_matrix(
+            y_tree, radius, p=p, output_type="ndarray"
+        )
+        rows.append(pairs["i"])
+        cols.append(pairs["j"])
+
+    if k is not None:
+        _, nearest_y = y_tree.query(x_tree.data, k=[*range(1, min(k, y_dim) + 1)], p=p)
+        rows.append(np.repeat(np.arange(x_dim), nearest_y.shape[1]))
+        cols.append(nearest_y.flatten())
+
+        _, nearest_x = x_tree.query(y_tree.data, k=[*range(1, min(k, x_dim) + 1)], p=p)
+        rows.append(nearest_x.flatten())
+        cols.append(np.repeat(np.arange(y_dim), nearest_x.shape[1]))
+
+    edges = np.unique(np.concatenate(rows) * y_dim + np.concatenate(cols))
+    edge_rows, edge_cols = np.divmod(edges, y_dim)
+
+    diff = np.abs(x_tree.data[edge_rows] - y_tree.data[edge_cols])
+    cost = np.sum(diff**p, axis=-1) ** (1.0 / p)
+
+    return edge_rows, edge_cols, cost
+
+
+class Voxels(NamedTuple):
+    """
+    A density summed over the cells of a regular grid.
+
+    weights : ndarray
+        1 - dimensional array with the total weight in each occupied voxel
+    points : ndarray
+        (weights.shape[0], n) - shaped array with the weighted centroid of each voxel
+    labels : ndarray
+        1 - dimensional array with the voxel each original point falls in
+    keys : ndarray
+        (weights.shape[0], n) - shaped integer grid coordinates of each voxel
+    displacement : float
+        total weight times distance moved by snapping points to their centroids,
+        which bounds the earth movers' distance between the original and
+        voxelized densities
+    """
+
+    weights: ndarray
+    points: ndarray
+    labels: ndarray
+    keys: ndarray
+    displacement: float
+
+
+def voxelize(x, x_points, voxel_size, p=2) -> Voxels:
+    """
+    Sums the density x over the cells of a grid with spacing voxel_size;
+    a voxel_size of 0 leaves the density as is.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        1 - dimensional array of weights
+    x_points : ndarray
+        (x.shape[0], n) - shaped array of points
+    voxel_size : float
+        grid spacing
+    p : int
+        minkowski p-norm used to measure the displacement
+
+    Returns
+    -------
+
+    Voxels
+
+    """
+
+    x = np.asarray(x, dtype="double")
+
+    if voxel_size == 0:
+        return Voxels(x, x_points, np.arange(x.shape[0]), x_points, 0.0)
+
+    keys, labels = np.unique(
+        np.floor(x_points / voxel_size).astype(np.int64), axis=0, return_inverse=True
+    )
+    labels = labels.ravel()
+
+    num_voxels = labels.max() + 1
+    weights = np.bincount(labels, x, num_voxels)
+    counts = np.bincount(labels, minlength=num_voxels)
+
+    # voxels holding only zero weights fall back to the plain centroid
+    positive = weights > 0
+    points = np.empty((num_voxels, x_points.shape[1]))
+    for dim in range(x_points.shape[1]):
+        weighted = np.bincount(labels, x * x_points[:, dim], num_voxels)
+        plain = np.bincount(labels, x_points[:, dim], num_voxels)
+        points[:, dim] = np.where(
+            positive, weighted / np.where(positive, weights, 1), plain / counts
+        )
+
+    diff = np.abs(x_points - points[labels])
+    displacement = np.sum(x * np.sum(diff**p, axis=-1) ** (1.0 / p))
+
+    return Voxels(weights, points, labels, keys, float(displacement))
+
+
+class MultiscaleLevel(NamedTuple):
+    """
+    Summary of one level of multiscale_emd.
+
+    voxel_size : float
+        grid spacing, 0 for the original points
+    distance : float
+        earth movers' distance between the voxelized densities, restricted to
+        the neighbourhoods of the coarser level's flow (which can only
+        overestimate it)
+    bound : float
+        the earth movers' distance between the original densities is within
+        bound of the one between the voxelized densities
+    x_dim : int
+        number of x voxels
+    y_dim : int
+        number of y voxels
+    num_edges : int
+        number of candidate moves solved for
+    """
+
+    voxel_size: float
+    distance: float
+    bound: float
+    x_dim: int
+    y_dim: int
+    num_edges: int
+
+
+class MultiscaleResult(NamedTuple):
+    """
+    distance : float
+        earth movers' distance at the finest level
+    flow : spmatrix
+        moves required to move the x voxels onto the y voxels at the finest level
+    x_labels : ndarray
+        x voxel of each x point at the finest level
+    y_labels : ndarray
+        y voxel of each y point at the finest level
+    levels : List[MultiscaleLevel]
+        summary of each level, coarse to fine
+    """
+
+    distance: float
+    flow: spmatrix
+    x_labels: ndarray
+    y_labels: ndarray
+    levels: List[MultiscaleLevel]
+
+
+def multiscale_emd(
+    x, x_points, y, y_points, voxel_sizes, p=2, neighbourhood=1
+) -> MultiscaleResult:
+    """
+    Coarse to fine approximation of the earth movers' distance between two
+    densities x and y.
+
+    Both densities are voxelized at each of voxel_sizes in turn. The coarsest
+    problem is solved in full; each finer problem only considers moves between
+    voxels whose points lie in coarser voxels the previous level moved mass
+    between, which always admits a feasible flow.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        1 - dimensional array of weights
+    x_points : ndarray
+        (x.shape[0], n) - shaped array of points
+    y : ndarray
+        1 - dimensional array of weights
+    y_points : ndarray
+        (y.shape[0], n) - shaped array of points
+    voxel_sizes : Sequence[float]
+        decreasing grid spacings, end with 0 to finish on the original points
+    p : int
+        minkowski p-norm
+    neighbourhood : int
+        number of coarse voxels around each move considered at the next level;
+        larger is more accurate and slower
+
+    Returns
+    -------
+
+    MultiscaleResult
+
+    """
+
+    assert len(voxel_sizes) > 0
+    assert all(a > b for a, b in zip(voxel_sizes[:-1], voxel_sizes[1:]))
+
+    levels: List[MultiscaleLevel] = []
+    prev: Optional[Tuple[Voxels, Voxels, spmatrix]] = None
+
+    for voxel_size in voxel_sizes:
+        x_vox = voxelize(x, x_points, voxel_size, p)
+        y_vox = voxelize(y, y_points, voxel_size, p)
+        x_dim = x_vox.weights.shape[0]
+        y_dim = y_vox.weights.shape[0]
+
+        if prev is None:
+            rows = np.repeat(np.arange(x_dim), y_dim)
+            cols = np.tile(np.arange(y_dim), x_dim)
+        else:
+            rows, cols = _refined_edges(x_vox, y_vox, *prev, neighbourhood)
+
+        diff = np.abs(x_vox.points[rows] - y_vox.points[cols])
+        cost = np.sum(diff**p, axis=-1) ** (1.0 / p)
+
+        if prev is None:
+            distance, dense_flow = emd(
+                x_vox.weights, y_vox.weights, cost.reshape(x_dim, y_dim)
+            )
+            flow = scipy.sparse.coo_matrix(dense_flow)
+        else:
+            res = edge_emd(x_vox.weights, y_vox.weights, rows, cols, cost)
+            assert res is not None, "refined problem is feasible by construction"
+            distance, flow = res
+
+        bound = x_vox.displacement + y_vox.displacement
+        levels.append(
+            MultiscaleLevel(voxel_size, distance, bound, x_dim, y_dim, rows.shape[0])
+        )
+        prev = (x_vox, y_vox, flow)
+
+    return MultiscaleResult(distance, flow, x_vox.labels, y_vox.labels, levels)
+
+
+def _refined_edges(
+    x_vox: Voxels, y_vox: Voxels, x_prev: Voxels, y_prev: Voxels, flow, neighbourhood
+):
+    """
+    Pairs of voxels containing points in the neighbourhoods of coarse voxels
+    connected by flow, the neighbourhood of a coarse voxel being those within
+    neighbourhood grid steps of it in every direction.
+    """
+
+    def membership(vox: Voxels, prev: Voxels) -> spmatrix:
+        # (voxels, coarse voxels) - shaped, nonzero where they share a point
+        num_points = vox.labels.shape[0]
+        return scipy.sparse.coo_matrix(
+            (np.ones(num_points), (vox.labels, prev.labels)),
+            shape=(vox.weights.shape[0], prev.weights.shape[0]),
+        ).tocsr()
+
+    moved = scipy.sparse.csr_matrix(flow)
+    moved.data = (moved.data > 0).astype("double")
+    moved.eliminate_zeros()
+
+    def neighbours(prev: Voxels) -> spmatrix:
+        # (coarse voxels, coarse voxels) - shaped, nonzero within neighbourhood
+        tree = scipy.spatial.cKDTree(prev.keys)
+        near = tree.sparse_distance_matrix(tree, neighbourhood, p=np.inf).tocsr()
+        return near + scipy.sparse.eye(prev.keys.shape[0])
+
+    if neighbourhood > 0:
+        moved = neighbours(x_prev) @ moved @ neighbours(y_prev)
+
+    support = membership(x_vox, x_prev) @ moved @ membership(y_vox, y_prev).T
+    support = support.tocoo()
+
+    return support.row.astype(int), support.col.astype(int)
+
+
+class SinkhornResult(NamedTuple):
+    """
+    Solutions of a batch of entropic-regularized transportation problems.
+
+    distance : ndarray
+        (batch,) - shaped transport cost of each approximate flow
+    flow : ndarray
+        (batch, n, m) - shaped approximate flows, zero on padding
+    bound : ndarray
+        (batch,) - shaped a priori bound eps * log(n * m) on how far distance
+        can overestimate the exact earth movers' distance, n and m counting
+        the nonzero weights of each problem
+    marginal_error : ndarray
+        (batch,) - shaped L1 violation of the y marginals by the flows
+    num_iter : int
+        number of iterations performed
+    """
+
+    distance: ndarray
+    flow: ndarray
+    bound: ndarray
+    marginal_error: ndarray
+    num_iter: int
+
+
+# log weight given to padding by sinkhorn
+PAD_LOG_WEIGHT = 1e6
+
+
+def sinkhorn(x, y, xy_dist, eps=1e-2, max_iter=1000, tol=1e-9) -> SinkhornResult:
+    """
+    Approximates earth movers' distances for a batch of problems at once with
+    the log-domain stabilized Sinkhorn algorithm.
+
+    Problems of different sizes are padded to a common size with zero weights,
+    which don't take part in the solution.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        (batch, n) - shaped array of weights
+    y : ndarray
+        (batch, m) - shaped array of weights
+    xy_dist : ndarray
+        (batch, n, m) - shaped array containing distances between x and y density coordinates
+    eps : float
+        entropic regularization relative to the largest distance of each problem;
+        smaller is more accurate and slower to converge
+    max_iter : int
+        maximum number of iterations
+    tol : float
+        stop when the L1 violation of the y marginals is below tol for every problem
+
+    Returns
+    -------
+
+    SinkhornResult
+
+    """
+
+    x = np.asarray(x, dtype="double")
+    y = np.asarray(y, dtype="double")
+    cost = np.asarray(xy_dist, dtype="double")
+
+    assert x.ndim == 2 and y.ndim == 2
+    assert cost.shape == (x.shape[0], x.shape[1], y.shape[1])
+
+    x_mask = x > 0
+    y_mask = y > 0
+    mask = x_mask[:, :, None] & y_mask[:, None, :]
+
+    scale = np.where(mask, cost, 0).max(axis=(1, 2))
+    abs_eps = eps * np.where(scale > 0, scale, 1.0)
+    batch_eps = abs_eps[:, None, None]
+
+    # padding gets a finite but negligible log weight so that it never
+    # meets an infinity in the log-sum-exp reductions
+    log_x = np.log(np.where(x_mask, x, 1.0)) - np.where(x_mask, 0.0, PAD_LOG_WEIGHT)
+    log_y = np.log(np.where(y_mask, y, 1.0)) - np.where(y_mask, 0.0, PAD_LOG_WEIGHT)
+
+    f = np.zeros(x.shape)
+    g = np.zeros(y.shape)
+
+    num_iter = 0
+
+    while num_iter < max_iter:
+        g_lse = _logsumexp((f[:, :, None] - cost) / batch_eps + log_x[:, :, None], 1)
+        g = np.where(y_mask, -abs_eps[:, None] * g_lse, 0.0)
+
+        f_lse = _logsumexp((g[:, None, :] - cost) / batch_eps + log_y[:, None, :], 2)
+        f = np.where(x_mask, -abs_eps[:, None] * f_lse, 0.0)
+
+        num_iter += 1
+
+        if num_iter % 10 == 0 or num_iter == max_iter:
+            flow = _sinkhorn_flow(f, g, cost, batch_eps, log_x, log_y)
+            marginal_error = np.abs(flow.sum(axis=1) - y).sum(axis=1)
+            if np.all(marginal_error < tol):
+                break
+
+    flow = _sinkhorn_flow(f, g, cost, batch_eps, log_x, log_y)
+    marginal_error = np.abs(flow.sum(axis=1) - y).sum(axis=1)
+
+    distance = np.sum(flow * np.where(mask, cost, 0), axis=(1, 2))
+    bound = abs_eps * np.log(x_mask.sum(axis=1) * y_mask.sum(axis=1))
+
+    return SinkhornResult(distance, flow, bound, marginal_error, num_iter)
+
+
+def _logsumexp(a: ndarray, axis: int) -> ndarray:
+    a_max = a.max(axis=axis, keepdims=True)
+    return np.log(np.exp(a - a_max).sum(axis=axis)) + np.squeeze(a_max, axis=axis)
+
+
+def _sinkhorn_flow(f, g, cost, batch_eps, log_x, log_y) -> ndarray:
+    log_flow = (
+        (f[:, :, None] + g[:, None, :] - cost) / batch_eps
+        + log_x[:, :, None]
+        + log_y[:, None, :]
+    )
+    return np.where(log_flow > -PAD_LOG_WEIGHT / 2, np.exp(log_flow), 0.0)
+
+
+def sinkhorn_emd(x, x_points, y, y_points, p=2, **kwargs) -> SinkhornResult:
+    """
+    Batched version of sparse_emd using sinkhorn.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        (batch, n) - shaped array of weights
+    x_points : ndarray
+        (batch, n, k) - shaped array of points
+    y : ndarray
+        (batch, m) - shaped array of weights
+    y_points : ndarray
+        (batch, m, k) - shaped array of points
+    p : int
+        minkowski p-norm
+    kwargs
+        passed on to sinkhorn
+
+    Returns
+    -------
+
+    SinkhornResult
+
+    """
+
+    diff = np.abs(x_points[:, :, None, :] - y_points[:, None, :, :])
+    xy_dist = np.sum(diff**p, axis=-1) ** (1.0 / p)
+
+    return sinkhorn(x, y, xy_dist, **kwargs)
+
+
+def pad_batch(problems: Sequence[Tuple[ndarray, ndarray, ndarray, ndarray]]):
+    """
+    Stacks (x, x_points, y, y_points) problems of different sizes into the
+    arrays expected by sinkhorn_emd, padding with zero weights.
+
+    Parameters
+    ----------
+
+    problems : Sequence[Tuple[ndarray, ndarray, ndarray, ndarray]]
+        sparse_emd arguments for each problem
+
+    Returns
+    -------
+
+    Tuple[ndarray, ndarray, ndarray, ndarray]
+        stacked x, x_points, y, y_points
+
+    """
+
+    batch = len(problems)
+    x_dim = max(x.shape[0] for x, _, _, _ in problems)
+    y_dim = max(y.shape[0] for _, _, y, _ in problems)
+    point_dim = problems[0][1].shape[1]
+
+    xs = np.zeros((batch, x_dim))
+    x_points = np.zeros((batch, x_dim, point_dim))
+    ys = np.zeros((batch, y_dim))
+    y_points = np.zeros((batch, y_dim, point_dim))
+
+    for k, (x, x_pts, y, y_pts) in enumerate(problems):
+        xs[k, : x.shape[0]] = x
+        x_points[k, : x.shape[0]] = x_pts
+        ys[k, : y.shape[0]] = y
+        y_points[k, : y.shape[0]] = y_pts
+
+    return xs, x_points, ys, y_points
+
+
+def solve_sinkhorn(x, y, xy_dist) -> Tuple[float, ndarray]:
+    """
+    Approximate backend: sinkhorn with default settings on a single problem.
+    """
+
+    res = sinkhorn(x[None], y[None], xy_dist[None])
+    return float(res.distance[0]), res.flow[0]
+
+
+Solver = Callable[[ndarray, ndarray, ndarray], Tuple[float, ndarray]]
+
+SOLVERS: Dict[str, Solver] = {
+    "transport": solve_transport,
+    "linprog": solve_linprog,
+    "sinkhorn": solve_sinkhorn,
+}
@@ -0,0 +1,363 @@
+"""
+Compact per-event storage for the nexus tables: the columns are sorted once
+by event_id into contiguous arrays and an offsets array maps each event to
+its slice of rows, so an event's rows are views rather than separate objects.
+"""
+
+import os
+import sys
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame
+
+if TYPE_CHECKING:
+    from multiprocessing.shared_memory import SharedMemory
+
+
+class SharedArray(NamedTuple):
+    """
+    Picklable reference to an array in a shared memory block.
+    """
+
+    name: str
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+class SharedTable(NamedTuple):
+    columns: Dict[str, SharedArray]
+    event_ids: SharedArray
+    offsets: SharedArray
+
+
+# shared memory blocks mapped by this process, by name; they stay open while
+# tables or views of them may be alive; multiprocessing.shared_memory needs
+# python 3.8, so it's only imported when shared tables are used
+blocks: Dict[str, "SharedMemory"] = {}
+
+SHARED_MEMORY = sys.version_info >= (3, 8)
+
+
+def publish_array(arr: ndarray) -> SharedArray:
+    """
+    Copy arr into a new shared memory block.
+    """
+
+    from multiprocessing.shared_memory import SharedMemory
+
+    # zero sized blocks are not allowed
+    block = SharedMemory(create=True, size=max(arr.nbytes, 1))
+    blocks[block.name] = block
+
+    shared: ndarray = np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)
+    shared[...] = arr
+    return SharedArray(block.name, arr.dtype.str, arr.shape)
+
+
+def attach_array(ref: SharedArray) -> ndarray:
+    """
+    Read only view of an array published by publish_array.
+    """
+
+    from multiprocessing.shared_memory import SharedMemory
+
+    if ref.name not in blocks:
+        blocks[ref.name] = SharedMemory(name=ref.name)
+
+    buf = blocks[ref.name].buf
+    arr: ndarray = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=buf)
+    arr.flags.writeable = False
+    return arr
+
+
+def unlink_array(ref: SharedArray):
+    """
+    Free the shared memory block of an array published by publish_array;
+    memory mapped by other processes is released when they exit.
+    """
+
+    block = blocks.pop(ref.name)
+    block.unlink()
+    try:
+        block.close()
+    except BufferError:
+        # views are still alive, the mapping goes when they do
+        blocks[ref.name] = block
+
+
+class EventTable:
+    """
+    Columns of a table sorted by event_id, rows offsets[k]:offsets[k + 1]
+    belonging to event event_ids[k].
+
+    Parameters
+    ----------
+
+    columns : Dict[str, ndarray]
+        columns sorted by event_id, with the rows along the first axis
+    event_ids : ndarray
+        sorted unique event ids
+    offsets : ndarray
+        (event_ids.shape[0] + 1) - shaped array of row offsets
+    """
+
+    def __init__(
+        self, columns: Dict[str, ndarray], event_ids: ndarray, offsets: ndarray
+    ):
+        assert offsets.shape[0] == event_ids.shape[0] + 1
+        self.columns = columns
+        self.event_ids = event_ids
+        self.offsets = offsets
+
+        # set for tables in shared memory, which pickle as a reference to it
+        self.shared: Optional[SharedTable] = None
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, ndarray]) -> "EventTable":
+        """
+        Build the table from unsorted columns, one of which must be event_id.
+        """
+
+        order = np.argsort(columns["event_id"], kind="stable")
+        sorted_columns = {
+            name: np.ascontiguousarray(col[order]) for name, col in columns.items()
+        }
+
+        event_ids, starts = np.unique(sorted_columns["event_id"], return_index=True)
+        offsets = np.append(starts, order.shape[0])
+
+        return cls(sorted_columns, event_ids, offsets)
+
+    @classmethod
+    def from_dataframe(cls, df: DataFrame) -> "EventTable":
+        return cls.from_columns({name: df[name].to_numpy() for name in df.columns})
+
+    @classmethod
+    def from_records(cls, records: ndarray) -> "EventTable":
+        """
+        Build the table from a structured array such as an h5py table.
+        """
+
+        names = records.dtype.names or ()
+        return cls.from_columns({name: records[name] for name in names})
+
+    def save(self, directory: str):
+        """
+        Write the table to directory as one .npy file per array.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        save_columns(os.path.join(directory, "columns"), self.columns)
+        np.save(os.path.join(directory, "event_ids.npy"), self.event_ids)
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "EventTable":
+        """
+        Read a table written by save, memory-mapping the columns read-only
+        by default.
+        """
+
+        columns = load_columns(os.path.join(directory, "columns"), mmap)
+        event_ids = np.load(os.path.join(directory, "event_ids.npy"))
+        offsets = np.load(os.path.join(directory, "offsets.npy"))
+        return cls(columns, event_ids, offsets)
+
+    def to_shared(self) -> "EventTable":
+        """
+        Copy of the table in shared memory. Pickling it, eg. to send it to
+        worker processes, only transfers the names of the shared memory
+        blocks and unpickling attaches to them, so all processes read the
+        same arrays without copying them. The memory is freed by unlink.
+        Needs python 3.8.
+        """
+
+        if not SHARED_MEMORY:
+            raise Exception("shared memory tables need python 3.8 or later")
+
+        shared = SharedTable(
+            {
+                name: publish_array(np.ascontiguousarray(col))
+                for name, col in self.columns.items()
+            },
+            publish_array(self.event_ids),
+            publish_array(self.offsets),
+        )
+        return EventTable.attach(shared)
+
+    @classmethod
+    def attach(cls, shared: SharedTable) -> "EventTable":
+        """
+        Table over the shared memory of a table made by to_shared.
+        """
+
+        table = cls(
+            {name: attach_array(ref) for name, ref in shared.columns.items()},
+            attach_array(shared.event_ids),
+            attach_array(shared.offsets),
+        )
+        table.shared = shared
+        return table
+
+    def unlink(self):
+        """
+        Free the shared memory of a table made by to_shared, the table and
+        the tables attached to it can't be used afterwards.
+        """
+
+        assert self.shared is not None
+        shared = self.shared
+
+        # drop the views so the blocks can be closed
+        self.columns = {}
+        self.event_ids = self.offsets = np.zeros(0, dtype="int64")
+        self.shared = None
+
+        for ref in [*shared.columns.values(), shared.event_ids, shared.offsets]:
+            unlink_array(ref)
+
+    def __getstate__(self) -> dict:
+        if self.shared is not None:
+            return {"shared": self.shared}
+        return self.__dict__
+
+    def __setstate__(self, state: dict):
+        if "columns" not in state:
+            state = EventTable.attach(state["shared"]).__dict__
+        self.__dict__.update(state)
+
+    def __len__(self) -> int:
+        return self.event_ids.shape[0]
+
+    def position(self, event_id: int) -> int:
+        """
+        Position of the event in event_ids, -1 if absent; a binary search
+        rather than a per process index, so attaching to a shared table
+        costs nothing per event.
+        """
+
+        k = int(np.searchsorted(self.event_ids, event_id))
+        if k < self.event_ids.shape[0] and self.event_ids[k] == event_id:
+            return k
+        return -1
+
+    def __contains__(self, event_id: object) -> bool:
+        if not isinstance(event_id, (int, np.integer)):
+            return False
+        return self.position(int(event_id)) >= 0
+
+    def rows(self, event_id: int) -> slice:
+        k = self.position(event_id)
+        if k < 0:
+            raise KeyError(event_id)
+        return slice(self.offsets[k], self.offsets[k + 1])
+
+    def get(self, event_id: int) -> Dict[str, ndarray]:
+        """
+        Columns of the event as views into the table.
+        """
+
+        rows = self.rows(event_id)
+        return {name: col[rows] for name, col in self.columns.items()}
+
+    def __getitem__(self, event_id: int) -> DataFrame:
+        """
+        Rows of the event as a DataFrame, for tables with 1 - dimensional columns.
+        """
+
+        return DataFrame(self.get(event_id), copy=False)
+
+
+class SensorGeometry:
+    """
+    Sensor positions as a dense sensor_id -> (x, y, z) lookup array, so the
+    positions of the sensors in an event are resolved by fancy indexing
+    instead of denormalizing them onto every waveform row.
+
+    Parameters
+    ----------
+
+    sensor_ids : ndarray
+        (n,) - shaped array of non negative sensor ids
+    points : ndarray
+        (n, 3) - shaped array of sensor positions
+    """
+
+    def __init__(self, sensor_ids: ndarray, points: ndarray):
+        assert points.shape == (sensor_ids.shape[0], 3)
+        assert sensor_ids.shape[0] == 0 or np.min(sensor_ids) >= 0
+        self.sensor_ids = sensor_ids
+        self.points = points
+
+        # unknown sensor ids resolve to nan, like the join they replace; ids
+        # beyond the array are handled by lookup
+        size = int(np.max(sensor_ids)) + 1 if sensor_ids.shape[0] else 0
+        self.xyz = np.full((size, 3), np.nan)
+        self.xyz[sensor_ids] = points
+
+    @classmethod
+    def from_dataframe(cls, positions: DataFrame) -> "SensorGeometry":
+        """
+        Build the geometry from a sensor_positions DataFrame.
+        """
+
+        return cls(
+            positions["sensor_id"].to_numpy(),
+            positions[["x", "y", "z"]].to_numpy(dtype="double"),
+        )
+
+    def save(self, directory: str):
+        save_columns(directory, {"sensor_id": self.sensor_ids, "points": self.points})
+
+    @classmethod
+    def load(cls, directory: str) -> "SensorGeometry":
+        columns = load_columns(directory, mmap=False)
+        return cls(columns["sensor_id"], columns["points"])
+
+    def lookup(self, sensor_ids: ndarray) -> ndarray:
+        """
+        (n, 3) - shaped array of the positions of sensor_ids, nan for unknown ids
+        """
+
+        sensor_ids = np.asarray(sensor_ids)
+        known = (sensor_ids >= 0) & (sensor_ids < self.xyz.shape[0])
+        if np.all(known):
+            return self.xyz[sensor_ids]
+
+        # ids outside the lookup array are unknown too
+        points = np.full((*sensor_ids.shape, 3), np.nan)
+        points[known] = self.xyz[sensor_ids[known]]
+        return points
+
+    @property
+    def df(self) -> DataFrame:
+        df = DataFrame(self.points, columns=["x", "y", "z"])
+        df.insert(0, "sensor_id", self.sensor_ids)
+        return df
+
+
+def save_columns(directory: str, columns: Dict[str, ndarray]):
+    """
+    Write each column to directory as <name>.npy
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    for name, col in columns.items():
+        np.save(os.path.join(directory, name + ".npy"), col)
+
+
+def load_columns(directory: str, mmap: bool = True) -> Dict[str, ndarray]:
+    """
+    Read the columns written by save_columns, memory-mapping them read-only
+    by default.
+    """
+
+    columns = {}
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext == ".npy":
+            path = os.path.join(directory, filename)
+            columns[name] = np.load(path, mmap_mode="r" if mmap else None)
+    return columns
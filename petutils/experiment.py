@@ -1,10 +1,34 @@
-from collections import defaultdict
-from typing import Dict, Generic, List, NamedTuple, Sequence, Tuple, TypeVar
+import os
+import pickle
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from queue import Empty, Full, Queue
+from typing import (
+    ContextManager,
+    Deque,
+    Dict,
+    Generic,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
 import matplotlib.pyplot as plt
 import numpy as np
+from numpy import ndarray
 from typing_extensions import Protocol
 
+from petutils.instrument import Instrument, stage_name
+from petutils.results import ResultsWriter
+from petutils.stats import LossStats, Reservoir, Welford, z_score
+
 XT_co = TypeVar("XT_co", covariant=True)
 X_co = TypeVar("X_co", covariant=True)
 Y_co = TypeVar("Y_co", covariant=True)
@@ -51,6 +75,45 @@ class Predictor(Protocol[X_co, Y_contra]):
         pass
 
 
+class BatchPredictor(Predictor[X_co, Y_contra], Protocol[X_co, Y_contra]):
+    """
+    Predictors can optionally implement predict_batch to infer the causes of
+    many observations at once, Experiment uses it when present.
+    """
+
+    def predict_batch(self, ys: Sequence[Y_contra]) -> Sequence[X_co]:
+        """
+        Infer the causes of observations ys
+
+        Parameters
+        ----------
+
+        ys : Sequence[Y]
+            observations
+
+        Returns
+        -------
+
+        Sequence[X]
+            inferred cause of each observation
+
+        """
+        pass
+
+
+def predict_batch(predictor: Predictor[X_co, Y_contra], ys: Sequence) -> Sequence:
+    """
+    Predict many observations with predictor.predict_batch if available,
+    one by one otherwise.
+    """
+
+    if hasattr(predictor, "predict_batch"):
+        xs = predictor.predict_batch(ys)
+        assert len(xs) == len(ys)
+        return xs
+    return [predictor.predict(y) for y in ys]
+
+
 class Loss(Protocol[XT_contra, X_contra]):
     def loss(self, xt: XT_contra, x: X_contra) -> float:
         """
@@ -74,6 +137,45 @@ class Loss(Protocol[XT_contra, X_contra]):
         pass
 
 
+class BatchLoss(Loss[XT_contra, X_contra], Protocol[XT_contra, X_contra]):
+    """
+    Losses can optionally implement loss_batch to score many pairs at once,
+    Experiment uses it when present.
+    """
+
+    def loss_batch(self, xts: Sequence[XT_contra], xs: Sequence[X_contra]) -> ndarray:
+        """
+        Losses associated to predicting xs[i] given true values xts[i]
+
+        Parameters
+        ----------
+
+        xts: Sequence[XT]
+            true values
+        xs: Sequence[X]
+            inferred values
+
+        Returns
+        -------
+
+        ndarray
+            1 - dimensional array of losses
+
+        """
+        pass
+
+
+def loss_batch(loss: Loss[XT_contra, X_contra], xts: Sequence, xs: Sequence) -> ndarray:
+    """
+    Score many pairs with loss.loss_batch if available, one by one otherwise.
+    """
+
+    assert len(xts) == len(xs)
+    if hasattr(loss, "loss_batch"):
+        return np.asarray(loss.loss_batch(xts, xs))
+    return np.array([loss.loss(xt, x) for xt, x in zip(xts, xs)])
+
+
 XT = TypeVar("XT")
 X = TypeVar("X")
 Y = TypeVar("Y")
@@ -83,6 +185,10 @@ class Sample(NamedTuple, Generic[XT, X, Y]):
     xt: XT
     y: Y
     predictions: Sequence[Tuple[X, float]]
+    # id of the event if the simulator reports one, see Experiment.event_id
+    event_id: int = -1
+    # seconds spent predicting and scoring, per predictor
+    times: Sequence[float] = ()
 
 
 class Experiment(Generic[XT, X, Y]):
@@ -91,54 +197,760 @@ class Experiment(Generic[XT, X, Y]):
         sim: Simulator[XT, Y],
         predictors: Sequence[Predictor[X, Y]],
         loss: Loss[XT, X],
+        instrument: Optional[Instrument] = None,
     ):
         self.sim = sim
         self.predictors = predictors
         self.loss = loss
+        self.instrument = instrument
+
+    def event_id(self) -> int:
+        """
+        Id of the event the simulator samples next, for simulators which
+        implement an event_id method; -1 for others.
+        """
+
+        if hasattr(self.sim, "event_id"):
+            return self.sim.event_id()
+        return -1
 
     def sample(self) -> Sample:
+        if self.instrument is not None:
+            # same results, timed by stage
+            return self.sample_batch(1)[0]
+
+        event_id = self.event_id()
         xt, y = self.sim.sample()
         predictions: List[Tuple[X, float]] = []
+        times: List[float] = []
         for predictor in self.predictors:
+            start = time.perf_counter()
             x = predictor.predict(y)
             loss = self.loss.loss(xt, x)
+            times.append(time.perf_counter() - start)
             predictions.append((x, loss))
-        return Sample(xt, y, predictions)
+        return Sample(xt, y, predictions, event_id, times)
+
+    def batches(self) -> bool:
+        """
+        Whether the loss or any of the predictors implement batch methods.
+        """
+
+        return hasattr(self.loss, "loss_batch") or any(
+            hasattr(predictor, "predict_batch") for predictor in self.predictors
+        )
+
+    def simulate(self, num: int) -> Tuple[List[int], List[XT], List[Y]]:
+        """
+        Event ids, true causes and observations of num events.
+        """
+
+        start = time.perf_counter()
+
+        event_ids = []
+        xts = []
+        ys = []
+        for _ in range(num):
+            event_ids.append(self.event_id())
+            xt, y = self.sim.sample()
+            xts.append(xt)
+            ys.append(y)
+
+        if self.instrument is not None:
+            self.instrument.record("simulate", time.perf_counter() - start, num)
+        return event_ids, xts, ys
+
+    def predict(self, ys: Sequence[Y]) -> List[Tuple[Sequence[X], float]]:
+        """
+        Each predictor's predictions for ys and the seconds they took; a
+        single observation is predicted with predict, like sample does.
+        """
+
+        predictions = []
+        for predictor in self.predictors:
+            start = time.perf_counter()
+            if len(ys) == 1:
+                xs: Sequence[X] = [predictor.predict(ys[0])]
+            else:
+                xs = predict_batch(predictor, ys)
+            elapsed = time.perf_counter() - start
+            predictions.append((xs, elapsed))
+
+            if self.instrument is not None:
+                name = stage_name("predict", predictor)
+                self.instrument.record(name, elapsed, len(ys))
+        return predictions
+
+    def record_scores(self, scores: Sequence[Tuple[ndarray, float]]):
+        """
+        Report the times taken by score to the instrument, if any.
+        """
+
+        if self.instrument is not None:
+            for predictor, (losses, elapsed) in zip(self.predictors, scores):
+                name = stage_name("loss", predictor)
+                self.instrument.record(name, elapsed, losses.shape[0])
+
+    def sample_batch(self, num: int) -> List[Sample]:
+        """
+        Take num samples, making each predictor's predictions in one
+        predict_batch call and scoring them in one loss_batch call.
+        """
+
+        captured: ContextManager[List[int]]
+        if self.instrument is None:
+            captured = nullcontext([])
+        else:
+            captured = self.instrument.capture()
+
+        with captured as ids:
+            event_ids, xts, ys = self.simulate(num)
+            predictions = self.predict(ys)
+            scores = score(self.loss, xts, [xs for xs, _ in predictions])
+            self.record_scores(scores)
+            ids.extend(event_ids)
+
+        return make_samples(event_ids, xts, ys, predictions, scores)
+
+
+def score(
+    loss: Loss[XT_contra, X_contra], xts: Sequence, predictions: Sequence[Sequence]
+) -> List[Tuple[ndarray, float]]:
+    """
+    Losses of each predictor's predictions and the seconds they took to
+    compute; a single pair is scored with loss.loss, like Experiment.sample does.
+    """
+
+    scores = []
+    for xs in predictions:
+        start = time.perf_counter()
+        if len(xts) == 1:
+            losses = np.array([loss.loss(xts[0], xs[0])])
+        else:
+            losses = loss_batch(loss, xts, xs)
+        scores.append((losses, time.perf_counter() - start))
+    return scores
+
+
+def make_samples(
+    event_ids: Sequence[int],
+    xts: Sequence[XT],
+    ys: Sequence[Y],
+    predictions: Sequence[Tuple[Sequence[X], float]],
+    scores: Sequence[Tuple[ndarray, float]],
+) -> List[Sample]:
+    """
+    Samples from the outputs of Experiment.simulate, Experiment.predict and
+    score; batch times are split evenly between the samples.
+    """
+
+    num = len(xts)
+    samples = []
+    for i in range(num):
+        preds = [
+            (xs[i], float(losses[i]))
+            for (xs, _), (losses, _) in zip(predictions, scores)
+        ]
+        times = [
+            (predict_time + score_time) / num
+            for (_, predict_time), (_, score_time) in zip(predictions, scores)
+        ]
+        samples.append(Sample(xts[i], ys[i], preds, event_ids[i], times))
+    return samples
+
+
+# default number of samples per batch for experiments implementing batch methods
+BATCH_SIZE = 256
+
+# default number of samples per task in parallel runs
+CHUNK_SIZE = 256
+
+# default number of batches simulated ahead in pipelined runs
+PREFETCH = 4
+
+# default number of samples between checkpoints
+CHECKPOINT_EVERY = 10000
+
+
+def take_samples(
+    expt: Experiment[XT, X, Y], num: int, batch_size: Optional[int] = None
+) -> List[Sample]:
+    """
+    Take num samples, batch_size at a time; batches make use of
+    predictors implementing predict_batch and losses implementing
+    loss_batch. By default experiments using any of those are batched
+    and others are not.
+    """
+
+    if batch_size is None:
+        batch_size = BATCH_SIZE if expt.batches() else 1
+
+    samples: List[Sample] = []
+    while len(samples) < num:
+        size = min(batch_size, num - len(samples))
+        if size == 1:
+            samples.append(expt.sample())
+        else:
+            samples.extend(expt.sample_batch(size))
+    return samples
+
+
+def seed_chunk(seed: int, chunk: int):
+    """
+    Seed the global numpy and python generators with an independent stream
+    for each (seed, chunk) pair.
+    """
+
+    seq = np.random.SeedSequence([seed, chunk])
+    np.random.seed(seq.generate_state(4))
+    random.seed(int(seq.generate_state(1, np.uint64)[0]))
+
+
+# experiment of each worker process, set once by init_worker
+worker_expt: Optional[Experiment] = None
+
+
+def init_worker(expt: Experiment):
+    global worker_expt
+    worker_expt = expt
+
+
+def sample_chunk(
+    start: int, num: int, chunk: int, seed: int, batch_size: Optional[int]
+) -> List[Sample]:
+    """
+    Take samples start:start + num in a worker process; simulators that keep
+    their position in a cur attribute (eg. simplified.Simulator) are moved to
+    start first.
+    """
+
+    expt = worker_expt
+    assert expt is not None
+    if hasattr(expt.sim, "cur"):
+        setattr(expt.sim, "cur", start)
+
+    seed_chunk(seed, chunk)
+    return take_samples(expt, num, batch_size)
+
+
+def read_samples(filename: str, size: int) -> List[Sample]:
+    """
+    Samples appended to filename by Runner.save_checkpoint, up to its first
+    size bytes; anything after them was appended after the checkpoint and
+    is dropped from the file.
+    """
+
+    samples: List[Sample] = []
+    with open(filename, "r+b") as f:
+        f.truncate(size)
+        while f.tell() < size:
+            samples.extend(pickle.load(f))
+    return samples
+
+
+def remove_checkpoint(filename: str):
+    for name in [filename, filename + ".samples"]:
+        if os.path.exists(name):
+            os.remove(name)
 
 
 class Runner(Generic[XT, X, Y]):
-    def __init__(self, expt: Experiment[XT, X, Y]):
+    """
+    Runs an experiment and summarizes the losses of each predictor.
+
+    By default every sample is kept in samples. For long runs pass
+    keep_samples=False to only keep running loss statistics, plus a uniform
+    random subset of sample_reservoir samples if asked for.
+
+    Parameters
+    ----------
+
+    expt : Experiment
+        experiment to run
+    keep_samples : bool
+        whether to keep all the samples
+    sample_reservoir : int
+        if not keeping all samples, how many to keep
+    loss_reservoir : int
+        number of losses per predictor kept for plots and quantiles
+    hist_range : Tuple[float, float]
+        if given, also histogram the losses over this range
+    seed : int
+        seed for the reservoirs
+    results : ResultsWriter
+        if given, every sample's results are written to it
+    """
+
+    def __init__(
+        self,
+        expt: Experiment[XT, X, Y],
+        keep_samples: bool = True,
+        sample_reservoir: int = 0,
+        loss_reservoir: int = 10000,
+        hist_range: Optional[Tuple[float, float]] = None,
+        seed: Optional[int] = None,
+        results: Optional[ResultsWriter] = None,
+    ):
         self.expt = expt
+        self.results = results
+        self.keep_samples = keep_samples
+        self.sample_reservoir: Reservoir[Sample] = Reservoir(sample_reservoir, seed)
+
         self.samples: List[Sample] = []
+        if not keep_samples:
+            # filled in place by the reservoir
+            self.samples = self.sample_reservoir.items
 
-    def run(self, num: int):
-        for _ in range(num):
-            sample = self.expt.sample()
-            self.samples.append(sample)
+        # number of samples already appended to the checkpoint's samples file
+        self.saved_samples = 0
+
+        self.stats: Dict[str, LossStats] = {}
+        for name in self.names():
+            if name not in self.stats:
+                self.stats[name] = LossStats(loss_reservoir, hist_range, seed=seed)
+
+        # moments of the paired loss differences between predictors
+        self.differences: Dict[Tuple[str, str], Welford] = {
+            pair: Welford() for pair in self.pairs()
+        }
+
+    def names(self) -> List[str]:
+        return [pred.__class__.__name__ for pred in self.expt.predictors]
+
+    def pairs(self) -> List[Tuple[str, str]]:
+        names = sorted(set(self.names()))
+        return [(a, b) for i, a in enumerate(names) for b in names[i + 1 :]]
+
+    def running(self, num: int) -> ContextManager:
+        """
+        Context timing a run of num samples, if the experiment is instrumented.
+        """
+
+        if self.expt.instrument is None:
+            return nullcontext()
+        return self.expt.instrument.running(num)
+
+    def record(self, samples: List[Sample]):
+        """
+        Add samples to the statistics, keeping them as configured.
+        """
+
+        losses = {}
+        for i, name in enumerate(self.names()):
+            losses[name] = np.array([sample.predictions[i][1] for sample in samples])
+            self.stats[name].add_batch(losses[name])
+
+        for (a, b), moments in self.differences.items():
+            moments.add_batch(losses[a] - losses[b])
+
+        if self.results is not None:
+            self.results.write(samples)
+
+        if self.keep_samples:
+            self.samples.extend(samples)
+        else:
+            for sample in samples:
+                self.sample_reservoir.add(sample)
+
+    def run(
+        self,
+        num: int,
+        batch_size: Optional[int] = None,
+        checkpoint: Optional[str] = None,
+        checkpoint_every: int = CHECKPOINT_EVERY,
+    ):
+        """
+        Take num samples, see take_samples.
+
+        If a checkpoint filename is given the run's progress is saved to it
+        about every checkpoint_every samples, and a run interrupted after a
+        checkpoint continues from it when run is called again with the same
+        arguments, giving the same results as an uninterrupted run. The
+        checkpoint is removed when the run completes.
+        """
+
+        if batch_size is None:
+            batch_size = BATCH_SIZE if self.expt.batches() else 1
+
+        # record whole batches at a time, checkpointing between them
+        step = CHUNK_SIZE if checkpoint is None else min(CHUNK_SIZE, checkpoint_every)
+        step = batch_size * max(1, step // batch_size)
+
+        done = 0
+        if checkpoint is not None:
+            if os.path.exists(checkpoint):
+                done = self.restore(checkpoint)
+            else:
+                remove_checkpoint(checkpoint)
+                self.saved_samples = 0
+        saved = done
+
+        with self.running(num - done):
+            while done < num:
+                size = min(step, num - done)
+                self.record(take_samples(self.expt, size, batch_size))
+                done += size
+
+                if checkpoint is not None and done - saved >= checkpoint_every:
+                    self.save_checkpoint(checkpoint, done)
+                    saved = done
+
+        if checkpoint is not None:
+            remove_checkpoint(checkpoint)
+
+    def run_until(
+        self,
+        max_samples: int,
+        ci_width: Optional[float] = None,
+        resolve: bool = False,
+        confidence: float = 0.95,
+        min_samples: int = 100,
+        step: int = CHUNK_SIZE,
+        batch_size: Optional[int] = None,
+    ) -> str:
+        """
+        Take samples step at a time until the answer is known, at most
+        max_samples of them. Stopping is checked on all the samples recorded
+        so far, once there are at least min_samples, using normal
+        approximation confidence intervals.
+
+        Parameters
+        ----------
+
+        max_samples : int
+            maximum number of samples to take
+        ci_width : float
+            stop when the confidence intervals of all the predictors' mean
+            losses are narrower than this
+        resolve : bool
+            stop when the confidence intervals of the mean paired loss
+            differences between all pairs of predictors exclude 0, ie. when
+            the ranking of the predictors is known; the confidence is
+            Bonferroni corrected for the number of pairs
+        confidence : float
+            confidence level of the intervals
+        min_samples : int
+            number of samples before stopping is considered
+        step : int
+            number of samples between checks
+        batch_size : int
+            see take_samples
+
+        Returns
+        -------
+
+        str
+            why sampling stopped: "ci_width", "resolved" or "max_samples"
+        """
+
+        assert ci_width is not None or resolve, "no stopping criterion"
+
+        done = 0
+        while done < max_samples:
+            size = min(step, max_samples - done)
+            self.run(size, batch_size)
+            done += size
+
+            if min(stats.count for stats in self.stats.values()) < min_samples:
+                continue
+
+            if ci_width is not None and all(
+                2 * stats.moments.halfwidth(confidence) < ci_width
+                for stats in self.stats.values()
+            ):
+                return "ci_width"
+
+            if resolve and self.resolved(confidence):
+                return "resolved"
+
+        return "max_samples"
+
+    def resolved(self, confidence: float = 0.95) -> bool:
+        """
+        Whether the mean paired loss differences of all pairs of predictors
+        are significantly different from 0, with Bonferroni correction.
+        """
+
+        if not self.differences:
+            return True
+
+        corrected = 1 - (1 - confidence) / len(self.differences)
+        z = z_score(corrected)
+        return all(
+            abs(moments.mean) > z * moments.standard_error
+            for moments in self.differences.values()
+        )
+
+    def save_checkpoint(self, filename: str, done: int):
+        """
+        Atomically save the state needed to continue the run after done
+        samples: the simulator's cur position, the global random generators'
+        states and everything recorded so far. The rest of the experiment is
+        assumed to be stateless.
+
+        Kept samples are appended to filename + ".samples", so each
+        checkpoint only writes the samples taken since the previous one.
+        """
+
+        if self.results is not None:
+            self.results.flush()
+
+        samples_bytes = None
+        if self.keep_samples:
+            with open(filename + ".samples", "ab") as f:
+                pickle.dump(self.samples[self.saved_samples :], f)
+                f.flush()
+                os.fsync(f.fileno())
+                samples_bytes = f.tell()
+            self.saved_samples = len(self.samples)
+
+        state = {
+            "done": done,
+            "cur": getattr(self.expt.sim, "cur", None),
+            "np_random": np.random.get_state(),
+            "random": random.getstate(),
+            "samples_bytes": samples_bytes,
+            "sample_reservoir": self.sample_reservoir,
+            "stats": self.stats,
+            "differences": self.differences,
+            "results_rows": None if self.results is None else self.results.rows(),
+        }
+
+        tmp = filename + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+
+    def restore(self, filename: str) -> int:
+        """
+        Restore the state saved by save_checkpoint, returning the number of
+        samples done.
+        """
+
+        with open(filename, "rb") as f:
+            state = pickle.load(f)
+
+        if state["cur"] is not None:
+            setattr(self.expt.sim, "cur", state["cur"])
+        np.random.set_state(state["np_random"])
+        random.setstate(state["random"])
+
+        self.sample_reservoir = state["sample_reservoir"]
+        if self.keep_samples:
+            if state["samples_bytes"] is None:
+                raise Exception("{0} has no samples to keep".format(filename))
+            self.samples = read_samples(filename + ".samples", state["samples_bytes"])
+            self.saved_samples = len(self.samples)
+        else:
+            self.samples = self.sample_reservoir.items
+        self.stats = state["stats"]
+        self.differences = state["differences"]
+
+        if self.results is not None:
+            # drop rows written after the checkpoint
+            self.results.truncate(state["results_rows"])
+
+        return state["done"]
+
+    def run_parallel(
+        self,
+        num: int,
+        workers: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+        seed: Optional[int] = None,
+        batch_size: Optional[int] = None,
+    ):
+        """
+        Take num samples in a pool of worker processes, chunk_size samples per
+        task. Each chunk seeds numpy's and python's global generators from
+        (seed, chunk index), so for a given seed and chunk_size the samples are
+        the same whatever the number of workers; they are collected in order.
+
+        Parameters
+        ----------
+
+        num : int
+            number of samples
+        workers : int
+            number of processes, by default the number of cpus
+        chunk_size : int
+            samples per task, larger chunks amortize the communication overhead
+        seed : int
+            seed of the run, random by default
+        batch_size : int
+            batch size within each chunk, see take_samples
+        """
+
+        if seed is None:
+            seed = np.random.randint(2**31)
+
+        offset = getattr(self.expt.sim, "cur", 0)
+        starts = list(range(0, num, chunk_size))
+        sizes = [min(chunk_size, num - start) for start in starts]
+
+        with self.running(num):
+            with ProcessPoolExecutor(
+                workers, initializer=init_worker, initargs=(self.expt,)
+            ) as pool:
+                chunks = pool.map(
+                    sample_chunk,
+                    [offset + start for start in starts],
+                    sizes,
+                    range(len(starts)),
+                    [seed] * len(starts),
+                    [batch_size] * len(starts),
+                )
+                for samples in chunks:
+                    self.record(samples)
+
+        if hasattr(self.expt.sim, "cur"):
+            setattr(self.expt.sim, "cur", offset + num)
+
+    def run_pipelined(
+        self,
+        num: int,
+        batch_size: Optional[int] = None,
+        prefetch: int = PREFETCH,
+        workers: Optional[int] = None,
+        processes: bool = False,
+    ):
+        """
+        Take num samples like run, overlapping the stages: a producer thread
+        simulates batches of events into a queue holding at most prefetch
+        batches, predictions are made in order as batches arrive, and the
+        losses are computed by a pool of workers, with at most twice as many
+        batches in flight as workers. The samples are recorded in order.
+
+        The results are the same as run's as long as the simulator doesn't
+        share a random generator with the predictors, since the simulator
+        runs ahead of them.
+
+        Parameters
+        ----------
+
+        num : int
+            number of samples
+        batch_size : int
+            see take_samples
+        prefetch : int
+            maximum number of simulated batches waiting for predictions
+        workers : int
+            size of the loss pool, by default the number of cpus
+        processes : bool
+            whether to compute losses in processes instead of threads, which
+            pays off for losses holding the GIL
+        """
+
+        if batch_size is None:
+            batch_size = BATCH_SIZE if self.expt.batches() else 1
+        step = batch_size * max(1, CHUNK_SIZE // batch_size)
+
+        sizes = [min(batch_size, num - done) for done in range(0, num, batch_size)]
+        batches: "Queue[Tuple[List[int], List, List]]" = Queue(maxsize=prefetch)
+        stop = threading.Event()
+        errors: List[BaseException] = []
+
+        def produce():
+            try:
+                for size in sizes:
+                    if stop.is_set():
+                        return
+                    batch = self.expt.simulate(size)
+                    while not stop.is_set():
+                        try:
+                            batches.put(batch, timeout=0.1)
+                            break
+                        except Full:
+                            pass
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+
+        workers = workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        pool = executor(workers)
+
+        in_flight: Deque = deque()
+        pending: List[Sample] = []
+
+        def finish():
+            event_ids, xts, ys, predictions, future = in_flight.popleft()
+            scores = future.result()
+            self.expt.record_scores(scores)
+            pending.extend(make_samples(event_ids, xts, ys, predictions, scores))
+            # record in the same steps as run
+            if len(pending) >= step:
+                self.record(pending[:])
+                pending.clear()
+
+        with self.running(num):
+            try:
+                for _ in sizes:
+                    while True:
+                        try:
+                            event_ids, xts, ys = batches.get(timeout=0.1)
+                            break
+                        except Empty:
+                            if errors:
+                                raise errors[0]
+
+                    predictions = self.expt.predict(ys)
+                    future = pool.submit(
+                        score, self.expt.loss, xts, [xs for xs, _ in predictions]
+                    )
+                    in_flight.append((event_ids, xts, ys, predictions, future))
+
+                    while len(in_flight) > 2 * workers:
+                        finish()
+
+                while in_flight:
+                    finish()
+                if pending:
+                    self.record(pending)
+            finally:
+                stop.set()
+                producer.join()
+                pool.shutdown()
 
     def get_losses_dict(self) -> Dict[str, List[float]]:
         losses_dict: Dict[str, List[float]] = defaultdict(list)
-        names = [pred.__class__.__name__ for pred in self.expt.predictors]
+        names = self.names()
         for sample in self.samples:
             for name, (_, loss) in zip(names, sample.predictions):
                 losses_dict[name].append(loss)
 
         return losses_dict
 
-    def print_summary(self):
-        losses_dict = self.get_losses_dict()
+    def print_report(self, captures: bool = False):
+        """
+        Print the time spent in each stage and the throughput of the
+        instrumented experiment, see instrument.Instrument.report
+        """
 
-        for name, losses in sorted(losses_dict.items()):
-            print(name, np.mean(losses), np.std(losses))
+        assert self.expt.instrument is not None, "experiment is not instrumented"
+        print(self.expt.instrument.report(captures))
+
+    def print_summary(self):
+        for name, stats in sorted(self.stats.items()):
+            print(name, stats.mean, stats.std)
 
     def plot_summary(self):
-        losses_dict = self.get_losses_dict()
         names = []
         loss_arrays = []
 
-        for name, losses in sorted(losses_dict.items()):
-            names.append(name)
-            loss_arrays.append(np.array(losses))
+        if self.keep_samples:
+            for name, losses in sorted(self.get_losses_dict().items()):
+                names.append(name)
+                loss_arrays.append(np.array(losses))
+        else:
+            for name, stats in sorted(self.stats.items()):
+                names.append(name)
+                loss_arrays.append(stats.losses)
 
         pos = range(len(names))
 
@@ -0,0 +1,239 @@
+"""
+Instrumentation for experiments: time spent in each stage (simulating,
+each predictor's predictions, each predictor's losses), throughput, and
+optionally cProfile or tracemalloc reports of the slowest samples.
+
+Experiments without an Instrument only pay for an `is None` check per stage.
+"""
+
+import cProfile
+import heapq
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from typing_extensions import Protocol
+
+PROFILERS = {"cprofile", "tracemalloc"}
+
+
+class Hook(Protocol):
+    def on_stage(self, stage: str, seconds: float, events: int):
+        """
+        Called every time a stage completes, eg. to forward timings to a
+        metrics sink.
+
+        Parameters
+        ----------
+
+        stage : str
+            eg. "simulate", "predict:BarycenterPredictor", "loss:BarycenterPredictor"
+        seconds : float
+            time the stage took
+        events : int
+            number of events processed
+        """
+        pass
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.events = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds: float, events: int):
+        self.calls += 1
+        self.events += events
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+
+class Capture(NamedTuple):
+    seconds: float
+    event_ids: List[int]
+    report: str
+
+
+class Instrument:
+    """
+    Parameters
+    ----------
+
+    hooks : Sequence[Hook]
+        notified of every stage timing
+    slowest : int
+        number of slowest samples, or batches of samples, to keep profiler
+        reports for
+    profiler : str
+        "cprofile" for time profiles or "tracemalloc" for allocation profiles
+        of the slowest samples
+    top : int
+        number of lines in each profiler report
+
+    Stage timings made in the worker processes of Runner.run_parallel stay
+    in the workers' copies, only the parent's run throughput is counted.
+    """
+
+    def __init__(
+        self,
+        hooks: Sequence[Hook] = (),
+        slowest: int = 0,
+        profiler: str = "cprofile",
+        top: int = 20,
+    ):
+        assert profiler in PROFILERS
+        self.hooks = list(hooks)
+        self.slowest = slowest
+        self.profiler = profiler
+        self.top = top
+
+        self.stages: Dict[str, StageStats] = {}
+        self.events = 0
+        self.wall = 0.0
+
+        # min heap of (seconds, sequence number, capture)
+        self.captures: List[Tuple[float, int, Capture]] = []
+        self.num_captures = 0
+
+        # stages may be recorded from producer threads
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, events: int = 1):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = StageStats()
+            self.stages[stage].add(seconds, events)
+        for hook in self.hooks:
+            hook.on_stage(stage, seconds, events)
+
+    @contextmanager
+    def running(self, events: int) -> Iterator[None]:
+        """
+        Count the wall time of a run of events samples.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.wall += time.perf_counter() - start
+            self.events += events
+
+    @property
+    def throughput(self) -> float:
+        """
+        Events per second over all runs.
+        """
+
+        return self.events / self.wall if self.wall else 0.0
+
+    @contextmanager
+    def capture(self) -> Iterator[List[int]]:
+        """
+        Profile the enclosed block, keeping the report if it's among the
+        slowest blocks so far; the block adds the ids of the events it
+        processes to the yielded list.
+        """
+
+        event_ids: List[int] = []
+        if not self.slowest:
+            yield event_ids
+            return
+
+        profile = None
+        if self.profiler == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        try:
+            yield event_ids
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                report = self.cprofile_report(profile)
+            else:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                report = self.tracemalloc_report(snapshot)
+            self.keep(Capture(seconds, event_ids, report))
+
+    def keep(self, capture: Capture):
+        self.num_captures += 1
+        item = (capture.seconds, self.num_captures, capture)
+        if len(self.captures) < self.slowest:
+            heapq.heappush(self.captures, item)
+        else:
+            heapq.heappushpop(self.captures, item)
+
+    def cprofile_report(self, profile: cProfile.Profile) -> str:
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        return out.getvalue()
+
+    def tracemalloc_report(self, snapshot: tracemalloc.Snapshot) -> str:
+        return "\n".join(
+            str(stat) for stat in snapshot.statistics("lineno")[: self.top]
+        )
+
+    def slowest_captures(self) -> List[Capture]:
+        return [capture for _, _, capture in sorted(self.captures, reverse=True)]
+
+    def report(self, captures: bool = False) -> str:
+        """
+        Table of the time spent in each stage and the throughput, followed by
+        the profiler reports of the slowest samples if captures is set.
+        """
+
+        lines = [
+            "{0:<40} {1:>10} {2:>10} {3:>12} {4:>12}".format(
+                "stage", "events", "seconds", "us/event", "events/s"
+            )
+        ]
+        for name, stage in sorted(self.stages.items()):
+            per_event = stage.seconds / stage.events if stage.events else 0.0
+            rate = stage.events / stage.seconds if stage.seconds else 0.0
+            lines.append(
+                "{0:<40} {1:>10} {2:>10.3f} {3:>12.1f} {4:>12.1f}".format(
+                    name, stage.events, stage.seconds, per_event * 1e6, rate
+                )
+            )
+        lines.append(
+            "{0} events in {1:.3f} s, {2:.1f} events/s".format(
+                self.events, self.wall, self.throughput
+            )
+        )
+
+        if captures:
+            for capture in self.slowest_captures():
+                lines.append(
+                    "{0:.6f} s for events {1}".format(
+                        capture.seconds, capture.event_ids
+                    )
+                )
+                lines.append(capture.report)
+
+        return "\n".join(lines)
+
+
+def stage_name(stage: str, obj: Optional[object] = None) -> str:
+    return stage if obj is None else stage + ":" + obj.__class__.__name__
@@ -0,0 +1,398 @@
+"""
+Lookup table predictor trained offline on simulated events: events are
+binned into voxels by the barycenter of their hits, and each voxel maps the
+mean normalized charge pattern its events leave on the sensors to their mean
+position. Patterns are compressed into a low dimensional PCA embedding
+indexed by a KD-tree, so a prediction is a projection and a nearest neighbour
+query; unlike BarycenterPredictor it learns the response near the cylinder
+edges.
+
+Build a table from nexus output files with:
+
+    python -m petutils.lut --pattern "full_ring.*.pet.h5" --num 100000 --out lut.npz
+"""
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import scipy.sparse
+from numpy import ndarray
+from scipy.spatial import cKDTree
+
+from petutils.simplified import XT, X, Y
+
+LUT_VERSION = 1
+
+CHUNK_SIZE = 1024
+
+
+def column_index(sensor_ids: ndarray) -> ndarray:
+    """
+    Dense sensor_id -> pattern column array, -1 for sensors not in sensor_ids.
+    """
+
+    size = int(np.max(sensor_ids)) + 1 if sensor_ids.shape[0] else 0
+    columns = np.full(size, -1, dtype="int64")
+    columns[sensor_ids] = np.arange(sensor_ids.shape[0])
+    return columns
+
+
+def charge_patterns(ys: Sequence[Y], columns: ndarray, size: int) -> ndarray:
+    """
+    (len(ys), size) - shaped array of the charge of each observation on each
+    pattern column, normalized to sum 1; charges of sensors without a column
+    are dropped.
+    """
+
+    if len(ys) == 0:
+        return np.zeros((0, size))
+
+    rows = np.repeat(np.arange(len(ys)), [y.charge.shape[0] for y in ys])
+    sensor_ids = np.concatenate([y.sensor_id for y in ys]).astype("int64")
+    charge = np.concatenate([y.charge for y in ys])
+
+    cols = np.full(sensor_ids.shape, -1, dtype="int64")
+    known = sensor_ids < columns.shape[0]
+    cols[known] = columns[sensor_ids[known]]
+    keep = cols >= 0
+
+    patterns = np.bincount(
+        rows[keep] * size + cols[keep],
+        weights=charge[keep],
+        minlength=len(ys) * size,
+    ).reshape(len(ys), size)
+
+    total = np.sum(patterns, axis=1, keepdims=True)
+    return np.divide(patterns, total, out=np.zeros_like(patterns), where=total > 0)
+
+
+def barycenter(xt: XT) -> ndarray:
+    return np.sum(xt.points * xt.energy[:, None], axis=0) / np.sum(xt.energy)
+
+
+class Voxels(NamedTuple):
+    """
+    Sums over the training events in each voxel.
+
+    keys : ndarray
+        (m, 3) - shaped array of integer voxel coordinates
+    counts : ndarray
+        (m,) - shaped array of number of events
+    patterns : ndarray
+        (m, n) - shaped array of summed charge patterns
+    positions : ndarray
+        (m, 3) - shaped array of summed event barycenters
+    """
+
+    keys: ndarray
+    counts: ndarray
+    patterns: ndarray
+    positions: ndarray
+
+    @classmethod
+    def reduce(
+        cls, keys: ndarray, counts: ndarray, patterns: ndarray, positions: ndarray
+    ) -> "Voxels":
+        """
+        Sum the rows sharing a voxel key.
+        """
+
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        # summing with a sparse (voxels, rows) indicator matrix is much faster
+        # than np.add.at on wide pattern arrays
+        indicator = scipy.sparse.csr_matrix(
+            (np.ones(inverse.shape[0]), (inverse, np.arange(inverse.shape[0]))),
+            shape=(unique.shape[0], inverse.shape[0]),
+        )
+        return Voxels(
+            unique,
+            (indicator @ counts).astype("int64"),
+            indicator @ patterns,
+            indicator @ positions,
+        )
+
+    @classmethod
+    def empty(cls, size: int) -> "Voxels":
+        return cls(
+            np.zeros((0, 3), dtype="int64"),
+            np.zeros(0, dtype="int64"),
+            np.zeros((0, size)),
+            np.zeros((0, 3)),
+        )
+
+    def merge(self, other: "Voxels") -> "Voxels":
+        return Voxels.reduce(*[np.concatenate(columns) for columns in zip(self, other)])
+
+
+def accumulate(sim: Any, num: int, columns: ndarray, voxel_size: float) -> Voxels:
+    """
+    Sum the next num events of sim into voxels, skipping events without
+    energy or charge.
+    """
+
+    size = int(np.sum(columns >= 0))
+    xts, ys = [], []
+    for _ in range(num):
+        xt, y = sim.sample()
+        xts.append(xt)
+        ys.append(y)
+
+    patterns = charge_patterns(ys, columns, size)
+    energy = np.array([np.sum(xt.energy) for xt in xts])
+    keep = (energy > 0) & (np.sum(patterns, axis=1) > 0)
+
+    positions = np.array([barycenter(xts[i]) for i in np.flatnonzero(keep)])
+    positions = positions.reshape(-1, 3)
+    keys = np.floor(positions / voxel_size).astype("int64")
+
+    return Voxels.reduce(
+        keys, np.ones(keys.shape[0], dtype="int64"), patterns[keep], positions
+    )
+
+
+# simulator of each worker process, set once by init_worker
+worker_sim: Optional[Any] = None
+
+
+def init_worker(sim: Any):
+    global worker_sim
+    worker_sim = sim
+
+
+def accumulate_chunk(
+    start: int, num: int, columns: ndarray, voxel_size: float
+) -> Voxels:
+    """
+    Sum events start:start + num in a worker process, see experiment.sample_chunk
+    """
+
+    sim = worker_sim
+    assert sim is not None
+    sim.cur = start
+    return accumulate(sim, num, columns, voxel_size)
+
+
+def build_voxels(
+    sim: Any,
+    num: int,
+    sensor_ids: ndarray,
+    voxel_size: float,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> Voxels:
+    """
+    Sum the next num events of sim into voxels, chunk_size events at a time,
+    in a pool of workers processes or in this process if workers is 1. The
+    simulator must keep its position in a cur attribute, like
+    simplified.Simulator and sharded.ShardedDataset; consider sending a
+    Simulator.to_shared copy to avoid copying its tables to every worker.
+    """
+
+    columns = column_index(sensor_ids)
+    offset = sim.cur
+    starts = list(range(0, num, chunk_size))
+    sizes = [min(chunk_size, num - start) for start in starts]
+
+    # chunks are folded into the table as they complete, so memory is bounded
+    # by the table plus a few chunks rather than growing with num
+    voxels = Voxels.empty(sensor_ids.shape[0])
+
+    if workers == 1:
+        for size in sizes:
+            voxels = voxels.merge(accumulate(sim, size, columns, voxel_size))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(sim,)
+        ) as pool:
+            # at most twice as many chunks in flight as workers
+            in_flight: Deque[Future] = deque()
+            for start, size in zip(starts, sizes):
+                if len(in_flight) == 2 * workers:
+                    voxels = voxels.merge(in_flight.popleft().result())
+                in_flight.append(
+                    pool.submit(
+                        accumulate_chunk, offset + start, size, columns, voxel_size
+                    )
+                )
+            while in_flight:
+                voxels = voxels.merge(in_flight.popleft().result())
+
+    sim.cur = offset + num
+    return voxels
+
+
+class LookupTablePredictor:
+    """
+    Predicts the mean position of the voxels whose embedded charge patterns
+    are nearest to the observation's.
+
+    Parameters
+    ----------
+
+    sensor_ids : ndarray
+        (n,) - shaped array of the sensor id of each pattern column
+    mean : ndarray
+        (n,) - shaped array, mean voxel pattern
+    components : ndarray
+        (k, n) - shaped array of principal axes of the voxel patterns
+    embeddings : ndarray
+        (m, k) - shaped array of embedded voxel patterns
+    positions : ndarray
+        (m, 3) - shaped array of mean event position in each voxel
+    neighbours : int
+        number of nearest voxels averaged, weighted by inverse distance
+    eps : float
+        relative error allowed in the nearest neighbour search, see
+        scipy.spatial.cKDTree.query
+    """
+
+    def __init__(
+        self,
+        sensor_ids: ndarray,
+        mean: ndarray,
+        components: ndarray,
+        embeddings: ndarray,
+        positions: ndarray,
+        neighbours: int = 1,
+        eps: float = 0.0,
+    ):
+        assert mean.shape == (sensor_ids.shape[0],)
+        assert components.shape[1] == sensor_ids.shape[0]
+        assert embeddings.shape == (positions.shape[0], components.shape[0])
+        assert positions.shape[0] > 0, "empty table"
+
+        self.sensor_ids = sensor_ids
+        self.mean = mean
+        self.components = components
+        self.embeddings = embeddings
+        self.positions = positions
+        self.neighbours = min(neighbours, positions.shape[0])
+        self.eps = eps
+
+        self.columns = column_index(sensor_ids)
+        self.tree = cKDTree(embeddings)
+
+    @classmethod
+    def from_voxels(
+        cls, sensor_ids: ndarray, voxels: Voxels, components: int = 16, **kwargs
+    ) -> "LookupTablePredictor":
+        """
+        Fit the embedding to the mean patterns of the voxels, keeping at most
+        components principal axes.
+        """
+
+        patterns = voxels.patterns / voxels.counts[:, None]
+        positions = voxels.positions / voxels.counts[:, None]
+
+        mean = np.mean(patterns, axis=0)
+        _, _, vt = np.linalg.svd(patterns - mean, full_matrices=False)
+        axes = vt[:components]
+
+        return cls(
+            sensor_ids, mean, axes, (patterns - mean) @ axes.T, positions, **kwargs
+        )
+
+    @classmethod
+    def build(
+        cls,
+        sim: Any,
+        num: int,
+        sensor_ids: ndarray,
+        voxel_size: float = 10.0,
+        components: int = 16,
+        workers: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+        **kwargs
+    ) -> "LookupTablePredictor":
+        """
+        Train on the next num events of sim, see build_voxels and from_voxels;
+        sensor_ids are the sensors of the patterns, eg. sim.geometry.sensor_ids
+        """
+
+        voxels = build_voxels(sim, num, sensor_ids, voxel_size, workers, chunk_size)
+        return cls.from_voxels(sensor_ids, voxels, components, **kwargs)
+
+    def embed(self, ys: Sequence[Y]) -> ndarray:
+        patterns = charge_patterns(ys, self.columns, self.sensor_ids.shape[0])
+        return (patterns - self.mean) @ self.components.T
+
+    def predict(self, y: Y) -> X:
+        return self.predict_batch([y])[0]
+
+    def predict_batch(self, ys: Sequence[Y]) -> List[X]:
+        distances, index = self.tree.query(
+            self.embed(ys), k=list(range(1, self.neighbours + 1)), eps=self.eps
+        )
+
+        if self.neighbours == 1:
+            xyz = self.positions[index[:, 0]]
+        else:
+            weights = 1.0 / np.maximum(distances, 1e-12)
+            weights /= np.sum(weights, axis=1, keepdims=True)
+            xyz = np.sum(self.positions[index] * weights[:, :, None], axis=1)
+
+        return [X(p) for p in xyz]
+
+    def save(self, filename: str):
+        """
+        Write the table to an .npz file, the KD-tree is rebuilt on load.
+        """
+
+        np.savez(
+            filename,
+            version=LUT_VERSION,
+            sensor_ids=self.sensor_ids,
+            mean=self.mean,
+            components=self.components,
+            embeddings=self.embeddings,
+            positions=self.positions,
+        )
+
+    @classmethod
+    def load(cls, filename: str, **kwargs) -> "LookupTablePredictor":
+        with np.load(filename) as f:
+            if int(f["version"]) != LUT_VERSION:
+                raise Exception("{0} is an outdated lookup table".format(filename))
+            return cls(
+                f["sensor_ids"],
+                f["mean"],
+                f["components"],
+                f["embeddings"],
+                f["positions"],
+                **kwargs
+            )
+
+
+if __name__ == "__main__":
+    from petutils.sharded import ShardedDataset
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--pattern", required=True, help="glob matching the pet files")
+    parser.add_argument("--out", required=True, help="lookup table .npz file")
+    parser.add_argument("--num", type=int, required=True, help="training events")
+    parser.add_argument("--voxel_size", type=float, default=10.0)
+    parser.add_argument("--components", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+
+    with ShardedDataset(args.pattern, workers=args.workers) as dataset:
+        lut = LookupTablePredictor.build(
+            dataset,
+            min(args.num, len(dataset)),
+            dataset.shard(0).geometry.sensor_ids,
+            voxel_size=args.voxel_size,
+            components=args.components,
+            workers=args.workers,
+        )
+
+    lut.save(args.out)
+    print("{0} voxels".format(lut.positions.shape[0]))
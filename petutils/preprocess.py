@@ -0,0 +1,164 @@
+"""
+One-time preprocessing of nexus hdf5 files into a cache directory of
+sorted columnar arrays plus event offsets, which later sessions and
+concurrent worker processes memory-map instead of re-reading and regrouping
+the hdf5 tables.
+
+The cache records the size and modification time of its source file and is
+rebuilt automatically when they change.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import h5py
+from pandas import DataFrame
+
+from petutils.events import EventTable, SensorGeometry
+from petutils.simplified import Simulator, hits_table, waveforms_table
+
+# bump when the cache layout changes to invalidate existing caches
+CACHE_VERSION = 2
+
+
+def cache_dir_for(filename: str) -> str:
+    return filename + ".cache"
+
+
+def source_stamp(filename: str) -> dict:
+    stat = os.stat(filename)
+    return {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def is_fresh(filename: str, cache_dir: Optional[str] = None) -> bool:
+    """
+    Whether the cache for filename exists and was built from its current contents.
+    """
+
+    cache_dir = cache_dir or cache_dir_for(filename)
+    meta_path = os.path.join(cache_dir, "meta.json")
+
+    if not os.path.exists(meta_path):
+        return False
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    return meta == source_stamp(filename)
+
+
+def preprocess(filename: str, cache_dir: Optional[str] = None) -> str:
+    """
+    Build the cache for an h5 file
+    eg. full_ring_iradius165mm_depth3cm_pitch7mm_new_h5.001.pet.h5
+
+    Parameters
+    ----------
+
+    filename : str
+        hdf5 file containing mc data
+    cache_dir : str
+        where to write the cache, defaults to filename + ".cache"
+
+    Returns
+    -------
+
+    str
+        the cache directory
+
+    """
+
+    cache_dir = cache_dir or cache_dir_for(filename)
+    stamp = source_stamp(filename)
+
+    with h5py.File(filename, "r") as f:
+        positions = DataFrame(f["MC"]["sensor_positions"][:])
+        hits = DataFrame(f["MC"]["hits"][:])
+        waveforms = DataFrame(f["MC"]["waveforms"][:])
+
+    # build in a directory of our own next to the final location, so that
+    # concurrent builds don't collide, and publish it with a single rename
+    parent = os.path.dirname(os.path.abspath(cache_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(cache_dir), dir=parent)
+
+    SensorGeometry.from_dataframe(positions).save(os.path.join(tmp_dir, "geometry"))
+    hits_table(hits).save(os.path.join(tmp_dir, "hits"))
+    waveforms_table(waveforms).save(os.path.join(tmp_dir, "waveforms"))
+
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(stamp, f)
+
+    publish(tmp_dir, filename, cache_dir)
+    return cache_dir
+
+
+def publish(tmp_dir: str, filename: str, cache_dir: str):
+    """
+    Rename tmp_dir to cache_dir. A fresh cache already there, eg. built
+    concurrently by another process, is kept and tmp_dir discarded; a stale
+    one is first renamed out of the way, so readers never see a partially
+    written or partially deleted cache.
+    """
+
+    while True:
+        try:
+            # fails if cache_dir exists and isn't empty
+            os.rename(tmp_dir, cache_dir)
+            return
+        except OSError:
+            if is_fresh(filename, cache_dir):
+                shutil.rmtree(tmp_dir)
+                return
+            if not os.path.exists(cache_dir):
+                shutil.rmtree(tmp_dir)
+                raise
+
+        stale = tempfile.mkdtemp(
+            prefix=os.path.basename(cache_dir) + ".stale", dir=os.path.dirname(tmp_dir)
+        )
+        try:
+            os.replace(cache_dir, stale)
+        except FileNotFoundError:
+            # moved away by a concurrent build
+            pass
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def load_simulator(filename: str, cache_dir: Optional[str] = None) -> Simulator:
+    """
+    Simulator over the events of an h5 file backed by its memory-mapped cache,
+    building or rebuilding the cache first if needed.
+
+    Parameters
+    ----------
+
+    filename : str
+        hdf5 file containing mc data
+    cache_dir : str
+        cache location, defaults to filename + ".cache"
+
+    Returns
+    -------
+
+    Simulator
+
+    """
+
+    cache_dir = cache_dir or cache_dir_for(filename)
+
+    if not is_fresh(filename, cache_dir):
+        preprocess(filename, cache_dir)
+
+    geometry = SensorGeometry.load(os.path.join(cache_dir, "geometry"))
+    hits = EventTable.load(os.path.join(cache_dir, "hits"))
+    waveforms = EventTable.load(os.path.join(cache_dir, "waveforms"))
+
+    return Simulator.from_tables(geometry, hits, waveforms)
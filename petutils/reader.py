@@ -0,0 +1,148 @@
+"""
+Streaming access to the events in nexus hdf5 files, reading the hits and
+waveforms tables in bounded-size chunks instead of loading them whole.
+"""
+
+from typing import Iterator, Tuple
+
+import h5py
+import numpy as np
+from numpy import ndarray
+from pandas import DataFrame
+
+from petutils.events import SensorGeometry
+from petutils.simplified import XT, Y
+
+
+def iter_chunks(dataset: h5py.Dataset, chunk_size: int) -> Iterator[ndarray]:
+    """
+    Parameters
+    ----------
+
+    dataset : h5py.Dataset
+        1 - dimensional table
+    chunk_size : int
+        maximum number of rows per chunk
+
+    Returns
+    -------
+
+    Iterator[ndarray]
+        consecutive slices of the table
+    """
+
+    for start in range(0, dataset.shape[0], chunk_size):
+        yield dataset[start : start + chunk_size]
+
+
+def iter_events(
+    dataset: h5py.Dataset, chunk_size: int
+) -> Iterator[Tuple[int, ndarray]]:
+    """
+    Group the rows of a table by event_id, reading chunk_size rows at a time.
+    Rows of an event must be contiguous; an event straddling a chunk boundary
+    is held back until the chunk where it ends is read.
+
+    Parameters
+    ----------
+
+    dataset : h5py.Dataset
+        1 - dimensional table with an event_id column
+    chunk_size : int
+        maximum number of rows per read
+
+    Returns
+    -------
+
+    Iterator[Tuple[int, ndarray]]
+        event_id and rows of each event, in file order
+    """
+
+    carry = None
+
+    for chunk in iter_chunks(dataset, chunk_size):
+        if carry is not None:
+            chunk = np.concatenate([carry, chunk])
+
+        event_ids = chunk["event_id"]
+        bounds = np.flatnonzero(event_ids[1:] != event_ids[:-1]) + 1
+        starts = np.concatenate([[0], bounds])
+        stops = np.concatenate([bounds, [chunk.shape[0]]])
+
+        # the last event may continue in the next chunk
+        for start, stop in zip(starts[:-1], stops[:-1]):
+            yield int(event_ids[start]), chunk[start:stop]
+
+        carry = chunk[starts[-1] :]
+
+    if carry is not None and carry.shape[0] > 0:
+        yield int(carry["event_id"][0]), carry
+
+
+class EventReader:
+    """
+    Simulator reading the events of an h5 file
+    eg. full_ring_iradius165mm_depth3cm_pitch7mm_new_h5.001.pet.h5
+    sequentially, with memory use proportional to chunk_size rather than to
+    the file size.
+
+    Like simplified.Simulator, only events with both hits and waveforms are
+    produced. Both tables must list events in increasing event_id order, as
+    nexus writes them.
+    """
+
+    def __init__(self, filename: str, chunk_size: int = 100000):
+        self.file = h5py.File(filename, "r")
+        self.chunk_size = chunk_size
+
+        self.positions = DataFrame(self.file["MC"]["sensor_positions"][:])
+        self.geometry = SensorGeometry.from_dataframe(self.positions)
+
+        self.events = iter(self)
+
+    def __iter__(self) -> Iterator[Tuple[XT, Y]]:
+        hits = iter_events(self.file["MC"]["hits"], self.chunk_size)
+        waveforms = iter_events(self.file["MC"]["waveforms"], self.chunk_size)
+
+        # merge join on event_id, stopping when either table runs out
+        try:
+            hits_id, hits_rows = next(hits)
+            waveforms_id, waveforms_rows = next(waveforms)
+
+            while True:
+                if hits_id < waveforms_id:
+                    hits_id, hits_rows = next(hits)
+                elif waveforms_id < hits_id:
+                    waveforms_id, waveforms_rows = next(waveforms)
+                else:
+                    yield self.to_sample(hits_rows, waveforms_rows)
+                    hits_id, hits_rows = next(hits)
+                    waveforms_id, waveforms_rows = next(waveforms)
+        except StopIteration:
+            return
+
+    def to_sample(self, hits: ndarray, waveforms: ndarray) -> Tuple[XT, Y]:
+        xt = XT(
+            np.column_stack([hits["x"], hits["y"], hits["z"]]),
+            hits["energy"],
+            int(hits["event_id"][0]),
+        )
+        y = Y(waveforms["sensor_id"], waveforms["charge"], geometry=self.geometry)
+
+        return xt, y
+
+    def sample(self) -> Tuple[XT, Y]:
+        """
+        Next event in the file, raises StopIteration after the last one.
+        """
+
+        return next(self.events)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,212 @@
+"""
+Columnar hdf5 storage for the per event results of experiment runs, so
+summaries, plots and comparisons between runs can be computed from disk
+without re-running the experiments.
+
+Each row holds the result of one predictor on one event:
+
+    event_id : int64, see experiment.Experiment.event_id
+    predictor : int16, index into the predictors attribute of the file
+    loss : float64
+    xyz : (3,) float64, predicted point or nan if the prediction has none
+    time : float64, seconds spent predicting and scoring
+"""
+
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence
+
+import h5py
+import numpy as np
+from numpy import ndarray
+
+COLUMNS = {
+    "event_id": ("int64", ()),
+    "predictor": ("int16", ()),
+    "loss": ("double", ()),
+    "xyz": ("double", (3,)),
+    "time": ("double", ()),
+}
+
+
+def default_xyz(x: Any) -> Sequence[float]:
+    """
+    Predicted point of simplified.X like predictions, nan for others.
+    """
+
+    if hasattr(x, "xyz"):
+        return x.xyz
+    return [np.nan, np.nan, np.nan]
+
+
+class ResultsWriter:
+    """
+    Appends results to an hdf5 file, buffer_size rows at a time.
+
+    Parameters
+    ----------
+
+    filename : str
+        file to write, an existing file with the same predictors is appended to
+    predictors : Sequence[str]
+        predictor names, in the order of Sample.predictions
+    buffer_size : int
+        number of rows buffered between writes
+    xyz : Callable[[X], Sequence[float]]
+        how to extract the predicted point from a prediction
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        predictors: Sequence[str],
+        buffer_size: int = 4096,
+        xyz: Callable[[Any], Sequence[float]] = default_xyz,
+    ):
+        self.file = h5py.File(filename, "a")
+        self.predictors = list(predictors)
+        self.xyz = xyz
+
+        if "results" in self.file:
+            self.group = self.file["results"]
+            stored = [str(name) for name in self.group.attrs["predictors"]]
+            if stored != self.predictors:
+                raise Exception(
+                    "{0} has results for predictors {1}".format(filename, stored)
+                )
+        else:
+            self.group = self.file.create_group("results")
+            self.group.attrs["predictors"] = self.predictors
+            for name, (dtype, shape) in COLUMNS.items():
+                self.group.create_dataset(
+                    name,
+                    shape=(0, *shape),
+                    maxshape=(None, *shape),
+                    dtype=dtype,
+                    chunks=(buffer_size, *shape),
+                )
+
+        self.buffer = {
+            name: np.zeros((buffer_size, *shape), dtype=dtype)
+            for name, (dtype, shape) in COLUMNS.items()
+        }
+        self.size = 0
+
+    def write(self, samples: Sequence):
+        """
+        Add one row per experiment.Sample and predictor.
+        """
+
+        for sample in samples:
+            for k, (x, loss) in enumerate(sample.predictions):
+                if self.size == self.buffer["loss"].shape[0]:
+                    self.flush()
+
+                row = self.size
+                self.buffer["event_id"][row] = sample.event_id
+                self.buffer["predictor"][row] = k
+                self.buffer["loss"][row] = loss
+                self.buffer["xyz"][row] = self.xyz(x)
+                self.buffer["time"][row] = sample.times[k] if sample.times else np.nan
+                self.size += 1
+
+    def rows(self) -> int:
+        """
+        Number of rows written, including buffered ones.
+        """
+
+        return self.group["loss"].shape[0] + self.size
+
+    def truncate(self, rows: int):
+        """
+        Drop the rows after the first rows, eg. when resuming from a checkpoint.
+        """
+
+        self.flush()
+        for name in COLUMNS:
+            self.group[name].resize(rows, axis=0)
+
+    def flush(self):
+        if self.size == 0:
+            return
+
+        for name, buffer in self.buffer.items():
+            dataset = self.group[name]
+            start = dataset.shape[0]
+            dataset.resize(start + self.size, axis=0)
+            dataset[start:] = buffer[: self.size]
+
+        self.size = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Results(NamedTuple):
+    predictors: List[str]
+    columns: Dict[str, ndarray]
+
+    def select(self, predictor: str) -> Dict[str, ndarray]:
+        """
+        Columns of the rows of one predictor.
+        """
+
+        mask = self.columns["predictor"] == self.predictors.index(predictor)
+        return {name: col[mask] for name, col in self.columns.items()}
+
+
+def read_results(filename: str) -> Results:
+    with h5py.File(filename, "r") as f:
+        group = f["results"]
+        predictors = [str(name) for name in group.attrs["predictors"]]
+        columns = {name: group[name][:] for name in COLUMNS}
+    return Results(predictors, columns)
+
+
+def get_losses_dict(filename: str) -> Dict[str, ndarray]:
+    """
+    Losses of each predictor, like experiment.Runner.get_losses_dict
+    """
+
+    results = read_results(filename)
+    return {name: results.select(name)["loss"] for name in results.predictors}
+
+
+def summarize(filename: str) -> Dict[str, Dict[str, float]]:
+    """
+    Count, mean and standard deviation of the losses and mean time of each
+    predictor.
+    """
+
+    results = read_results(filename)
+    summary = {}
+    for name in results.predictors:
+        rows = results.select(name)
+        summary[name] = {
+            "count": float(rows["loss"].shape[0]),
+            "mean": float(np.mean(rows["loss"])),
+            "std": float(np.std(rows["loss"])),
+            "time": float(np.mean(rows["time"])),
+        }
+    return summary
+
+
+def compare(filename_a: str, filename_b: str, predictor: str) -> ndarray:
+    """
+    Paired loss differences b - a of predictor on the events both runs share,
+    ordered by event_id; event ids must be unique within each run.
+    """
+
+    a = read_results(filename_a).select(predictor)
+    b = read_results(filename_b).select(predictor)
+
+    _, index_a, index_b = np.intersect1d(
+        a["event_id"], b["event_id"], return_indices=True
+    )
+    return b["loss"][index_b] - a["loss"][index_a]
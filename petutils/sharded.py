@@ -0,0 +1,186 @@
+"""
+A single event space over the many *.NNN.pet.h5 shards of a nexus production
+run: the shards are preprocessed and indexed in parallel in a process pool,
+and sampled in order with the next shard loaded in the background.
+"""
+
+import glob
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from petutils.preprocess import cache_dir_for, load_simulator
+from petutils.simplified import XT, Simulator, Y
+
+# nexus event ids fit in the low bits of global event ids
+SHARD_SHIFT = 32
+
+
+def index_shard(filename: str, cache_dir: Optional[str] = None) -> ndarray:
+    """
+    Build the cache for a shard if needed and list its events.
+
+    Returns
+    -------
+
+    ndarray
+        sorted ids of the events with both hits and waveforms, which must be
+        in [0, 2 ** SHARD_SHIFT) so global ids don't collide across shards
+    """
+
+    event_ids = np.array(load_simulator(filename, cache_dir).event_ids, dtype="int64")
+
+    # global ids pack the shard above SHARD_SHIFT bits of event id
+    if event_ids.shape[0] and (event_ids[0] < 0 or event_ids[-1] >= 1 << SHARD_SHIFT):
+        raise Exception(
+            "{0} has event ids outside [0, 2 ** {1})".format(filename, SHARD_SHIFT)
+        )
+
+    return event_ids
+
+
+class ShardedDataset:
+    """
+    Simulator over the events of all the files matching pattern, in sorted
+    filename order. Event ids are only unique within a shard, so events are
+    identified by (shard, event_id) pairs.
+
+    Parameters
+    ----------
+
+    pattern : str
+        glob matching the shards eg. "full_ring.*.pet.h5"
+    cache_root : str
+        directory for the shard caches, by default next to each shard
+    workers : int
+        size of the process pool used to index the shards, 1 indexes them in
+        this process
+    prefetch : bool
+        whether to load the next shard in the background while sampling
+    """
+
+    def __init__(
+        self,
+        pattern: str,
+        cache_root: Optional[str] = None,
+        workers: Optional[int] = None,
+        prefetch: bool = True,
+    ):
+        self.filenames = sorted(glob.glob(pattern))
+        if not self.filenames:
+            raise Exception("no files match {0}".format(pattern))
+
+        self.cache_dirs = [
+            self.cache_dir(filename, cache_root) for filename in self.filenames
+        ]
+
+        self.shard_event_ids: List[ndarray]
+        if workers == 1:
+            # no pool, eg. when already running in a worker process
+            self.shard_event_ids = list(
+                map(index_shard, self.filenames, self.cache_dirs)
+            )
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                self.shard_event_ids = list(
+                    pool.map(index_shard, self.filenames, self.cache_dirs)
+                )
+
+        sizes = [event_ids.shape[0] for event_ids in self.shard_event_ids]
+
+        # global positions offsets[k]:offsets[k + 1] belong to shard k
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+
+        self.event_ids: List[Tuple[int, int]] = [
+            (shard, event_id)
+            for shard, event_ids in enumerate(self.shard_event_ids)
+            for event_id in event_ids.tolist()
+        ]
+
+        self.prefetch = prefetch
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        self.shards: Dict[int, Future] = {}
+
+        # current index into event_ids
+        self.cur = 0
+
+    @staticmethod
+    def cache_dir(filename: str, cache_root: Optional[str]) -> str:
+        if cache_root is None:
+            return cache_dir_for(filename)
+        return os.path.join(cache_root, os.path.basename(filename) + ".cache")
+
+    def __len__(self) -> int:
+        return len(self.event_ids)
+
+    def load(self, shard: int) -> Future:
+        if shard not in self.shards:
+            self.shards[shard] = self.loader.submit(
+                load_simulator, self.filenames[shard], self.cache_dirs[shard]
+            )
+        return self.shards[shard]
+
+    def shard(self, shard: int) -> Simulator:
+        """
+        Simulator over a shard, releasing the earlier ones and starting to load
+        the next one.
+        """
+
+        sim = self.load(shard).result()
+
+        for done in [k for k in self.shards if k < shard]:
+            del self.shards[done]
+
+        if self.prefetch and shard + 1 < len(self.filenames):
+            self.load(shard + 1)
+
+        return sim
+
+    def event_id(self) -> int:
+        """
+        Global id of the event sample returns next, (shard << SHARD_SHIFT) | event_id
+        """
+
+        if self.cur >= len(self.event_ids):
+            return -1
+        shard, event_id = self.event_ids[self.cur]
+        return (shard << SHARD_SHIFT) | event_id
+
+    def sample(self) -> Tuple[XT, Y]:
+        shard, event_id = self.event_ids[self.cur]
+        sim = self.shard(shard)
+
+        sim.cur = self.cur - int(self.offsets[shard])
+        assert sim.event_ids[sim.cur] == event_id
+
+        global_id = self.event_id()
+        self.cur += 1
+
+        xt, y = sim.sample()
+        xt.event_id = global_id
+        return xt, y
+
+    def __getstate__(self) -> dict:
+        # loaded shards stay behind, eg. when sent to worker processes
+        state = self.__dict__.copy()
+        del state["loader"]
+        del state["shards"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.loader = ThreadPoolExecutor(max_workers=1)
+        self.shards = {}
+
+    def close(self):
+        self.loader.shutdown()
+        self.shards.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -5,7 +5,7 @@ where we ignore the time dimension and restrict our density predictions to a sin
 
 
 import random
-from typing import Dict, Tuple
+from typing import List, Optional, Sequence, Tuple
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -13,20 +13,44 @@ from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 unused import
 from numpy import ndarray
 from pandas import DataFrame
 
-from petutils.emd import sparse_emd
+from petutils.emd import SOLVERS, multiscale_emd, pad_batch, sinkhorn_emd, sparse_emd
+from petutils.events import EventTable, SensorGeometry
 
 
 class XT:
     """
     Causes are hit energy distributions integrated over time. We can represent
     them by taking the hits DataFrame and ignoring everything except x, y, z
-    and energy.
+    and energy, stored as arrays to avoid DataFrame overhead in the hot loop.
+
+    Parameters
+    ----------
+
+    points : ndarray
+        (n, 3) - shaped array of hit positions
+    energy : ndarray
+        (n,) - shaped array of hit energies
+    event_id : int
+        id of the event the hits belong to, -1 if unknown
     """
 
-    def __init__(self, df: DataFrame):
-        self.df = df
-        for col in "x y z energy".split():
-            assert col in df
+    __slots__ = ("points", "energy", "event_id")
+
+    def __init__(self, points: ndarray, energy: ndarray, event_id: int = -1):
+        self.points = np.ascontiguousarray(points, dtype="double")
+        self.energy = np.ascontiguousarray(energy, dtype="double")
+        self.event_id = event_id
+        assert self.points.shape == (self.energy.shape[0], 3)
+
+    @classmethod
+    def from_dataframe(cls, df: DataFrame) -> "XT":
+        return cls(df[["x", "y", "z"]].to_numpy(), df["energy"].to_numpy())
+
+    @property
+    def df(self) -> DataFrame:
+        df = DataFrame(self.points, columns=["x", "y", "z"])
+        df["energy"] = self.energy
+        return df
 
 
 class X:
@@ -35,6 +59,8 @@ class X:
     occurred.
     """
 
+    __slots__ = ("xyz",)
+
     def __init__(self, xyz: ndarray):
         self.xyz = xyz
 
@@ -45,78 +71,269 @@ class Y:
     taking the waveforms DataFrame and ignoring everything except sensor_id,
     charge columns (as they all fall in the 0 time bin)
 
-    We also denormalize x, y, z coords of sensors to this to make stuff more convenient
+    The x, y, z coords of the sensors are available as points, resolved from
+    the sensor geometry the first time they are accessed
+
+    Parameters
+    ----------
+
+    sensor_id : ndarray
+        (n,) - shaped array of sensor ids
+    charge : ndarray
+        (n,) - shaped array of counts
+    points : ndarray
+        (n, 3) - shaped array of sensor positions, if not given they are
+        looked up in geometry
+    geometry : SensorGeometry
+        positions of all the sensors
+    """
+
+    __slots__ = ("sensor_id", "charge", "geometry", "_points")
+
+    def __init__(
+        self,
+        sensor_id: ndarray,
+        charge: ndarray,
+        points: Optional[ndarray] = None,
+        geometry: Optional[SensorGeometry] = None,
+    ):
+        assert points is not None or geometry is not None
+        self.sensor_id = sensor_id
+        self.charge = np.ascontiguousarray(charge, dtype="double")
+        self.geometry = geometry
+        self._points: Optional[ndarray] = None
+        if points is not None:
+            self._points = np.ascontiguousarray(points, dtype="double")
+            assert self._points.shape == (self.charge.shape[0], 3)
+
+    @classmethod
+    def from_dataframe(cls, df: DataFrame) -> "Y":
+        return cls(
+            df["sensor_id"].to_numpy(),
+            df["charge"].to_numpy(),
+            df[["x", "y", "z"]].to_numpy(),
+        )
+
+    @property
+    def points(self) -> ndarray:
+        if self._points is None:
+            assert self.geometry is not None
+            self._points = self.geometry.lookup(self.sensor_id)
+        return self._points
+
+    @property
+    def df(self) -> DataFrame:
+        df = DataFrame(self.points, columns=["x", "y", "z"])
+        df["sensor_id"] = self.sensor_id
+        df["charge"] = self.charge
+        return df
+
+
+def hits_table(hits: DataFrame) -> EventTable:
+    """
+    Hits as an EventTable with points and energy columns.
     """
 
-    def __init__(self, df: DataFrame):
-        self.df = df
-        for col in "sensor_id charge x y z".split():
-            assert col in df
+    return EventTable.from_columns(
+        {
+            "event_id": hits["event_id"].to_numpy(),
+            "points": hits[["x", "y", "z"]].to_numpy(dtype="double"),
+            "energy": hits["energy"].to_numpy(dtype="double"),
+        }
+    )
+
+
+def waveforms_table(waveforms: DataFrame) -> EventTable:
+    """
+    Waveforms as an EventTable with sensor_id and charge columns, sensor
+    positions are resolved per event through a SensorGeometry.
+    """
+
+    return EventTable.from_columns(
+        {
+            "event_id": waveforms["event_id"].to_numpy(),
+            "sensor_id": waveforms["sensor_id"].to_numpy(),
+            "charge": waveforms["charge"].to_numpy(dtype="double"),
+        }
+    )
 
 
 class Simulator:
     def __init__(self, positions: DataFrame, hits: DataFrame, waveforms: DataFrame):
-        self.positions = positions
+        self.init_tables(
+            SensorGeometry.from_dataframe(positions),
+            hits_table(hits),
+            waveforms_table(waveforms),
+        )
 
-        self.hits: Dict[int, DataFrame] = {}
-        for event_id, df in hits.groupby("event_id"):
-            self.hits[event_id] = df
+    @classmethod
+    def from_tables(
+        cls, geometry: SensorGeometry, hits: EventTable, waveforms: EventTable
+    ) -> "Simulator":
+        """
+        Build a Simulator from prepared tables, eg. loaded by petutils.preprocess
+        """
 
-        # make x, y, z coordinates easy to access for counts
-        ext_waveforms = waveforms.join(
-            self.positions.set_index("sensor_id"), on="sensor_id"
-        )
+        sim = cls.__new__(cls)
+        sim.init_tables(geometry, hits, waveforms)
+        return sim
 
-        self.waveforms: Dict[int, DataFrame] = {}
-        for event_id, df in ext_waveforms.groupby("event_id"):
-            self.waveforms[event_id] = df
+    def init_tables(
+        self, geometry: SensorGeometry, hits: EventTable, waveforms: EventTable
+    ):
+        self.geometry = geometry
+        self.hits = hits
+        self.waveforms = waveforms
 
-        self.event_ids = sorted(
-            set(self.hits.keys()).intersection(self.waveforms.keys())
-        )
+        self.event_ids = np.intersect1d(
+            self.hits.event_ids, self.waveforms.event_ids
+        ).tolist()
 
         # current index into event_ids
         self.cur = 0
 
+    @property
+    def positions(self) -> DataFrame:
+        return self.geometry.df
+
+    def to_shared(self) -> "Simulator":
+        """
+        Copy of the simulator with its tables in shared memory, so it can be
+        sent to worker processes (eg. by experiment.Runner.run_parallel)
+        without copying the events. Call unlink when done with it.
+        """
+
+        sim = Simulator.from_tables(
+            self.geometry, self.hits.to_shared(), self.waveforms.to_shared()
+        )
+        sim.cur = self.cur
+        return sim
+
+    def unlink(self):
+        self.hits.unlink()
+        self.waveforms.unlink()
+
+    def event_id(self) -> int:
+        """
+        Id of the event sample returns next.
+        """
+
+        return self.event_ids[self.cur] if self.cur < len(self.event_ids) else -1
+
     def sample(self) -> Tuple[XT, Y]:
         event_id = self.event_ids[self.cur]
 
-        xt = XT(self.hits[event_id])
-        y = Y(self.waveforms[event_id])
+        hits = self.hits.get(event_id)
+        xt = XT(hits["points"], hits["energy"], event_id)
+
+        waveforms = self.waveforms.get(event_id)
+        y = Y(waveforms["sensor_id"], waveforms["charge"], geometry=self.geometry)
 
         self.cur += 1
         return xt, y
 
 
 class EMDLoss:
+    """
+    Earth mover's distance between the real energy distribution and the
+    predicted energy distribution, which is simply all probability mass
+    at the predicted point.
+
+    Parameters
+    ----------
+
+    solver : str
+        one of the petutils.emd.SOLVERS backends; "sinkhorn" trades exactness
+        for speed, see approximation_error
+    eps : float
+        entropic regularization used by the "sinkhorn" solver
+    voxel_sizes : Sequence[float]
+        if given, approximate coarse to fine with petutils.emd.multiscale_emd
+        on hits voxelized at these sizes
+    """
+
+    def __init__(
+        self,
+        solver: str = "transport",
+        eps: float = 1e-2,
+        voxel_sizes: Optional[Sequence[float]] = None,
+    ):
+        assert solver in SOLVERS
+        self.solver = solver
+        self.eps = eps
+        self.voxel_sizes = voxel_sizes
+
     def loss(self, xt: XT, x: X) -> float:
+        if self.voxel_sizes is not None:
+            return multiscale_emd(*self.problem(xt, x), self.voxel_sizes).distance
+
+        if self.solver == "sinkhorn":
+            res = sinkhorn_emd(*pad_batch([self.problem(xt, x)]), eps=self.eps)
+            return float(res.distance[0])
+
+        loss, _ = sparse_emd(*self.problem(xt, x), solver=self.solver)
+        return loss
+
+    def loss_batch(self, xts: Sequence[XT], xs: Sequence[X]) -> ndarray:
+        """
+        Losses for many (xt, x) pairs; with the default exact solver this
+        is a single segmented reduction over all the hits, as the distance
+        to a point mass is the energy weighted mean distance to it.
+        """
+
+        if self.voxel_sizes is not None:
+            return np.array([self.loss(xt, x) for xt, x in zip(xts, xs)])
+
+        if self.solver == "sinkhorn":
+            problems = [self.problem(xt, x) for xt, x in zip(xts, xs)]
+            return sinkhorn_emd(*pad_batch(problems), eps=self.eps).distance
+
+        sizes = np.array([xt.energy.shape[0] for xt in xts])
+        assert np.all(sizes > 0), "events must have hits"
+
+        energy = np.concatenate([xt.energy for xt in xts])
+        points = np.concatenate([xt.points for xt in xts])
+        targets = np.repeat(
+            np.array([x.xyz for x in xs], dtype="double"), sizes, axis=0
+        )
+
+        starts = np.cumsum(sizes) - sizes
+        dist = np.sqrt(np.sum((points - targets) ** 2, axis=1))
+
+        return np.add.reduceat(energy * dist, starts) / np.add.reduceat(energy, starts)
+
+    def approximation_error(self, xt: XT, x: X) -> float:
         """
-        Earth mover's distance between the real energy distribution and the
-        predicted energy distribution, which is simply all probability mass
-        at the predicted point.
+        How far the loss computed by the configured solver is from the exact
+        earth mover's distance.
+        """
+
+        exact, _ = sparse_emd(*self.problem(xt, x), solver="transport")
+        return self.loss(xt, x) - exact
 
-        Special casing the calculation instead of using the generalized emd.py
-        code because that fails in some cases, either because my implementation
-        is buggy or because I hit a scipy.optimize.linprog bug.
+    def problem(self, xt: XT, x: X) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        """
+        Arguments for sparse_emd comparing xt to x.
         """
 
-        xt_energy = np.array(xt.df["energy"]).astype("double")
-        xt_density = xt_energy / np.sum(xt_energy)
+        xt_density = xt.energy / np.sum(xt.energy)
 
-        xt_points = np.array(xt.df[["x", "y", "z"]])
+        xt_points = xt.points
 
         x_points = np.array([x.xyz])
 
         x_density = np.array([1.0], dtype="double")
 
-        loss, _ = sparse_emd(xt_density, xt_points, x_density, x_points)
-        return loss
+        return xt_density, xt_points, x_density, x_points
 
 
 class DumbPredictor:
     def predict(self, _y: Y) -> X:
         return X(np.array([0.0, 0.0, 0.0]))
 
+    def predict_batch(self, ys: Sequence[Y]) -> List[X]:
+        return [X(xyz) for xyz in np.zeros((len(ys), 3))]
+
 
 class RndMarginalPredictor:
     """
@@ -130,6 +347,10 @@ class RndMarginalPredictor:
     def predict(self, _y: Y) -> X:
         return X(random.choice(self.positions))
 
+    def predict_batch(self, ys: Sequence[Y]) -> List[X]:
+        # same draws as predict, so batched runs match unbatched ones
+        return [self.predict(y) for y in ys]
+
 
 class BarycenterPredictor:
     """
@@ -139,10 +360,9 @@ class BarycenterPredictor:
     """
 
     def predict(self, y: Y) -> X:
-        charge = np.array(y.df["charge"])
-        density = charge / np.sum(charge)
+        density = y.charge / np.sum(y.charge)
 
-        points = np.array(y.df[["x", "y", "z"]])
+        points = y.points
 
         x = np.sum(points[:, 0] * density)
         y = np.sum(points[:, 1] * density)
@@ -150,6 +370,24 @@ class BarycenterPredictor:
 
         return X(np.array([x, y, z]))
 
+    def predict_batch(self, ys: Sequence[Y]) -> List[X]:
+        """
+        Barycenters of all observations in one segmented reduction over
+        their concatenated charges and positions.
+        """
+
+        sizes = np.array([y.charge.shape[0] for y in ys])
+        assert np.all(sizes > 0), "observations must have counts"
+
+        charge = np.concatenate([y.charge for y in ys])
+        points = np.concatenate([y.points for y in ys])
+        starts = np.cumsum(sizes) - sizes
+
+        weighted = np.add.reduceat(points * charge[:, None], starts, axis=0)
+        total = np.add.reduceat(charge, starts)
+
+        return [X(xyz) for xyz in weighted / total[:, None]]
+
 
 class Plotter:
     def __init__(self, positions: DataFrame):
@@ -184,10 +422,12 @@ class Plotter:
         ax.scatter(pos["x"], pos["y"], pos["z"], c="blue", alpha=0.1)
 
         # draw hits
-        ax.scatter(xt.df["x"], xt.df["y"], xt.df["z"], c="red", alpha=1.0)
+        ax.scatter(
+            xt.points[:, 0], xt.points[:, 1], xt.points[:, 2], c="red", alpha=1.0
+        )
 
         # draw counts
-        ax.scatter(y.df["x"], y.df["y"], y.df["z"], c="green", alpha=0.5)
+        ax.scatter(y.points[:, 0], y.points[:, 1], y.points[:, 2], c="green", alpha=0.5)
 
         # draw prediction
         ax.scatter([x.xyz[0]], [x.xyz[1]], [x.xyz[2]], c="black", alpha=1.0, marker="^")
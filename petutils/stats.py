@@ -0,0 +1,226 @@
+"""
+Running accumulators for summarizing long runs in constant memory: Welford
+mean and variance, uniform reservoir samples and fixed bin histograms.
+"""
+
+from typing import Generic, List, Optional, Tuple, TypeVar
+
+import numpy as np
+import scipy.stats
+from numpy import ndarray
+
+T = TypeVar("T")
+
+
+class Welford:
+    """
+    Numerically stable running mean and variance.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self.m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def add_batch(self, values: ndarray):
+        batch = Welford()
+        batch.count = values.shape[0]
+        if batch.count:
+            batch.mean = float(np.mean(values))
+            batch.m2 = float(np.sum((values - batch.mean) ** 2))
+            self.merge(batch)
+
+    def merge(self, other: "Welford"):
+        """
+        Combine with the statistics of other values, see Chan et al.
+        "Updating formulae and a pairwise algorithm for computing sample variances"
+        """
+
+        count = self.count + other.count
+        if count == 0:
+            return
+
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self) -> float:
+        """
+        Population variance like np.var, nan if empty.
+        """
+
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    @property
+    def standard_error(self) -> float:
+        """
+        Standard error of the mean, from the unbiased variance estimate;
+        inf with fewer than 2 values.
+        """
+
+        if self.count < 2:
+            return np.inf
+        return float(np.sqrt(self.m2 / (self.count - 1) / self.count))
+
+    def halfwidth(self, confidence: float) -> float:
+        """
+        Half width of the normal approximation confidence interval of the mean.
+        """
+
+        return z_score(confidence) * self.standard_error
+
+
+def z_score(confidence: float) -> float:
+    """
+    z such that a standard normal falls in [-z, z] with probability confidence.
+    """
+
+    return float(scipy.stats.norm.ppf(0.5 + confidence / 2))
+
+
+class Reservoir(Generic[T]):
+    """
+    Uniform random sample of at most size of the items added so far,
+    see Vitter's algorithm R.
+
+    Parameters
+    ----------
+
+    size : int
+        maximum number of items kept
+    seed : int
+        seed of the reservoir's own generator, which leaves the global ones alone
+    """
+
+    def __init__(self, size: int, seed: Optional[int] = None):
+        self.size = size
+        self.count = 0
+        self.items: List[T] = []
+        self.rng = np.random.RandomState(seed)
+
+    def add(self, item: T):
+        self.count += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            k = self.rng.randint(self.count)
+            if k < self.size:
+                self.items[k] = item
+
+
+class Histogram:
+    """
+    Counts of values in bins equally spaced over [lo, hi), plus the counts of
+    values below and above the range.
+    """
+
+    def __init__(self, lo: float, hi: float, bins: int = 100):
+        assert lo < hi
+        self.edges = np.linspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins, dtype="int64")
+        self.under = 0
+        self.over = 0
+
+    def add_batch(self, values: ndarray):
+        self.under += int(np.sum(values < self.edges[0]))
+        self.over += int(np.sum(values >= self.edges[-1]))
+        counts, _ = np.histogram(values, self.edges)
+        # np.histogram includes hi in the last bin
+        counts[-1] -= int(np.sum(values == self.edges[-1]))
+        self.counts += counts
+
+    def quantile(self, q: float) -> float:
+        """
+        Quantile interpolated within its bin; values out of range are
+        clamped to lo or hi.
+        """
+
+        cum = self.under + np.concatenate([[0], np.cumsum(self.counts)])
+        target = q * (cum[-1] + self.over)
+
+        if target <= cum[0]:
+            return float(self.edges[0])
+        if target >= cum[-1]:
+            return float(self.edges[-1])
+
+        k = int(np.searchsorted(cum, target, side="right")) - 1
+        frac = (target - cum[k]) / self.counts[k]
+        return float(self.edges[k] + frac * (self.edges[k + 1] - self.edges[k]))
+
+
+class LossStats:
+    """
+    Summary of the losses of one predictor: running mean and variance, a
+    reservoir of losses for plotting and quantiles and, given a range,
+    a histogram.
+
+    Parameters
+    ----------
+
+    reservoir_size : int
+        number of losses kept
+    hist_range : Tuple[float, float]
+        if given, also histogram the losses over this range
+    bins : int
+        number of histogram bins
+    seed : int
+        seed of the reservoir
+    """
+
+    def __init__(
+        self,
+        reservoir_size: int = 10000,
+        hist_range: Optional[Tuple[float, float]] = None,
+        bins: int = 100,
+        seed: Optional[int] = None,
+    ):
+        self.moments = Welford()
+        self.reservoir: Reservoir[float] = Reservoir(reservoir_size, seed)
+        self.histogram: Optional[Histogram] = None
+        if hist_range is not None:
+            self.histogram = Histogram(hist_range[0], hist_range[1], bins)
+
+    def add_batch(self, losses: ndarray):
+        self.moments.add_batch(losses)
+        for loss in losses.tolist():
+            self.reservoir.add(loss)
+        if self.histogram is not None:
+            self.histogram.add_batch(losses)
+
+    @property
+    def count(self) -> int:
+        return self.moments.count
+
+    @property
+    def mean(self) -> float:
+        return self.moments.mean
+
+    @property
+    def std(self) -> float:
+        return self.moments.std
+
+    @property
+    def losses(self) -> ndarray:
+        """
+        Uniform sample of the losses.
+        """
+
+        return np.array(self.reservoir.items)
+
+    def quantile(self, q: float) -> float:
+        if self.histogram is not None:
+            return self.histogram.quantile(q)
+        return float(np.quantile(self.losses, q))
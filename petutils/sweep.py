@@ -0,0 +1,296 @@
+"""
+Sweeps over detector configurations, eg. geometries, sensor counts and sipm
+types: each configuration maps a set of nexus output files to predictors and
+loss settings, configurations are run in a pool of processes, and their
+results are gathered into a single table of loss (and cost) per
+configuration and predictor.
+
+Results of each configuration are stored in <output>/<name>.h5 (see
+petutils.results), configurations with stored results are skipped, and an
+interrupted configuration resumes from its last checkpoint, so a sweep can
+simply be restarted after a crash.
+
+A sweep is described by a json file:
+
+    {
+        "output": "sweep_results",
+        "workers": 4,
+        "configs": [
+            {
+                "name": "std1_20000",
+                "files": "std1_20000/*.pet.h5",
+                "params": {"geometry": "std.1", "sensors": 20000, "cost": 1.0},
+                "predictors": ["BarycenterPredictor"],
+                "loss": {"solver": "transport"},
+                "num_samples": 10000
+            }
+        ],
+        "grid": [
+            {
+                "template": {
+                    "name": "{geometry}_{solver}",
+                    "files": "{geometry}/*.pet.h5",
+                    "loss": {"solver": "{solver}"}
+                },
+                "values": {"geometry": ["std.1", "std.2"], "solver": ["transport"]}
+            }
+        ]
+    }
+
+where each grid entry expands to one configuration per combination of values.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from pandas import DataFrame
+
+from petutils.experiment import Experiment, Predictor, Runner
+from petutils.results import ResultsWriter, summarize
+from petutils.sharded import ShardedDataset
+from petutils.simplified import (
+    BarycenterPredictor,
+    DumbPredictor,
+    EMDLoss,
+    RndMarginalPredictor,
+)
+
+
+def rnd_marginal(dataset: ShardedDataset) -> RndMarginalPredictor:
+    points = dataset.shard(0).hits.columns["points"]
+    return RndMarginalPredictor(DataFrame(points, columns=["x", "y", "z"]))
+
+
+PREDICTORS: Dict[str, Callable[[ShardedDataset], Predictor]] = {
+    "BarycenterPredictor": lambda _: BarycenterPredictor(),
+    "DumbPredictor": lambda _: DumbPredictor(),
+    "RndMarginalPredictor": rnd_marginal,
+}
+
+
+class Config(NamedTuple):
+    """
+    Parameters
+    ----------
+
+    name : str
+        unique name, also names the results file
+    files : str
+        glob matching the nexus output files
+    params : Dict[str, Any]
+        columns describing the configuration in the table, eg. geometry, cost
+    predictors : Sequence[str]
+        names of predictors in PREDICTORS
+    loss : Dict[str, Any]
+        keyword arguments of simplified.EMDLoss
+    num_samples : int
+        maximum number of events to evaluate
+    seed : int
+        seed of the global random generators
+    """
+
+    name: str
+    files: str
+    # None rather than {} defaults, which every config would share
+    params: Optional[Dict[str, Any]] = None
+    predictors: Sequence[str] = ("BarycenterPredictor",)
+    loss: Optional[Dict[str, Any]] = None
+    num_samples: int = 1000
+    seed: int = 0
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Config":
+        config = cls(**d)
+        config = config._replace(
+            params=dict(config.params or {}), loss=dict(config.loss or {})
+        )
+        for name in config.predictors:
+            if name not in PREDICTORS:
+                raise Exception("unknown predictor {0}".format(name))
+        return config
+
+
+def fill(template: Any, params: Dict[str, Any]) -> Any:
+    """
+    Format the strings in template with params; a string that is exactly
+    one "{key}" is replaced by the value itself, so it keeps its type.
+    """
+
+    if isinstance(template, dict):
+        return {key: fill(value, params) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fill(value, params) for value in template]
+    if isinstance(template, str):
+        key = template[1:-1]
+        if template == "{" + key + "}" and key in params:
+            return params[key]
+        return template.format(**params)
+    return template
+
+
+def expand(template: Dict[str, Any], values: Dict[str, Sequence]) -> List[Config]:
+    """
+    One configuration per combination of values, filling the template's
+    strings with them, eg. "loss": {"solver": "{solver}"}; the values are
+    added to the params.
+    """
+
+    configs = []
+    keys = sorted(values)
+    for combination in itertools.product(*[values[key] for key in keys]):
+        params = dict(zip(keys, combination))
+        d = fill(template, params)
+        d["params"] = {**d.get("params", {}), **params}
+        configs.append(Config.from_dict(d))
+    return configs
+
+
+def load_sweep(filename: str) -> Dict[str, Any]:
+    """
+    Read a sweep description, expanding its grid into configs.
+    """
+
+    with open(filename) as f:
+        sweep = json.load(f)
+
+    configs = [Config.from_dict(d) for d in sweep.get("configs", [])]
+    for grid in sweep.get("grid", []):
+        configs.extend(expand(grid["template"], grid["values"]))
+
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise Exception("configuration names must be unique")
+
+    return {
+        "output": sweep.get("output", "."),
+        "workers": sweep.get("workers"),
+        "configs": configs,
+    }
+
+
+def results_filename(output: str, config: Config) -> str:
+    return os.path.join(output, config.name + ".h5")
+
+
+def run_config(config: Config, output: str, checkpoint_every: int = 1000) -> str:
+    """
+    Run a configuration, writing its results to output. Results are written
+    to a temporary file, renamed when complete, and the run checkpoints so
+    it can resume if interrupted.
+
+    Returns
+    -------
+
+    str
+        results filename
+    """
+
+    filename = results_filename(output, config)
+    partial = filename + ".partial"
+    checkpoint = filename + ".checkpoint"
+
+    # a partial results file without a checkpoint can't be resumed
+    if os.path.exists(partial) and not os.path.exists(checkpoint):
+        os.remove(partial)
+
+    random.seed(config.seed)
+    np.random.seed(config.seed)
+
+    with ShardedDataset(config.files, workers=1) as dataset:
+        predictors = [PREDICTORS[name](dataset) for name in config.predictors]
+        expt = Experiment(dataset, predictors, EMDLoss(**(config.loss or {})))
+        num = min(config.num_samples, len(dataset))
+
+        with ResultsWriter(partial, config.predictors) as results:
+            runner = Runner(expt, keep_samples=False, results=results)
+            runner.run(num, checkpoint=checkpoint, checkpoint_every=checkpoint_every)
+
+    os.replace(partial, filename)
+    return filename
+
+
+def run_sweep(
+    configs: Sequence[Config], output: str, workers: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    Run the configurations without stored results in a pool of at most
+    workers processes. A failing configuration doesn't stop the others.
+
+    Returns
+    -------
+
+    Dict[str, str]
+        error message of each failed configuration
+    """
+
+    os.makedirs(output, exist_ok=True)
+    pending = [
+        config
+        for config in configs
+        if not os.path.exists(results_filename(output, config))
+    ]
+    print("{0} of {1} configurations to run".format(len(pending), len(configs)))
+
+    errors = {}
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {
+            pool.submit(run_config, config, output): config for config in pending
+        }
+        for future in as_completed(futures):
+            config = futures[future]
+            try:
+                print("done", config.name, future.result())
+            except Exception as e:
+                print("failed", config.name, repr(e))
+                errors[config.name] = repr(e)
+
+    return errors
+
+
+def table(configs: Sequence[Config], output: str) -> DataFrame:
+    """
+    One row per configuration with stored results and predictor: the
+    configuration's params followed by loss count, mean and std and mean time
+    per event.
+    """
+
+    rows = []
+    for config in configs:
+        filename = results_filename(output, config)
+        if not os.path.exists(filename):
+            continue
+        for predictor, summary in summarize(filename).items():
+            rows.append(
+                {
+                    "config": config.name,
+                    **(config.params or {}),
+                    "predictor": predictor,
+                    **summary,
+                }
+            )
+    return DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("command", choices=["run", "table"], help="command to execute")
+
+    parser.add_argument(
+        "--sweep_file", required=True, help="json file describing the sweep"
+    )
+
+    args = parser.parse_args()
+
+    sweep = load_sweep(args.sweep_file)
+
+    if args.command == "run":
+        run_sweep(sweep["configs"], sweep["output"], sweep["workers"])
+
+    print(table(sweep["configs"], sweep["output"]).to_string(index=False))
@@ -0,0 +1,137 @@
+import os
+import pickle
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+import numpy as np
+from numpy import ndarray
+
+from petutils.cache import CachedLoss, digest
+from petutils.experiment import Experiment, Predictor, Runner
+from petutils.simplified import (
+    XT,
+    BarycenterPredictor,
+    DumbPredictor,
+    EMDLoss,
+    Simulator,
+)
+from petutils.test_reader import hits, positions, waveforms
+from petutils.trivial_example import Loss, get_experiment
+
+
+class CountingLoss(EMDLoss):
+    def __init__(self):
+        super().__init__()
+        self.pairs = 0
+
+    def loss_batch(self, xts: Sequence, xs: Sequence) -> ndarray:
+        self.pairs += len(xts)
+        return super().loss_batch(xts, xs)
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_digest(self):
+        a = XT(np.zeros((2, 3)), np.ones(2))
+        b = XT(np.zeros((2, 3)), np.ones(2))
+        c = XT(np.zeros((2, 3)), np.array([1.0, 2.0]))
+        self.assertEqual(digest(a), digest(b))
+        self.assertNotEqual(digest(a), digest(c))
+
+    def test_lru(self):
+        cached = CachedLoss(Loss(), size=2)
+        expt = get_experiment()
+        for _ in range(3):
+            xt, y = expt.sim.sample()
+            x = expt.predictors[0].predict(y)
+            self.assertEqual(cached.loss(xt, x), cached.loss(xt, x))
+
+        self.assertEqual(cached.misses, 3)
+        self.assertEqual(cached.hits, 3)
+        self.assertEqual(len(cached.memory), 2)
+
+    def test_experiment(self):
+        sim = Simulator(positions, hits, waveforms)
+        counting = CountingLoss()
+        cached = CachedLoss(counting)
+        predictors: List[Predictor] = [BarycenterPredictor(), DumbPredictor()]
+
+        def run() -> ndarray:
+            sim.cur = 0
+            runner = Runner(Experiment(sim, predictors, cached))
+            runner.run(len(sim.event_ids), batch_size=2)
+            return np.array(list(runner.get_losses_dict().values()))
+
+        first = run()
+        self.assertEqual(counting.pairs, 2 * len(sim.event_ids))
+        self.assertEqual(cached.hits, 0)
+
+        second = run()
+        self.assertEqual(counting.pairs, 2 * len(sim.event_ids))
+        self.assertEqual(cached.hits, 2 * len(sim.event_ids))
+        np.testing.assert_array_equal(first, second)
+
+        sim.cur = 0
+        uncached = Runner(Experiment(sim, predictors, EMDLoss()))
+        uncached.run(len(sim.event_ids), batch_size=2)
+        losses = np.array(list(uncached.get_losses_dict().values()))
+        np.testing.assert_allclose(first, losses)
+
+    def test_store(self):
+        store = os.path.join(self.tmpdir.name, "losses")
+        sim = Simulator(positions, hits, waveforms)
+        xt, y = sim.sample()
+        x = BarycenterPredictor().predict(y)
+
+        cached = CachedLoss(EMDLoss(), store=store)
+        loss = cached.loss(xt, x)
+        cached.close()
+
+        counting = CountingLoss()
+        cached = CachedLoss(counting, store=store, namespace=cached.namespace)
+        self.assertEqual(list(cached.loss_batch([xt], [x])), [loss])
+        self.assertEqual(counting.pairs, 0)
+        self.assertEqual(cached.store_hits, 1)
+
+        # other loss settings don't share results
+        other = CachedLoss(EMDLoss(solver="sinkhorn"), store=store)
+        other.loss(xt, x)
+        self.assertEqual(other.misses, 1)
+        other.close()
+
+        copy = pickle.loads(pickle.dumps(cached))
+        self.assertIsNone(copy.store)
+        self.assertEqual(copy.loss(xt, x), loss)
+        cached.close()
+
+    def test_threads(self):
+        store = os.path.join(self.tmpdir.name, "losses")
+        cached = CachedLoss(Loss(), size=4, store=store)
+        expt = get_experiment()
+        pairs = []
+        for _ in range(20):
+            xt, y = expt.sim.sample()
+            pairs.append((xt, expt.predictors[0].predict(y)))
+
+        def score(k: int) -> float:
+            xt, x = pairs[k % len(pairs)]
+            return cached.loss(xt, x)
+
+        with ThreadPoolExecutor(8) as pool:
+            losses = list(pool.map(score, range(2000)))
+
+        expected = [Loss().loss(*pairs[k % len(pairs)]) for k in range(2000)]
+        self.assertEqual(losses, expected)
+        self.assertEqual(cached.hits + cached.store_hits + cached.misses, 2000)
+        self.assertLessEqual(len(cached.memory), 4)
+
+        copy = pickle.loads(pickle.dumps(cached))
+        self.assertEqual(copy.loss(*pairs[0]), expected[0])
+        cached.close()
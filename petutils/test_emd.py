@@ -1,8 +1,19 @@
 import unittest
 
 import numpy as np
+import scipy.sparse
 
-from petutils.emd import emd, sparse_emd
+from petutils.emd import (
+    closed_form_emd,
+    emd,
+    multiscale_emd,
+    pad_batch,
+    pruned_emd,
+    sinkhorn_emd,
+    sparse_emd,
+    to_linprog,
+    voxelize,
+)
 
 
 class Test(unittest.TestCase):
@@ -87,3 +98,213 @@ class Test(unittest.TestCase):
 
         dist, _ = sparse_emd(x, x_points, y, np.array([[10.0]]))
         self.assertTrue(np.allclose(dist, 10))
+
+    def test_to_linprog_sparse(self):
+        x = np.array([0.5, 0.5, 0.0])
+        y = np.array([0.25, 0.75])
+        xy_dist = np.arange(6.0).reshape(3, 2)
+
+        linprog = to_linprog(x, y, xy_dist)
+
+        self.assertTrue(scipy.sparse.issparse(linprog.A_eq))
+        self.assertEqual(linprog.A_eq.shape, (5, 6))
+        self.assertEqual(linprog.A_eq.nnz, 12)
+        self.assertIsNone(linprog.A_ub)
+
+        flow = np.arange(6.0)
+        marginals = linprog.A_eq @ flow
+        expected = np.concatenate(
+            [flow.reshape(3, 2).sum(axis=1), flow.reshape(3, 2).sum(axis=0)]
+        )
+        self.assertTrue(np.allclose(marginals, expected))
+
+    def test_large_sparse_emd(self):
+        rng = np.random.RandomState(0)
+        x_points = rng.uniform(size=(200, 3))
+        x = rng.uniform(size=200)
+        x /= x.sum()
+
+        dist, flow = sparse_emd(x, x_points, x, x_points + 1.0)
+
+        self.assertTrue(np.allclose(dist, np.sqrt(3)))
+        self.assertTrue(np.allclose(flow.sum(axis=1), x))
+
+    def test_solvers_agree(self):
+        rng = np.random.RandomState(0)
+
+        for _ in range(50):
+            x_dim, y_dim = rng.randint(1, 12, size=2)
+
+            x = rng.uniform(size=x_dim)
+            x[rng.uniform(size=x_dim) < 0.3] = 0
+            x[0] += 0.1
+            x /= x.sum()
+
+            y = np.round(rng.uniform(size=y_dim) * 3)
+            y[0] += 1
+            y /= y.sum()
+
+            xy_dist = np.round(rng.uniform(size=(x_dim, y_dim)) * 3)
+
+            results = {
+                name: emd(x, y, xy_dist, name) for name in ["transport", "linprog"]
+            }
+            expected, _ = results["linprog"]
+
+            for name, (dist, flow) in results.items():
+                self.assertTrue(np.allclose(dist, expected), name)
+                self.assertTrue(np.allclose(flow.sum(axis=1), x), name)
+                self.assertTrue(np.allclose(flow.sum(axis=0), y), name)
+                self.assertTrue(np.all(flow > -1e-12), name)
+                self.assertTrue(np.allclose(np.sum(flow * xy_dist), dist), name)
+
+    def test_sinkhorn_batch(self):
+        rng = np.random.RandomState(0)
+
+        problems = []
+        for _ in range(20):
+            x_dim, y_dim = rng.randint(1, 10, size=2)
+            x = rng.uniform(size=x_dim)
+            y = rng.uniform(size=y_dim)
+            problems.append(
+                (
+                    x / x.sum(),
+                    rng.uniform(size=(x_dim, 3)),
+                    y / y.sum(),
+                    rng.uniform(size=(y_dim, 3)),
+                )
+            )
+
+        xs, x_points, ys, y_points = pad_batch(problems)
+        self.assertEqual(xs.shape[0], 20)
+        self.assertEqual(x_points.shape[:2], xs.shape)
+        self.assertEqual(y_points.shape[:2], ys.shape)
+
+        res = sinkhorn_emd(xs, x_points, ys, y_points, eps=1e-3, max_iter=10000)
+        exact = np.array([sparse_emd(*problem)[0] for problem in problems])
+
+        self.assertTrue(np.all(res.marginal_error < 1e-6))
+        self.assertTrue(np.all(res.distance >= exact - 1e-6))
+        self.assertTrue(np.all(res.distance <= exact + res.bound + 1e-6))
+        self.assertTrue(np.allclose(res.distance, exact, atol=1e-2))
+
+        # padding carries no flow
+        for k, (x, _, y, _) in enumerate(problems):
+            self.assertTrue(np.allclose(res.flow[k, x.shape[0] :].sum(), 0))
+            self.assertTrue(np.allclose(res.flow[k, :, y.shape[0] :].sum(), 0))
+
+    def test_closed_form_emd(self):
+        rng = np.random.RandomState(0)
+
+        def check(x, x_points, y, y_points):
+            self.assertIsNotNone(closed_form_emd(x, x_points, y, y_points))
+            dist, flow = sparse_emd(x, x_points, y, y_points)
+            expected, _ = sparse_emd(x, x_points, y, y_points, fast_paths=False)
+            self.assertTrue(np.allclose(dist, expected))
+            self.assertTrue(np.allclose(flow.sum(axis=1), x))
+            self.assertTrue(np.allclose(flow.sum(axis=0), y))
+
+        x = rng.uniform(size=7)
+        x /= x.sum()
+        x_points = rng.uniform(size=(7, 3))
+        one = np.array([1.0])
+        one_point = rng.uniform(size=(1, 3))
+
+        check(x, x_points, one, one_point)
+        check(one, one_point, x, x_points)
+        check(x, x_points, x, x_points)
+
+        y = rng.uniform(size=5)
+        y /= y.sum()
+        check(x, x_points[:, :1], y, rng.uniform(size=(5, 1)))
+
+        self.assertIsNone(closed_form_emd(x, x_points, y, rng.uniform(size=(5, 3))))
+
+        # unbalanced densities are rejected like they are by the solvers
+        with self.assertRaises(AssertionError):
+            sparse_emd(one, one_point, np.array([0.5, 0.6]), x_points[:2])
+
+    def test_pruned_emd(self):
+        rng = np.random.RandomState(0)
+
+        x = rng.uniform(size=30)
+        x /= x.sum()
+        x_points = rng.uniform(size=(30, 3))
+        y = rng.uniform(size=20)
+        y /= y.sum()
+        y_points = rng.uniform(size=(20, 3))
+
+        exact, _ = sparse_emd(x, x_points, y, y_points)
+
+        for radius, k in [(0.2, None), (None, 3), (1e-6, None), (None, 1), (0.2, 3)]:
+            dist, flow = pruned_emd(x, x_points, y, y_points, radius=radius, k=k)
+            self.assertTrue(scipy.sparse.issparse(flow))
+            self.assertTrue(dist >= exact - 1e-9)
+            self.assertTrue(np.allclose(np.asarray(flow.sum(axis=1)).ravel(), x))
+            self.assertTrue(np.allclose(np.asarray(flow.sum(axis=0)).ravel(), y))
+
+        dist, flow = sparse_emd(x, x_points, y, y_points, radius=10.0)
+        self.assertTrue(np.allclose(dist, exact))
+        self.assertEqual(flow.shape, (30, 20))
+
+        with self.assertRaises(AssertionError):
+            sparse_emd(x, x_points, y, y_points, radius=0.0)
+        with self.assertRaises(AssertionError):
+            sparse_emd(x, x_points, y, y_points, k=0)
+
+        # pruned problems are solved as linear programs only
+        with self.assertRaises(Exception):
+            sparse_emd(x, x_points, y, y_points, solver="transport", radius=0.2)
+        dist, _ = sparse_emd(x, x_points, y, y_points, solver="linprog", radius=10.0)
+        self.assertTrue(np.allclose(dist, exact))
+
+        # the flow is sparse whenever radius or k are given, even on fast paths
+        one, one_point = np.array([1.0]), y_points[:1]
+        dist, flow = sparse_emd(x, x_points, one, one_point, k=1)
+        self.assertTrue(scipy.sparse.issparse(flow))
+        dist, flow = sparse_emd(x, x_points, one, one_point)
+        self.assertIsInstance(flow, np.ndarray)
+
+        # the exhaustive fallback measures distances in the same norm
+        for p in [1, np.inf]:
+            expected, _ = sparse_emd(x, x_points, y, y_points, p=p, solver="linprog")
+            dist, _ = pruned_emd(x, x_points, y, y_points, p=p, radius=1e-6)
+            self.assertTrue(dist >= expected - 1e-9)
+            dist, _ = pruned_emd(x, x_points, y, y_points, p=p, radius=10.0)
+            self.assertTrue(np.allclose(dist, expected))
+
+    def test_voxelize(self):
+        x = np.array([1.0, 1.0, 2.0, 0.0])
+        x_points = np.array([[0.1, 0.0], [0.3, 0.0], [1.5, 0.0], [2.5, 0.0]])
+
+        vox = voxelize(x, x_points, 1.0)
+
+        self.assertTrue(np.allclose(vox.weights, [2.0, 2.0, 0.0]))
+        self.assertTrue(np.allclose(vox.points, [[0.2, 0], [1.5, 0], [2.5, 0]]))
+        self.assertTrue(np.array_equal(vox.labels, [0, 0, 1, 2]))
+        self.assertTrue(np.allclose(vox.displacement, 0.2))
+
+    def test_multiscale_emd(self):
+        rng = np.random.RandomState(0)
+
+        def cloud(num):
+            centers = rng.uniform(0, 100, size=(3, 3))
+            points = centers[rng.randint(3, size=num)] + rng.normal(size=(num, 3))
+            weights = rng.uniform(size=num)
+            return weights / weights.sum(), points
+
+        x, x_points = cloud(60)
+        y, y_points = cloud(50)
+        exact, _ = sparse_emd(x, x_points, y, y_points)
+
+        res = multiscale_emd(x, x_points, y, y_points, [10.0, 2.0, 0.0])
+
+        self.assertEqual([level.voxel_size for level in res.levels], [10.0, 2.0, 0.0])
+        for level in res.levels:
+            self.assertTrue(level.distance >= exact - level.bound - 1e-9)
+        self.assertEqual(res.levels[-1].bound, 0)
+        self.assertTrue(res.distance >= exact - 1e-9)
+        self.assertTrue(np.allclose(res.distance, exact, rtol=1e-2))
+
+        self.assertTrue(np.allclose(np.asarray(res.flow.sum(axis=1)).ravel(), x))
+        self.assertTrue(np.array_equal(res.x_labels, np.arange(60)))
@@ -0,0 +1,80 @@
+import pickle
+import unittest
+
+import numpy as np
+from pandas import DataFrame
+
+from petutils.events import SHARED_MEMORY, EventTable, SensorGeometry
+
+hits = DataFrame(
+    {
+        "event_id": [3, 0, 3, 1, 0],
+        "x": [1.0, 2.0, 3.0, 4.0, 5.0],
+        "energy": [0.1, 0.2, 0.3, 0.4, 0.5],
+    }
+)
+
+
+class Test(unittest.TestCase):
+    def test_from_dataframe(self):
+        table = EventTable.from_dataframe(hits)
+
+        self.assertEqual(len(table), 3)
+        self.assertTrue(np.array_equal(table.event_ids, [0, 1, 3]))
+        self.assertTrue(np.array_equal(table.offsets, [0, 2, 3, 5]))
+
+        # rows keep their original order within an event
+        self.assertTrue(np.allclose(table.get(0)["x"], [2.0, 5.0]))
+        self.assertTrue(np.allclose(table.get(3)["energy"], [0.1, 0.3]))
+        self.assertTrue(np.allclose(table[1]["x"], [4.0]))
+
+        self.assertIn(3, table)
+        self.assertIn(np.int64(3), table)
+        self.assertNotIn(2, table)
+        self.assertNotIn(7, table)
+        self.assertNotIn(-1, table)
+        self.assertNotIn("3", table)
+        with self.assertRaises(KeyError):
+            table.get(2)
+        with self.assertRaises(KeyError):
+            table.get(7)
+
+    def test_views(self):
+        table = EventTable.from_records(hits.to_records(index=False))
+
+        for event_id in table.event_ids:
+            x = table.get(event_id)["x"]
+            self.assertTrue(np.shares_memory(x, table.columns["x"]))
+
+    def test_sensor_geometry(self):
+        positions = DataFrame(
+            {"sensor_id": [7, 2], "x": [1.0, 2.0], "y": [3.0, 4.0], "z": [5.0, 6.0]}
+        )
+        geometry = SensorGeometry.from_dataframe(positions)
+
+        points = geometry.lookup(np.array([2, 7, 2]))
+        self.assertTrue(np.allclose(points, [[2, 4, 6], [1, 3, 5], [2, 4, 6]]))
+        self.assertTrue(np.all(np.isnan(geometry.lookup(np.array([3])))))
+
+        # ids beyond the largest known one are unknown too
+        points = geometry.lookup(np.array([2, 9, -1]))
+        self.assertTrue(np.allclose(points[0], [2, 4, 6]))
+        self.assertTrue(np.all(np.isnan(points[1:])))
+
+        self.assertTrue(np.allclose(geometry.df, positions))
+
+    @unittest.skipUnless(SHARED_MEMORY, "shared memory needs python 3.8")
+    def test_shared(self):
+        table = EventTable.from_dataframe(hits).to_shared()
+
+        data = pickle.dumps(table)
+        self.assertNotIn(pickle.dumps(table.columns["x"]), data)
+
+        attached = pickle.loads(data)
+        self.assertTrue(np.array_equal(attached.event_ids, [0, 1, 3]))
+        self.assertTrue(np.allclose(attached.get(0)["x"], [2.0, 5.0]))
+        self.assertTrue(np.allclose(attached[3]["energy"], [0.1, 0.3]))
+
+        del attached
+        table.unlink()
+        self.assertEqual(len(table), 0)
@@ -0,0 +1,64 @@
+import unittest
+from typing import List, Tuple
+
+from petutils.experiment import Experiment, Runner
+from petutils.instrument import Instrument
+from petutils.trivial_example import get_experiment
+
+
+class Sink:
+    def __init__(self):
+        self.timings: List[Tuple[str, float, int]] = []
+
+    def on_stage(self, stage: str, seconds: float, events: int):
+        self.timings.append((stage, seconds, events))
+
+
+def instrumented(instrument: Instrument) -> Experiment:
+    expt = get_experiment()
+    return Experiment(expt.sim, expt.predictors, expt.loss, instrument)
+
+
+class Test(unittest.TestCase):
+    def test_stages(self):
+        sink = Sink()
+        instrument = Instrument(hooks=[sink])
+        runner = Runner(instrumented(instrument))
+
+        runner.run(10, batch_size=1)
+        runner.run(20, batch_size=4)
+        runner.run_pipelined(12, batch_size=3, workers=2)
+        runner.run_parallel(8, workers=2, chunk_size=4)
+
+        self.assertEqual(
+            sorted(instrument.stages),
+            [
+                "loss:DumbPredictor",
+                "loss:MeanPredictor",
+                "predict:DumbPredictor",
+                "predict:MeanPredictor",
+                "simulate",
+            ],
+        )
+        self.assertEqual(instrument.stages["simulate"].events, 42)
+        self.assertEqual(instrument.stages["simulate"].calls, 19)
+        self.assertEqual(instrument.stages["loss:MeanPredictor"].events, 42)
+        self.assertEqual(instrument.events, 50)
+        self.assertGreater(instrument.throughput, 0)
+
+        self.assertEqual(len(sink.timings), 5 * 19)
+        self.assertTrue(all(seconds >= 0 for _, seconds, _ in sink.timings))
+
+        runner.print_report()
+
+    def test_captures(self):
+        for profiler in ["cprofile", "tracemalloc"]:
+            instrument = Instrument(slowest=2, profiler=profiler, top=5)
+            runner = Runner(instrumented(instrument))
+            runner.run(10, batch_size=1)
+
+            captures = instrument.slowest_captures()
+            self.assertEqual(len(captures), 2)
+            self.assertGreaterEqual(captures[0].seconds, captures[1].seconds)
+            self.assertEqual(captures[0].event_ids, [-1])
+            self.assertIn(captures[0].report, instrument.report(captures=True))
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from pandas import DataFrame
+
+from petutils.lut import LookupTablePredictor, charge_patterns, column_index
+from petutils.simplified import BarycenterPredictor, Simulator
+
+
+def cylinder_simulator(num: int, seed: int = 0) -> Simulator:
+    """
+    Sensors on a cylinder of radius 100 and length 200, events are single
+    hits inside it and sensors see 1 / distance ** 2 of their energy.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    phi, z = np.meshgrid(np.linspace(0, 2 * np.pi, 24, endpoint=False), [-100, 100])
+    sensors = np.column_stack(
+        [100 * np.cos(phi.ravel()), 100 * np.sin(phi.ravel()), z.ravel()]
+    )
+    positions = DataFrame(sensors, columns=["x", "y", "z"])
+    positions.insert(0, "sensor_id", np.arange(sensors.shape[0]) + 5)
+
+    r = 80 * np.sqrt(rng.uniform(size=num))
+    angle = rng.uniform(0, 2 * np.pi, size=num)
+    points = np.column_stack([r * np.cos(angle), r * np.sin(angle)])
+    points = np.column_stack([points, rng.uniform(-80, 80, size=num)])
+    hits = DataFrame(points, columns=["x", "y", "z"])
+    hits.insert(0, "event_id", np.arange(num))
+    hits["energy"] = 1.0
+
+    distances = np.linalg.norm(points[:, None, :] - sensors[None, :, :], axis=2)
+    waveforms = DataFrame(
+        {
+            "event_id": np.repeat(np.arange(num), sensors.shape[0]),
+            "sensor_id": np.tile(positions["sensor_id"], num),
+            "charge": 1e4 / distances.ravel() ** 2,
+        }
+    )
+
+    return Simulator(positions, hits, waveforms)
+
+
+def mean_error(predictor, sim: Simulator, num: int) -> float:
+    xts, ys = zip(*[sim.sample() for _ in range(num)])
+    xyz = np.array([x.xyz for x in predictor.predict_batch(ys)])
+    return float(np.mean(np.linalg.norm(xyz - [xt.points[0] for xt in xts], axis=1)))
+
+
+class Test(unittest.TestCase):
+    def test_charge_patterns(self):
+        sim = cylinder_simulator(3)
+        _, y = sim.sample()
+        columns = column_index(np.array([7, 5]))
+        patterns = charge_patterns([y, y], columns, 2)
+
+        expected = y.charge[[2, 0]] / np.sum(y.charge[[2, 0]])
+        np.testing.assert_allclose(patterns, [expected, expected])
+
+    def test_predictor(self):
+        sim = cylinder_simulator(3000)
+        sensor_ids = sim.geometry.sensor_ids
+
+        lut = LookupTablePredictor.build(
+            sim, 2500, sensor_ids, voxel_size=10.0, components=8, workers=1
+        )
+        self.assertEqual(sim.cur, 2500)
+
+        lut_error = mean_error(lut, sim, 500)
+        sim.cur = 2500
+        barycenter_error = mean_error(BarycenterPredictor(), sim, 500)
+        self.assertLess(lut_error, 15.0)
+        self.assertLess(lut_error, barycenter_error)
+
+        sim.cur = 2500
+        _, y = sim.sample()
+        np.testing.assert_array_equal(
+            lut.predict(y).xyz, lut.predict_batch([y, y])[1].xyz
+        )
+
+    def test_parallel(self):
+        sim = cylinder_simulator(300)
+        sensor_ids = sim.geometry.sensor_ids
+
+        sequential = LookupTablePredictor.build(sim, 300, sensor_ids, workers=1)
+        sim.cur = 0
+        parallel = LookupTablePredictor.build(
+            sim, 300, sensor_ids, workers=2, chunk_size=64
+        )
+        self.assertEqual(sim.cur, 300)
+
+        np.testing.assert_allclose(sequential.positions, parallel.positions)
+        np.testing.assert_allclose(sequential.mean, parallel.mean)
+
+    def test_save_load(self):
+        sim = cylinder_simulator(200)
+        lut = LookupTablePredictor.build(
+            sim, 150, sim.geometry.sensor_ids, workers=1, neighbours=3
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "lut.npz")
+            lut.save(filename)
+            loaded = LookupTablePredictor.load(filename, neighbours=3)
+
+        ys = [sim.sample()[1] for _ in range(50)]
+        for a, b in zip(lut.predict_batch(ys), loaded.predict_batch(ys)):
+            np.testing.assert_array_equal(a.xyz, b.xyz)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from petutils.preprocess import (
+    cache_dir_for,
+    is_fresh,
+    load_simulator,
+    preprocess,
+    publish,
+)
+from petutils.simplified import Simulator
+from petutils.test_reader import hits, positions, waveforms, write_h5
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "test.pet.h5")
+        write_h5(self.filename)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_load_simulator(self):
+        self.assertFalse(is_fresh(self.filename))
+        cache_dir = preprocess(self.filename)
+        self.assertTrue(os.path.isdir(cache_dir))
+        self.assertTrue(is_fresh(self.filename))
+
+        cached = load_simulator(self.filename)
+        self.assertIsInstance(cached.hits.columns["points"], np.memmap)
+
+        sim = Simulator(positions, hits, waveforms)
+        self.assertEqual(cached.event_ids, sim.event_ids)
+
+        for _ in sim.event_ids:
+            xt, y = cached.sample()
+            sim_xt, sim_y = sim.sample()
+            self.assertTrue(np.allclose(xt.points, sim_xt.points))
+            self.assertTrue(np.allclose(xt.energy, sim_xt.energy))
+            self.assertTrue(np.allclose(y.points, sim_y.points))
+            self.assertTrue(np.allclose(y.charge, sim_y.charge))
+
+    def test_invalidation(self):
+        load_simulator(self.filename)
+        self.assertTrue(is_fresh(self.filename))
+
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertFalse(is_fresh(self.filename))
+
+        load_simulator(self.filename)
+        self.assertTrue(is_fresh(self.filename))
+
+    def test_concurrent(self):
+        with ProcessPoolExecutor(4) as pool:
+            caches = list(pool.map(preprocess, [self.filename] * 8))
+        self.assertEqual(set(caches), {cache_dir_for(self.filename)})
+        self.assertTrue(is_fresh(self.filename))
+
+        # only the cache is left, no staging directories
+        self.assertEqual(
+            sorted(os.listdir(self.tmpdir.name)), ["test.pet.h5", "test.pet.h5.cache"]
+        )
+
+    def test_keep_fresh(self):
+        cache_dir = preprocess(self.filename)
+        inode = os.stat(cache_dir).st_ino
+
+        # a fresh cache is never replaced, the staged one is discarded
+        tmp_dir = tempfile.mkdtemp(dir=self.tmpdir.name)
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            f.write("{}")
+        publish(tmp_dir, self.filename, cache_dir)
+
+        self.assertEqual(os.stat(cache_dir).st_ino, inode)
+        self.assertFalse(os.path.exists(tmp_dir))
+        self.assertTrue(is_fresh(self.filename))
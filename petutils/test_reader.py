@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+from pandas import DataFrame
+
+from petutils.reader import EventReader, iter_events
+from petutils.simplified import Simulator
+
+positions = DataFrame(
+    {"sensor_id": [0, 1], "x": [10.0, -10.0], "y": [10.0, 0.0], "z": [10.0, 5.0]}
+)
+
+hits = DataFrame(
+    {
+        "event_id": [0, 0, 0, 1, 3, 3],
+        "x": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        "y": 1.0,
+        "z": 1.0,
+        "energy": [0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+    }
+)
+
+waveforms = DataFrame(
+    {
+        "event_id": [0, 2, 3, 3, 3],
+        "sensor_id": [0, 1, 0, 1, 0],
+        "charge": [1.0, 2.0, 3.0, 4.0, 5.0],
+    }
+)
+
+
+def write_h5(filename: str):
+    with h5py.File(filename, "w") as f:
+        mc = f.create_group("MC")
+        for name, df in [
+            ("sensor_positions", positions),
+            ("hits", hits),
+            ("waveforms", waveforms),
+        ]:
+            mc.create_dataset(name, data=df.to_records(index=False))
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, "test.pet.h5")
+        write_h5(self.filename)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_iter_events(self):
+        with h5py.File(self.filename, "r") as f:
+            for chunk_size in [1, 2, 4, 100]:
+                events = list(iter_events(f["MC"]["hits"], chunk_size))
+                self.assertEqual([event_id for event_id, _ in events], [0, 1, 3])
+                self.assertEqual([rows.shape[0] for _, rows in events], [3, 1, 2])
+
+    def test_reader(self):
+        sim = Simulator(positions, hits, waveforms)
+
+        for chunk_size in [1, 2, 100]:
+            with EventReader(self.filename, chunk_size) as reader:
+                samples = list(reader)
+
+            self.assertEqual(len(samples), len(sim.event_ids))
+            sim.cur = 0
+            for xt, y in samples:
+                sim_xt, sim_y = sim.sample()
+                self.assertTrue(np.allclose(xt.df["x"], sim_xt.df["x"]))
+                self.assertTrue(np.allclose(y.df["charge"], sim_y.df["charge"]))
+                self.assertTrue(np.allclose(y.df["y"], sim_y.df["y"]))
+
+    def test_sample(self):
+        with EventReader(self.filename, 2) as reader:
+            xt, y = reader.sample()
+            self.assertEqual(xt.df.shape[0], 3)
+            xt, y = reader.sample()
+            self.assertEqual(y.df.shape[0], 3)
+            with self.assertRaises(StopIteration):
+                reader.sample()
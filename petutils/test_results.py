@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+from typing import List
+
+import numpy as np
+
+from petutils.experiment import Experiment, Predictor, Runner
+from petutils.results import (
+    ResultsWriter,
+    compare,
+    get_losses_dict,
+    read_results,
+    summarize,
+)
+from petutils.simplified import BarycenterPredictor, DumbPredictor, EMDLoss, Simulator
+from petutils.test_reader import hits, positions, waveforms
+from petutils.test_trivial_example import FlakyPredictor
+from petutils.trivial_example import Loss
+from petutils.trivial_example import Simulator as TrivialSimulator
+from petutils.trivial_example import get_experiment
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_runner(self):
+        filename = os.path.join(self.tmpdir.name, "results.h5")
+        expt = get_experiment()
+        names = ["DumbPredictor", "MeanPredictor"]
+
+        with ResultsWriter(filename, names, buffer_size=7) as results:
+            runner = Runner(expt, results=results)
+            runner.run(30, batch_size=4)
+
+        # appending to an existing file
+        with ResultsWriter(filename, names, buffer_size=7) as results:
+            runner.results = results
+            runner.run(5)
+
+        losses = get_losses_dict(filename)
+        for name, expected in runner.get_losses_dict().items():
+            self.assertTrue(np.allclose(losses[name], expected))
+
+        columns = read_results(filename).columns
+        self.assertEqual(columns["xyz"].shape, (70, 3))
+        self.assertTrue(np.all(np.isnan(columns["xyz"])))
+        self.assertTrue(np.all(columns["time"] >= 0))
+
+        summary = summarize(filename)
+        self.assertEqual(summary["MeanPredictor"]["count"], 35)
+        self.assertAlmostEqual(
+            summary["MeanPredictor"]["mean"],
+            float(np.mean(losses["MeanPredictor"])),
+        )
+
+        with self.assertRaises(Exception):
+            ResultsWriter(filename, ["MeanPredictor"])
+
+    def test_compare(self):
+        filenames = [os.path.join(self.tmpdir.name, f) for f in ["a.h5", "b.h5"]]
+
+        predictors: List[Predictor] = [DumbPredictor(), BarycenterPredictor()]
+        for filename, predictor in zip(filenames, predictors):
+            sim = Simulator(positions, hits, waveforms)
+            with ResultsWriter(filename, ["Predictor"]) as results:
+                runner = Runner(
+                    Experiment(sim, [predictor], EMDLoss()), results=results
+                )
+                runner.run(len(sim.event_ids))
+
+        columns = read_results(filenames[1]).columns
+        self.assertEqual(columns["event_id"].tolist(), sim.event_ids)
+        self.assertFalse(np.any(np.isnan(columns["xyz"])))
+
+        diff = compare(filenames[0], filenames[1], "Predictor")
+        a, b = [get_losses_dict(filename)["Predictor"] for filename in filenames]
+        self.assertTrue(np.allclose(diff, b - a))
+
+    def test_checkpoint(self):
+        filename = os.path.join(self.tmpdir.name, "results.h5")
+        checkpoint = os.path.join(self.tmpdir.name, "run.pkl")
+
+        for flaky in [FlakyPredictor(fail_at=50), FlakyPredictor()]:
+            expt = Experiment(TrivialSimulator(), [flaky], Loss())
+            with ResultsWriter(filename, ["FlakyPredictor"], buffer_size=8) as results:
+                runner = Runner(expt, results=results)
+                try:
+                    runner.run(60, checkpoint=checkpoint, checkpoint_every=20)
+                except Exception:
+                    pass
+
+        # rows written after the checkpoint before failing are dropped
+        losses = get_losses_dict(filename)["FlakyPredictor"]
+        self.assertTrue(
+            np.array_equal(losses, runner.get_losses_dict()["FlakyPredictor"])
+        )
@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import unittest
+from typing import List
+
+import h5py
+import numpy as np
+
+from petutils.experiment import Experiment, Predictor, Runner
+from petutils.sharded import SHARD_SHIFT, ShardedDataset, index_shard
+from petutils.simplified import (
+    BarycenterPredictor,
+    EMDLoss,
+    RndMarginalPredictor,
+    Simulator,
+)
+from petutils.test_reader import hits, positions, waveforms, write_h5
+
+
+def count_events(pattern: str) -> int:
+    with ShardedDataset(pattern, workers=1) as dataset:
+        return len(dataset)
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for shard in range(3):
+            write_h5(os.path.join(self.tmpdir.name, "run.{0:03d}.pet.h5".format(shard)))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sample(self):
+        pattern = os.path.join(self.tmpdir.name, "run.*.pet.h5")
+        sim = Simulator(positions, hits, waveforms)
+
+        with ShardedDataset(pattern, workers=2) as dataset:
+            self.assertEqual(len(dataset), 3 * len(sim.event_ids))
+            self.assertEqual(dataset.event_ids[: len(sim.event_ids)], [(0, 0), (0, 3)])
+            self.assertEqual(dataset.event_ids[-1], (2, 3))
+
+            for _ in range(3):
+                sim.cur = 0
+                for _ in sim.event_ids:
+                    xt, y = dataset.sample()
+                    sim_xt, sim_y = sim.sample()
+                    self.assertTrue(np.allclose(xt.points, sim_xt.points))
+                    self.assertTrue(np.allclose(y.points, sim_y.points))
+
+            with self.assertRaises(IndexError):
+                dataset.sample()
+
+    def test_in_process(self):
+        # multiprocessing.Pool workers are daemonic and can't start a pool
+        pattern = os.path.join(self.tmpdir.name, "run.*.pet.h5")
+        with multiprocessing.Pool(1) as pool:
+            self.assertEqual(pool.apply(count_events, (pattern,)), 6)
+
+    def test_event_id_range(self):
+        for offset in [1 << SHARD_SHIFT, -10]:
+            filename = os.path.join(self.tmpdir.name, "big{0}.pet.h5".format(offset))
+            with h5py.File(filename, "w") as f:
+                mc = f.create_group("MC")
+                for name, df in [
+                    ("sensor_positions", positions),
+                    ("hits", hits.assign(event_id=hits["event_id"] + offset)),
+                    (
+                        "waveforms",
+                        waveforms.assign(event_id=waveforms["event_id"] + offset),
+                    ),
+                ]:
+                    mc.create_dataset(name, data=df.to_records(index=False))
+
+            with self.assertRaisesRegex(Exception, "outside"):
+                index_shard(filename)
+
+    def test_runner(self):
+        pattern = os.path.join(self.tmpdir.name, "run.*.pet.h5")
+        cache_root = os.path.join(self.tmpdir.name, "cache")
+
+        with ShardedDataset(pattern, cache_root=cache_root) as dataset:
+            runner = Runner(Experiment(dataset, [BarycenterPredictor()], EMDLoss()))
+            runner.run(len(dataset))
+
+        self.assertEqual(len(runner.samples), 6)
+        self.assertEqual(
+            [sample.event_id for sample in runner.samples[-2:]],
+            [(2 << SHARD_SHIFT) | 0, (2 << SHARD_SHIFT) | 3],
+        )
+        self.assertEqual(len(os.listdir(cache_root)), 3)
+
+    def test_parallel_runner(self):
+        pattern = os.path.join(self.tmpdir.name, "run.*.pet.h5")
+        predictors: List[Predictor] = [
+            BarycenterPredictor(),
+            RndMarginalPredictor(hits),
+        ]
+
+        runs = []
+        for workers in [1, 2]:
+            with ShardedDataset(pattern) as dataset:
+                runner = Runner(Experiment(dataset, predictors, EMDLoss()))
+                runner.run_parallel(5, workers=workers, chunk_size=2, seed=1)
+                self.assertEqual(dataset.cur, 5)
+                runs.append(runner.get_losses_dict())
+
+        self.assertEqual(runs[0], runs[1])
+
+        # same events in the same order as a sequential run
+        with ShardedDataset(pattern) as dataset:
+            runner = Runner(Experiment(dataset, predictors[:1], EMDLoss()))
+            runner.run(5)
+            expected = runner.get_losses_dict()["BarycenterPredictor"]
+        self.assertTrue(np.allclose(runs[0]["BarycenterPredictor"], expected))
+
+    def test_pipelined_runner(self):
+        pattern = os.path.join(self.tmpdir.name, "run.*.pet.h5")
+        predictors: List[Predictor] = [
+            BarycenterPredictor(),
+            RndMarginalPredictor(hits),
+        ]
+
+        runs = []
+        for pipelined in [False, True]:
+            random.seed(0)
+            with ShardedDataset(pattern) as dataset:
+                runner = Runner(Experiment(dataset, predictors, EMDLoss()))
+                if pipelined:
+                    runner.run_pipelined(6, batch_size=2, workers=2, processes=True)
+                else:
+                    runner.run(6, batch_size=2)
+                runs.append(runner.get_losses_dict())
+
+        self.assertEqual(runs[0], runs[1])
+
+    def test_no_match(self):
+        with self.assertRaises(Exception):
+            ShardedDataset(os.path.join(self.tmpdir.name, "missing.*.pet.h5"))
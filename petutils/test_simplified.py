@@ -1,11 +1,15 @@
+import random
 import unittest
 
 import numpy as np
 from pandas import DataFrame
 
+from petutils.events import SHARED_MEMORY
+from petutils.experiment import Experiment, Runner
 from petutils.simplified import (
     XT,
     BarycenterPredictor,
+    DumbPredictor,
     EMDLoss,
     RndMarginalPredictor,
     Simulator,
@@ -24,8 +28,8 @@ ext_waveforms = waveforms.join(positions.set_index("sensor_id"), on="sensor_id")
 
 class Test(unittest.TestCase):
     def test_constructors(self):
-        print(XT(hits))
-        print(Y(ext_waveforms))
+        print(XT.from_dataframe(hits))
+        print(Y.from_dataframe(ext_waveforms))
         print(RndMarginalPredictor(hits))
 
     def test_simulator(self):
@@ -33,10 +37,27 @@ class Test(unittest.TestCase):
         xt, y = sim.sample()
         print(xt, y)
 
+        self.assertTrue(np.allclose(xt.points, [[1.0, 1.0, 1.0]]))
+        self.assertTrue(np.allclose(xt.energy, [1.0]))
+        self.assertTrue(np.allclose(y.points, [[10.0, 10.0, 10.0]]))
+        self.assertTrue(np.allclose(y.charge, [20.0]))
+        self.assertTrue(np.allclose(sim.positions, positions))
+
+    def test_dataframe_roundtrip(self):
+        xt = XT.from_dataframe(hits)
+        self.assertTrue(
+            np.allclose(
+                xt.df[["x", "y", "z", "energy"]], hits[["x", "y", "z", "energy"]]
+            )
+        )
+
+        y = Y.from_dataframe(ext_waveforms)
+        self.assertTrue(np.allclose(y.df["charge"], ext_waveforms["charge"]))
+
     def test_emd_loss(self):
         loss = EMDLoss()
 
-        xt = XT(hits)
+        xt = XT.from_dataframe(hits)
         x_eq = X(np.array([1.0, 1.0, 1.0]))
 
         self.assertAlmostEqual(loss.loss(xt, x_eq), 0)
@@ -46,13 +67,87 @@ class Test(unittest.TestCase):
 
     def test_rnd_marginal_predictor(self):
         pred = RndMarginalPredictor(hits)
-        y = Y(ext_waveforms)
+        y = Y.from_dataframe(ext_waveforms)
         x = pred.predict(y)
         print(x)
 
     def test_barycenter_predictor(self):
         pred = BarycenterPredictor()
-        y = Y(ext_waveforms)
+        y = Y.from_dataframe(ext_waveforms)
         x = pred.predict(y)
 
         self.assertTrue(np.allclose(x.xyz, [10, 10, 10]))
+
+    def test_sinkhorn_emd_loss(self):
+        loss = EMDLoss(solver="sinkhorn")
+
+        xt = XT(np.array([[0.0, 0, 0], [2.0, 0, 0]]), np.array([1.0, 1.0]))
+        x = X(np.array([1.0, 1.0, 0.0]))
+
+        self.assertAlmostEqual(loss.loss(xt, x), np.sqrt(2), places=6)
+        self.assertAlmostEqual(loss.approximation_error(xt, x), 0, places=6)
+
+    def test_multiscale_emd_loss(self):
+        loss = EMDLoss(voxel_sizes=[1.0, 0.0])
+
+        xt = XT(np.array([[0.0, 0, 0], [0.1, 0, 0], [2.0, 0, 0]]), np.ones(3))
+        x = X(np.array([2.0, 0.0, 0.0]))
+
+        self.assertAlmostEqual(loss.loss(xt, x), EMDLoss().loss(xt, x))
+
+    def test_emd_loss_batch(self):
+        rng = np.random.RandomState(0)
+
+        xts = []
+        xs = []
+        for num_hits in [1, 5, 3]:
+            xts.append(XT(rng.uniform(size=(num_hits, 3)), rng.uniform(size=num_hits)))
+            xs.append(X(rng.uniform(size=3)))
+
+        for loss in [EMDLoss(), EMDLoss(solver="sinkhorn")]:
+            expected = [loss.loss(xt, x) for xt, x in zip(xts, xs)]
+            self.assertTrue(np.allclose(loss.loss_batch(xts, xs), expected, atol=1e-6))
+
+    @unittest.skipUnless(SHARED_MEMORY, "shared memory needs python 3.8")
+    def test_shared_simulator(self):
+        sim = Simulator(positions, hits, waveforms).to_shared()
+
+        xt, y = sim.sample()
+        self.assertTrue(np.allclose(xt.points, [[1.0, 1.0, 1.0]]))
+        self.assertTrue(np.allclose(y.points, [[10.0, 10.0, 10.0]]))
+
+        sim.cur = 0
+        runner = Runner(Experiment(sim, [BarycenterPredictor()], EMDLoss()))
+        runner.run_parallel(1, workers=2)
+        self.assertTrue(np.allclose(runner.samples[0].y.charge, [20.0]))
+
+        del xt, y, runner
+        sim.unlink()
+
+    def test_predict_batch(self):
+        rng = np.random.RandomState(0)
+
+        ys = []
+        for num_counts in [1, 4, 2]:
+            charge = rng.uniform(size=num_counts)
+            points = rng.uniform(size=(num_counts, 3))
+            ys.append(Y(np.arange(num_counts), charge, points))
+
+        barycenter = BarycenterPredictor()
+        for x, y in zip(barycenter.predict_batch(ys), ys):
+            self.assertTrue(np.allclose(x.xyz, barycenter.predict(y).xyz))
+
+        for x in DumbPredictor().predict_batch(ys):
+            self.assertTrue(np.allclose(x.xyz, 0))
+
+        xs = RndMarginalPredictor(hits).predict_batch(ys)
+        self.assertEqual(len(xs), 3)
+
+        # batched and single predictions draw the same points for a seed
+        points = rng.uniform(size=(100, 3))
+        marginal = RndMarginalPredictor(DataFrame(points, columns=["x", "y", "z"]))
+        random.seed(0)
+        batched = [x.xyz for x in marginal.predict_batch(ys)]
+        random.seed(0)
+        single = [marginal.predict(y).xyz for y in ys]
+        np.testing.assert_array_equal(batched, single)
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from petutils.stats import Histogram, LossStats, Reservoir, Welford
+
+
+class Test(unittest.TestCase):
+    def test_welford(self):
+        rng = np.random.RandomState(0)
+        values = 1e6 + rng.normal(size=1000)
+
+        moments = Welford()
+        for value in values[:10]:
+            moments.add(value)
+        moments.add_batch(values[10:500])
+
+        other = Welford()
+        other.add_batch(values[500:])
+        moments.merge(other)
+
+        self.assertEqual(moments.count, 1000)
+        self.assertAlmostEqual(moments.mean, float(np.mean(values)))
+        self.assertAlmostEqual(moments.std, float(np.std(values)))
+
+        self.assertTrue(np.isnan(Welford().variance))
+
+        standard_error = np.std(values, ddof=1) / np.sqrt(1000)
+        self.assertAlmostEqual(moments.standard_error, float(standard_error))
+        self.assertAlmostEqual(moments.halfwidth(0.95), 1.96 * standard_error, 3)
+
+    def test_reservoir(self):
+        reservoir: Reservoir[int] = Reservoir(100, seed=0)
+        for k in range(10000):
+            reservoir.add(k)
+
+        self.assertEqual(reservoir.count, 10000)
+        self.assertEqual(len(reservoir.items), 100)
+        self.assertEqual(len(set(reservoir.items)), 100)
+        # roughly uniform
+        self.assertTrue(3000 < np.mean(reservoir.items) < 7000)
+
+    def test_histogram(self):
+        values = np.linspace(0, 1, 10001)
+
+        histogram = Histogram(0.0, 2.0, 200)
+        histogram.add_batch(values - 0.5)
+
+        self.assertEqual(histogram.under, 5000)
+        self.assertEqual(histogram.over, 0)
+        self.assertEqual(np.sum(histogram.counts), 5001)
+        self.assertAlmostEqual(histogram.quantile(0.75), 0.25, places=2)
+        self.assertEqual(histogram.quantile(0.25), 0.0)
+
+    def test_loss_stats(self):
+        losses = np.random.RandomState(0).exponential(size=5000)
+
+        stats = LossStats(reservoir_size=1000, hist_range=(0, 10), seed=0)
+        stats.add_batch(losses[:100])
+        stats.add_batch(losses[100:])
+
+        self.assertEqual(stats.count, 5000)
+        self.assertAlmostEqual(stats.mean, float(np.mean(losses)))
+        self.assertEqual(stats.losses.shape, (1000,))
+        self.assertAlmostEqual(stats.quantile(0.5), float(np.median(losses)), places=1)
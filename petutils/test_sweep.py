@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+
+from petutils.results import read_results
+from petutils.sweep import Config, load_sweep, run_sweep, table
+from petutils.test_reader import write_h5
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for geometry in ["std1", "std2"]:
+            os.makedirs(os.path.join(self.tmpdir.name, geometry))
+            for shard in range(2):
+                name = "run.{0:03d}.pet.h5".format(shard)
+                write_h5(os.path.join(self.tmpdir.name, geometry, name))
+
+        self.sweep_file = os.path.join(self.tmpdir.name, "sweep.json")
+        self.output = os.path.join(self.tmpdir.name, "results")
+        sweep = {
+            "output": self.output,
+            "workers": 2,
+            "configs": [
+                {
+                    "name": "broken",
+                    "files": os.path.join(self.tmpdir.name, "missing", "*.pet.h5"),
+                }
+            ],
+            "grid": [
+                {
+                    "template": {
+                        "name": "{geometry}_{solver}",
+                        "files": os.path.join(self.tmpdir.name, "{geometry}", "*.h5"),
+                        "params": {"cost": 1.0},
+                        "loss": {"solver": "{solver}"},
+                        "predictors": ["BarycenterPredictor", "DumbPredictor"],
+                        "num_samples": 3,
+                    },
+                    "values": {
+                        "geometry": ["std1", "std2"],
+                        "solver": ["transport", "linprog"],
+                    },
+                }
+            ],
+        }
+        with open(self.sweep_file, "w") as f:
+            json.dump(sweep, f)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sweep(self):
+        sweep = load_sweep(self.sweep_file)
+        configs = sweep["configs"]
+        self.assertEqual(len(configs), 5)
+        self.assertEqual(configs[1].name, "std1_transport")
+        self.assertEqual(configs[1].loss, {"solver": "transport"})
+        self.assertEqual(
+            configs[1].params, {"cost": 1.0, "geometry": "std1", "solver": "transport"}
+        )
+
+        errors = run_sweep(configs, self.output, sweep["workers"])
+        self.assertEqual(list(errors), ["broken"])
+
+        results = read_results(os.path.join(self.output, "std2_transport.h5"))
+        self.assertEqual(results.columns["loss"].shape, (6,))
+
+        df = table(configs, self.output)
+        self.assertEqual(df.shape[0], 8)
+        self.assertEqual(set(df["predictor"]), {"BarycenterPredictor", "DumbPredictor"})
+        self.assertTrue((df["count"] == 3).all())
+
+        # transport and linprog agree
+        means = df.groupby(["geometry", "predictor"])["mean"]
+        self.assertTrue(((means.max() - means.min()) < 1e-6).all())
+
+        # completed configurations are skipped
+        mtime = os.stat(os.path.join(self.output, "std1_transport.h5")).st_mtime_ns
+        errors = run_sweep(configs, self.output, 1)
+        self.assertEqual(list(errors), ["broken"])
+        self.assertEqual(
+            os.stat(os.path.join(self.output, "std1_transport.h5")).st_mtime_ns, mtime
+        )
+
+    def test_defaults(self):
+        # configs don't share their default params and loss dicts
+        a = Config.from_dict({"name": "a", "files": "*.h5"})
+        b = Config.from_dict({"name": "b", "files": "*.h5"})
+        assert a.params is not None and a.loss is not None
+        a.params["cost"] = 1.0
+        a.loss["solver"] = "sinkhorn"
+        self.assertEqual(b.params, {})
+        self.assertEqual(b.loss, {})
+        self.assertIsNone(Config("c", "*.h5").params)
+
+    def test_unknown_predictor(self):
+        with self.assertRaises(Exception):
+            Config.from_dict({"name": "a", "files": "*.h5", "predictors": ["Oracle"]})
@@ -1,7 +1,36 @@
+import os
+import pickle
+import tempfile
 import unittest
+from typing import Optional
 
-from petutils.experiment import Runner
-from petutils.trivial_example import get_experiment
+import numpy as np
+
+from petutils.experiment import Experiment, Runner
+from petutils.trivial_example import (
+    Loss,
+    MeanPredictor,
+    Simulator,
+    X,
+    Y,
+    get_experiment,
+)
+
+
+class FlakyPredictor(MeanPredictor):
+    """
+    Fails on its fail_at-th prediction.
+    """
+
+    def __init__(self, fail_at: Optional[int] = None):
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def predict(self, y: Y) -> X:
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise Exception("preempted")
+        return super().predict(y)
 
 
 class Test(unittest.TestCase):
@@ -16,3 +45,143 @@ class Test(unittest.TestCase):
         runner.run(20)
 
         runner.print_summary()
+
+    def test_batch(self):
+        expt = get_experiment()
+
+        samples = expt.sample_batch(10)
+        self.assertEqual(len(samples), 10)
+
+        for sample in samples:
+            for x, loss in sample.predictions:
+                self.assertAlmostEqual(loss, expt.loss.loss(sample.xt, x))
+
+        runner = Runner(expt)
+        runner.run(25, batch_size=10)
+        self.assertEqual(len(runner.samples), 25)
+
+    def test_parallel(self):
+        runs = []
+        for workers in [1, 3]:
+            runner = Runner(get_experiment())
+            runner.run_parallel(25, workers=workers, chunk_size=4, seed=0)
+            runs.append(runner.samples)
+
+        self.assertEqual(len(runs[0]), 25)
+        self.assertEqual([s.xt.x for s in runs[0]], [s.xt.x for s in runs[1]])
+        self.assertEqual(
+            [loss for s in runs[0] for _, loss in s.predictions],
+            [loss for s in runs[1] for _, loss in s.predictions],
+        )
+
+    def test_streaming(self):
+        expt = get_experiment()
+        runner = Runner(expt, keep_samples=False, sample_reservoir=5, seed=0)
+        runner.run(1000, batch_size=100)
+
+        self.assertEqual(len(runner.samples), 5)
+        stats = runner.stats["MeanPredictor"]
+        self.assertEqual(stats.count, 1000)
+        self.assertEqual(runner.stats["DumbPredictor"].count, 1000)
+
+        # same statistics as keeping every sample
+        np.random.seed(0)
+        full = Runner(expt)
+        full.run(300)
+        np.random.seed(0)
+        streaming = Runner(expt, keep_samples=False)
+        streaming.run(300)
+
+        losses = full.get_losses_dict()["MeanPredictor"]
+        stats = streaming.stats["MeanPredictor"]
+        self.assertAlmostEqual(stats.mean, float(np.mean(losses)))
+        self.assertAlmostEqual(stats.std, float(np.std(losses)))
+        self.assertEqual(len(streaming.samples), 0)
+        streaming.print_summary()
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            checkpoint = os.path.join(tmpdir, "run.pkl")
+
+            np.random.seed(0)
+            expected = Runner(Experiment(Simulator(), [FlakyPredictor()], Loss()))
+            expected.run(100, batch_size=3, checkpoint=checkpoint, checkpoint_every=20)
+            self.assertFalse(os.path.exists(checkpoint))
+            self.assertFalse(os.path.exists(checkpoint + ".samples"))
+
+            np.random.seed(0)
+            flaky = FlakyPredictor(fail_at=95)
+            runner = Runner(Experiment(Simulator(), [flaky], Loss()))
+            with self.assertRaises(Exception):
+                runner.run(
+                    100, batch_size=3, checkpoint=checkpoint, checkpoint_every=20
+                )
+            self.assertTrue(os.path.exists(checkpoint))
+
+            # each checkpoint appended only the samples taken since the last
+            chunks = []
+            with open(checkpoint + ".samples", "rb") as f:
+                while True:
+                    try:
+                        chunks.append(len(pickle.load(f)))
+                    except EOFError:
+                        break
+            self.assertEqual(chunks, [36, 36])
+
+            # a write interrupted after the last checkpoint is dropped
+            with open(checkpoint + ".samples", "ab") as f:
+                f.write(b"partial")
+
+            # the global generators are restored from the checkpoint
+            np.random.seed(1)
+            runner = Runner(Experiment(Simulator(), [FlakyPredictor()], Loss()))
+            runner.run(100, batch_size=3, checkpoint=checkpoint, checkpoint_every=20)
+
+        self.assertEqual(runner.get_losses_dict(), expected.get_losses_dict())
+        self.assertEqual(
+            [sample.xt.x for sample in runner.samples],
+            [sample.xt.x for sample in expected.samples],
+        )
+
+    def test_pipelined(self):
+        runs = []
+        for pipelined in [False, True]:
+            np.random.seed(0)
+            runner = Runner(
+                get_experiment(), keep_samples=False, sample_reservoir=10, seed=0
+            )
+            if pipelined:
+                runner.run_pipelined(700, batch_size=30, prefetch=2, workers=2)
+            else:
+                runner.run(700, batch_size=30)
+            runs.append(runner)
+
+        self.assertEqual(
+            [sample.xt.x for sample in runs[1].samples],
+            [sample.xt.x for sample in runs[0].samples],
+        )
+        for name, stats in runs[0].stats.items():
+            self.assertEqual(runs[1].stats[name].count, 700)
+            self.assertEqual(runs[1].stats[name].mean, stats.mean)
+            self.assertEqual(runs[1].stats[name].std, stats.std)
+
+    def test_pipelined_error(self):
+        runner = Runner(Experiment(Simulator(), [FlakyPredictor(fail_at=50)], Loss()))
+        with self.assertRaises(Exception):
+            runner.run_pipelined(100, batch_size=1)
+
+    def test_run_until(self):
+        runner = Runner(get_experiment())
+        self.assertEqual(runner.run_until(5000, resolve=True, step=50), "resolved")
+        self.assertLessEqual(len(runner.samples), 200)
+        self.assertTrue(runner.resolved())
+
+        runner = Runner(get_experiment())
+        self.assertEqual(runner.run_until(5000, ci_width=0.05, step=50), "ci_width")
+        self.assertLess(len(runner.samples), 1000)
+        for stats in runner.stats.values():
+            self.assertLess(2 * stats.moments.halfwidth(0.95), 0.05)
+
+        runner = Runner(get_experiment())
+        self.assertEqual(runner.run_until(200, ci_width=1e-6), "max_samples")
+        self.assertEqual(len(runner.samples), 200)
@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import List, Sequence, Tuple
 
 import numpy as np
 from numpy import ndarray
@@ -52,6 +52,11 @@ class Loss:
     def loss(self, xt: XT, x: X) -> float:
         return np.abs(xt.x - x.x)
 
+    def loss_batch(self, xts: Sequence[XT], xs: Sequence[X]) -> ndarray:
+        xt_array = np.array([xt.x for xt in xts], dtype="double")
+        x_array = np.array([x.x for x in xs], dtype="double")
+        return np.abs(xt_array - x_array)
+
 
 class DumbPredictor:
     """
@@ -8,10 +8,14 @@ from typing import Dict
 
 import h5py
 import matplotlib.pyplot as plt
+import numpy as np
 from matplotlib.axes import Axes
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401 unused import
 from pandas import DataFrame
 
+from petutils.events import EventTable, SensorGeometry
+from petutils.preprocess import preprocess
+
 
 def plot_xyz(ax: Axes, pos: DataFrame, c: str, alpha: float):
     """
@@ -40,23 +44,14 @@ class Plotter:
     def __init__(self, filename: str):
         with h5py.File(filename, "r") as f:
             self.positions = DataFrame(f["MC"]["sensor_positions"][:])
-            hits = DataFrame(f["MC"]["hits"][:])
-            waveforms = DataFrame(f["MC"]["waveforms"][:])
-
-        self.hits: Dict[int, DataFrame] = {}
-        for event_id, df in hits.groupby("event_id"):
-            self.hits[event_id] = df
+            self.hits = EventTable.from_records(f["MC"]["hits"][:])
+            self.waveforms = EventTable.from_records(f["MC"]["waveforms"][:])
 
-        # make x, y, z coordinates easy to access for counts
-        ext_waveforms = waveforms.join(
-            self.positions.set_index("sensor_id"), on="sensor_id"
-        )
+        self.geometry = SensorGeometry.from_dataframe(self.positions)
 
-        self.waveforms: Dict[int, DataFrame] = {}
-        for event_id, df in ext_waveforms.groupby("event_id"):
-            self.waveforms[event_id] = df
-
-        self.event_ids = list(set(self.hits.keys()).intersection(self.waveforms.keys()))
+        self.event_ids = np.intersect1d(
+            self.hits.event_ids, self.waveforms.event_ids
+        ).tolist()
 
     def plot_random_event(self):
         event_id = random.choice(self.event_ids)
@@ -68,10 +63,14 @@ class Plotter:
         plot_xyz(ax, self.positions, c="green", alpha=0.1)
 
         hits = self.hits[event_id]
-        waveforms = self.waveforms[event_id]
+        # resolve x, y, z coordinates of the counts
+        waveforms = self.waveforms.get(event_id)
+        counts = DataFrame(
+            self.geometry.lookup(waveforms["sensor_id"]), columns=["x", "y", "z"]
+        )
 
         plot_xyz(ax, hits, c="red", alpha=1)
-        plot_xyz(ax, waveforms, c="blue", alpha=0.5)
+        plot_xyz(ax, counts, c="blue", alpha=0.5)
 
         plt.show()
 
@@ -96,7 +95,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
-        "command", choices=["plot_rnd", "check_file"], help="command to execute"
+        "command",
+        choices=["plot_rnd", "check_file", "preprocess"],
+        help="command to execute",
     )
 
     parser.add_argument(
@@ -109,6 +110,8 @@ if __name__ == "__main__":
 
     if args.command == "check_file":
         assert check_file(args.hdf5_file)
+    elif args.command == "preprocess":
+        print(preprocess(args.hdf5_file))
     elif args.command == "plot_rnd":
         plotter = Plotter(args.hdf5_file)
         plotter.plot_random_event()